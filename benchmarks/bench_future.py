@@ -0,0 +1,151 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Micro-benchmark of the per-message overhead of the messaging futures.
+
+Each message sent through a Stream creates a Future, puts it in the
+FutureCollection and, when the response arrives, resolves and removes it
+before the caller reads the result. This measures the time taken by that
+cycle and the memory held by each pending future, for the current
+implementation and for the previous RLock/Condition based one.
+
+    PYTHONPATH=. python3 benchmarks/bench_future.py [-n COUNT]
+"""
+
+import argparse
+from threading import Condition
+from threading import RLock
+import time
+import tracemalloc
+
+from sawtooth_sdk.messaging.future import Future
+from sawtooth_sdk.messaging.future import FutureCollection
+from sawtooth_sdk.messaging.future import FutureCollectionKeyError
+from sawtooth_sdk.messaging.future import FutureResult
+
+
+class LockedFuture:
+    """The Future as it was before, for comparison."""
+
+    def __init__(self, correlation_id, request_type=None):
+        self.correlation_id = correlation_id
+        self._result = None
+        self._condition = Condition()
+        self._request_type = request_type
+
+    def result(self, timeout=None):
+        with self._condition:
+            if self._result is None:
+                self._condition.wait(timeout)
+        return self._result
+
+    def set_result(self, result):
+        with self._condition:
+            self._result = result
+            self._condition.notify()
+
+
+class LockedFutureCollection:
+    """The FutureCollection as it was before, for comparison."""
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = RLock()
+
+    def put(self, future):
+        with self._lock:
+            self._futures[future.correlation_id] = future
+
+    def set_result(self, correlation_id, result):
+        with self._lock:
+            future = self.get(correlation_id)
+            future.set_result(result)
+
+    def get(self, correlation_id):
+        with self._lock:
+            if correlation_id not in self._futures:
+                raise FutureCollectionKeyError(correlation_id)
+            return self._futures[correlation_id]
+
+    def remove(self, correlation_id):
+        with self._lock:
+            if correlation_id not in self._futures:
+                raise FutureCollectionKeyError(correlation_id)
+            del self._futures[correlation_id]
+
+    def resolve(self, correlation_id, result):
+        # the two locked operations _receive_message used to perform
+        try:
+            self.set_result(correlation_id, result)
+            self.remove(correlation_id)
+        except FutureCollectionKeyError:
+            return False
+        return True
+
+
+def single_thread(future_class, collection_class, count):
+    collection = collection_class()
+    result = FutureResult(message_type=1, content=b'')
+    ids = [str(i).encode() for i in range(count)]
+
+    start = time.perf_counter()
+    for correlation_id in ids:
+        future = future_class(correlation_id)
+        collection.put(future)
+        collection.resolve(correlation_id, result)
+        future.result()
+    return time.perf_counter() - start
+
+
+def pending_memory(future_class, collection_class, count):
+    """The memory held per future while waiting for its response."""
+    result = FutureResult(message_type=1, content=b'')
+    ids = [str(i).encode() for i in range(count)]
+
+    tracemalloc.start()
+    collection = collection_class()
+    for correlation_id in ids:
+        collection.put(future_class(correlation_id))
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for correlation_id in ids:
+        collection.resolve(correlation_id, result)
+    return held
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    implementations = [
+        ('locked (before)', LockedFuture, LockedFutureCollection),
+        ('lock-free (after)', Future, FutureCollection),
+    ]
+    print('put, resolve and read one future')
+    for label, future_class, collection_class in implementations:
+        elapsed = single_thread(future_class, collection_class, args.count)
+        print('  {:<20} {:8.0f} ns/message'.format(
+            label, elapsed / args.count * 1e9))
+
+    print('memory held per pending future')
+    for label, future_class, collection_class in implementations:
+        held = pending_memory(future_class, collection_class, args.count)
+        print('  {:<20} {:8.0f} bytes/message'.format(
+            label, held / args.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Micro-benchmark of receiving TP_PROCESS_REQUESTs with large payloads.
+
+Each request is sent over an inproc ZMQ socket, received, and parsed as
+the Stream and TransactionProcessor do, and its payload read; first with
+the frame copied, as by default, and then parsed straight from ZMQ's
+memory, as with Stream.set_zero_copy. Transfer over TCP is left out, so
+that only the cost of the receive path itself is measured.
+
+    PYTHONPATH=. python3 benchmarks/bench_receive.py [-n COUNT] [SIZE ...]
+"""
+
+import argparse
+import time
+
+import zmq
+
+# pylint: disable=protected-access
+from sawtooth_sdk.messaging.stream import _parse_frame
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+def make_message(size):
+    request = TpProcessRequest(
+        header=TransactionHeader(
+            family_name='bench',
+            family_version='1.0',
+            inputs=['a' * 70],
+            outputs=['a' * 70]),
+        payload=b'x' * size,
+        signature='s' * 128,
+        context_id='c' * 32)
+    return Message(
+        message_type=Message.TP_PROCESS_REQUEST,
+        correlation_id='bench',
+        content=request.SerializeToString()).SerializeToString()
+
+
+def receive(sender, receiver, message_bytes, count, copy):
+    """Returns the seconds taken to receive and parse count requests."""
+    start = time.perf_counter()
+    for _ in range(count):
+        sender.send(message_bytes, copy=False)
+        frame = receiver.recv(copy=copy)
+        if copy:
+            message = Message()
+            message.ParseFromString(frame)
+        else:
+            message = _parse_frame(frame.buffer)
+        request = TpProcessRequest()
+        request.ParseFromString(message.content)
+        len(request.payload)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=200)
+    parser.add_argument('sizes', metavar='SIZE', type=int, nargs='*',
+                        default=[256, 1 << 20, 8 << 20],
+                        help='sizes of the payloads, in bytes')
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    sender = context.socket(zmq.PAIR)
+    sender.bind('inproc://bench')
+    receiver = context.socket(zmq.PAIR)
+    receiver.connect('inproc://bench')
+    try:
+        for size in args.sizes:
+            message_bytes = make_message(size)
+            # Small messages are repeated more, for a stable timing.
+            count = args.count * max(1, (1 << 16) // size)
+            results = []
+            for copy in (True, False):
+                # the first run warms up the allocator
+                receive(sender, receiver, message_bytes, 10, copy)
+                results.append(receive(
+                    sender, receiver, message_bytes, count, copy) / count)
+            print('{:>10} bytes  copied {:9.1f} us  zero copy {:9.1f} us'
+                  '  ({:.2f}x)'.format(
+                      size, results[0] * 1e6, results[1] * 1e6,
+                      results[0] / results[1]))
+    finally:
+        sender.close(linger=0)
+        receiver.close(linger=0)
+        context.term()
+
+
+if __name__ == '__main__':
+    main()
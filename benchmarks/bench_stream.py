@@ -0,0 +1,146 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Benchmark of request/response throughput through a Stream.
+
+A ROUTER socket on a background thread stands in for the validator and
+answers every message with an empty response carrying the same
+correlation id. Messages are sent one at a time, waiting for each
+response, and pipelined, with up to --window requests outstanding.
+
+    PYTHONPATH=. python3 benchmarks/bench_stream.py [-n COUNT]
+"""
+
+import argparse
+import threading
+import time
+import timeit
+import uuid
+
+import zmq
+
+from sawtooth_sdk.messaging.stream import DEFAULT_MAX_BATCH
+from sawtooth_sdk.messaging.stream import Stream
+from sawtooth_sdk.messaging.stream import _CorrelationIdGenerator
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+class RouterStandIn:
+    """Answers each request on a ROUTER socket until stopped."""
+
+    def __init__(self):
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.ROUTER)
+        self._socket.bind('tcp://127.0.0.1:*')
+        self.url = self._socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join()
+        self._socket.close(linger=0)
+        self._context.term()
+
+    def _run(self):
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        request = Message()
+        while not self._stopped:
+            if not poller.poll(100):
+                continue
+            identity, message_bytes = self._socket.recv_multipart()
+            request.ParseFromString(message_bytes)
+            self._socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.PING_RESPONSE,
+                    correlation_id=request.correlation_id
+                ).SerializeToString()])
+
+
+def sequential(stream, count, content):
+    start = time.perf_counter()
+    for _ in range(count):
+        stream.send(Message.PING_REQUEST, content).result()
+    return time.perf_counter() - start
+
+
+def pipelined(stream, count, content, window):
+    start = time.perf_counter()
+    sent = 0
+    while sent < count:
+        batch = min(window, count - sent)
+        futures = [
+            stream.send(Message.PING_REQUEST, content) for _ in range(batch)
+        ]
+        for future in futures:
+            future.result()
+        sent += batch
+    return time.perf_counter() - start
+
+
+def correlation_ids(count):
+    generate = _CorrelationIdGenerator()
+    return [
+        ('uuid4().hex', timeit.timeit(
+            lambda: uuid.uuid4().hex.encode(), number=count)),
+        ('prefix + counter', timeit.timeit(generate, number=count)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=20000)
+    parser.add_argument('-w', '--window', type=int, default=100)
+    parser.add_argument('-s', '--size', type=int, default=256,
+                        help='size of the message content, in bytes')
+    parser.add_argument('-b', '--max-batch', type=int,
+                        default=DEFAULT_MAX_BATCH,
+                        help='the most messages sent or received per '
+                        'wakeup of the event loop')
+    args = parser.parse_args()
+
+    print('correlation id generation')
+    for label, elapsed in correlation_ids(args.count):
+        print('  {:<20} {:8.0f} ns/id'.format(
+            label, elapsed / args.count * 1e9))
+
+    validator = RouterStandIn()
+    validator.start()
+    stream = Stream(validator.url, max_batch=args.max_batch)
+    content = b'x' * args.size
+    try:
+        # warm up the connection
+        stream.send(Message.PING_REQUEST, content).result(5)
+        for label, elapsed in [
+                ('sequential', sequential(stream, args.count, content)),
+                ('pipelined (window {})'.format(args.window),
+                 pipelined(stream, args.count, content, args.window))]:
+            print('{:<24} {:10.0f} messages/s'.format(
+                label, args.count / elapsed))
+        for name in ('stream_send_batch_size', 'stream_receive_batch_size'):
+            histogram = stream.metrics.histogram(name)
+            print('{:<24} {:10.2f} messages/wakeup'.format(
+                name, histogram.sum / histogram.count))
+    finally:
+        stream.close()
+        validator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,7 @@ import cbor
 from sawtooth_sdk.processor.handler import TransactionHandler
 from sawtooth_sdk.processor.exceptions import InvalidTransaction
 from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.processor.memo import PayloadCache
 
 
 LOGGER = logging.getLogger(__name__)
@@ -45,6 +46,18 @@ def make_intkey_address(name):
 
 
 class IntkeyTransactionHandler(TransactionHandler):
+    """Handles intkey transactions.
+
+    Args:
+        payload_cache (PayloadCache): caches decoded payloads across
+            deliveries of a transaction; defaults to a new PayloadCache
+    """
+
+    def __init__(self, payload_cache=None):
+        if payload_cache is None:
+            payload_cache = PayloadCache()
+        self.payload_cache = payload_cache
+
     # Disable invalid-overridden-method. The sawtooth-sdk expects these to be
     # properties.
     # pylint: disable=invalid-overridden-method
@@ -61,7 +74,8 @@ class IntkeyTransactionHandler(TransactionHandler):
         return [INTKEY_ADDRESS_PREFIX]
 
     def apply(self, transaction, context):
-        verb, name, value = _unpack_transaction(transaction)
+        verb, name, value = self.payload_cache.decode(
+            transaction, _unpack_transaction)
 
         state = _get_state_data(name, context)
 
@@ -13,6 +13,7 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+import os
 import sys
 import argparse
 import pkg_resources
@@ -20,6 +21,8 @@ import pkg_resources
 from sawtooth_intkey.processor.handler import IntkeyTransactionHandler
 
 from sawtooth_sdk.processor.core import TransactionProcessor
+from sawtooth_sdk.processor.memo import PayloadCache
+from sawtooth_sdk.processor.supervisor import TransactionProcessorSupervisor
 from sawtooth_sdk.processor.log import init_console_logging
 from sawtooth_sdk.processor.log import log_configuration
 from sawtooth_sdk.processor.config import get_log_config
@@ -36,7 +39,14 @@ def parse_args(args):
     parser.add_argument(
         '-C', '--connect',
         default='tcp://localhost:4004',
-        help='Endpoint for the validator connection')
+        help='Endpoint for the validator connection, or comma separated '
+        'endpoints of several validators to serve')
+
+    parser.add_argument(
+        '-P', '--processes',
+        type=int,
+        default=1,
+        help='Number of processes to run the transaction processor in')
 
     parser.add_argument('-v', '--verbose',
                         action='count',
@@ -64,7 +74,11 @@ def main(args=None):
     opts = parse_args(args)
     processor = None
     try:
-        processor = TransactionProcessor(url=opts.connect)
+        if opts.processes > 1:
+            processor = TransactionProcessorSupervisor(
+                url=opts.connect.split(','), processes=opts.processes)
+        else:
+            processor = TransactionProcessor(url=opts.connect.split(','))
         log_config = get_log_config(filename="intkey_log_config.toml")
 
         # If no toml, try loading yaml
@@ -75,16 +89,25 @@ def main(args=None):
             log_configuration(log_config=log_config)
         else:
             log_dir = get_log_dir()
-            # use the transaction processor zmq identity for filename
-            log_configuration(
-                log_dir=log_dir,
-                name="intkey-" + str(processor.zmq_id)[2:-1])
+            # use the transaction processor zmq identity for filename; the
+            # workers of a supervisor share one log
+            if opts.processes > 1:
+                name = "intkey-{}".format(os.getpid())
+            else:
+                name = "intkey-" + str(processor.zmq_id)[2:-1]
+            log_configuration(log_dir=log_dir, name=name)
 
         init_console_logging(verbose_level=opts.verbose)
 
         # The prefix should eventually be looked up from the
         # validator's namespace registry.
-        handler = IntkeyTransactionHandler()
+        # Each worker of a supervisor has its own metrics, so the cache is
+        # only instrumented when there is a single process.
+        if opts.processes > 1:
+            payload_cache = PayloadCache()
+        else:
+            payload_cache = PayloadCache(metrics=processor.metrics)
+        handler = IntkeyTransactionHandler(payload_cache=payload_cache)
 
         processor.add_handler(handler)
 
@@ -0,0 +1,340 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Benchmarks a transaction handler without a validator.
+
+Generated TpProcessRequests are applied one after another by the handler
+against a LocalContext, and the throughput, latency and memory allocated
+by the handler are reported. The changes of valid transactions are
+committed, so that each transaction sees the state left by the ones before
+it, as it would in a block.
+
+Handlers and generators are named as module:attribute. A generator is
+called with the number of transactions wanted, and returns an iterable of
+TpProcessRequests.
+"""
+
+import argparse
+from collections import Counter
+import hashlib
+import importlib
+import logging
+import sys
+import time
+import tracemalloc
+
+import cbor
+
+from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from sawtooth_processor_test.local_context import LocalContext
+from sawtooth_processor_test.local_context import LocalState
+from sawtooth_processor_test.merkle import LmdbNodeStore
+from sawtooth_processor_test.merkle import MerkleTree
+
+
+LOGGER = logging.getLogger(__name__)
+
+_SIGNERS = ['02' + hashlib.sha256(name).hexdigest() for name in (b'1', b'2')]
+
+_INTKEY_NAMESPACE = hashlib.sha512(b'intkey').hexdigest()[:6]
+_XO_NAMESPACE = hashlib.sha512(b'xo').hexdigest()[:6]
+
+# The handlers and generators that can be named without a module.
+WORKLOADS = {
+    'intkey': ('sawtooth_intkey.processor.handler:IntkeyTransactionHandler',
+               'sawtooth_processor_test.bench:intkey_transactions'),
+    'xo': ('sawtooth_xo.processor.handler:XoTransactionHandler',
+           'sawtooth_processor_test.bench:xo_transactions'),
+}
+
+
+def make_request(family_name, family_version, payload, inputs, outputs,
+                 signer=_SIGNERS[0], nonce=''):
+    """Returns a TpProcessRequest as the validator would send it."""
+    header = TransactionHeader(
+        family_name=family_name,
+        family_version=family_version,
+        inputs=inputs,
+        outputs=outputs,
+        signer_public_key=signer,
+        batcher_public_key=signer,
+        nonce=nonce,
+        payload_sha512=hashlib.sha512(payload).hexdigest())
+    header_bytes = header.SerializeToString()
+    return TpProcessRequest(
+        header=header,
+        payload=payload,
+        signature=hashlib.sha512(header_bytes).hexdigest(),
+        context_id='bench')
+
+
+def intkey_transactions(count):
+    """Sets a key for each of the first half of the transactions, then
+    increments the keys in turn.
+    """
+    keys = max(1, count // 2)
+    for i in range(count):
+        name = 'key{}'.format(i % keys)
+        if i < keys:
+            content = {'Verb': 'set', 'Name': name, 'Value': i}
+        else:
+            content = {'Verb': 'inc', 'Name': name, 'Value': 1}
+        address = _INTKEY_NAMESPACE + hashlib.sha512(
+            name.encode()).hexdigest()[-64:]
+        yield make_request(
+            'intkey', '1.0', cbor.dumps(content), [address], [address],
+            nonce=str(i))
+
+
+def xo_transactions(count):
+    """Plays games of xo between two signers, each game being a create,
+    the five takes of a win for the first player, and a delete.
+    """
+    moves = ['create']
+    moves.extend('take,{}'.format(space) for space in (1, 2, 4, 5, 7))
+    moves.append('delete')
+    for i in range(count):
+        game, move = divmod(i, len(moves))
+        name = 'game{}'.format(game)
+        action = moves[move]
+        if ',' not in action:
+            action += ','
+        address = _XO_NAMESPACE + hashlib.sha512(
+            name.encode()).hexdigest()[:64]
+        # The takes alternate between the players, starting with the first.
+        signer = _SIGNERS[(move - 1) % 2] if move else _SIGNERS[0]
+        yield make_request(
+            'xo', '1.0', '{},{}'.format(name, action).encode(), [address],
+            [address], signer=signer, nonce=str(i))
+
+
+class BenchReport:
+    """The results of a benchmark.
+
+    Attributes:
+        latencies (list): the seconds taken by each call to apply, sorted
+        elapsed (float): the seconds taken by all of the calls
+        statuses (Counter): the number of transactions of each
+            TpProcessResponse status
+        peak_memory (int): the most bytes allocated by the handler at once,
+            or None if allocations were not traced
+        retained_memory (int): the bytes allocated by the handler and not
+            yet freed at the end, or None if allocations were not traced
+    """
+
+    def __init__(self, latencies, elapsed, statuses, peak_memory=None,
+                 retained_memory=None):
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+        self.statuses = statuses
+        self.peak_memory = peak_memory
+        self.retained_memory = retained_memory
+
+    @property
+    def throughput(self):
+        """Transactions per second."""
+        if not self.elapsed:
+            return 0.0
+        return len(self.latencies) / self.elapsed
+
+    def percentile(self, percent):
+        """The latency below which percent of the transactions completed,
+        by the nearest-rank method.
+        """
+        if not self.latencies:
+            return 0.0
+        rank = max(1, -(-len(self.latencies) * percent // 100))
+        return self.latencies[int(rank) - 1]
+
+    def format(self):
+        lines = [
+            'transactions:  {}'.format(len(self.latencies)),
+            'elapsed:       {:.3f}s'.format(self.elapsed),
+            'throughput:    {:.1f} transactions/s'.format(self.throughput),
+        ]
+        for percent in (50, 99):
+            lines.append('latency p{:<3}   {:.3f}ms'.format(
+                percent, self.percentile(percent) * 1000))
+        for status, count in sorted(self.statuses.items()):
+            lines.append('{:<14} {}'.format(
+                TpProcessResponse.Status.Name(status).lower() + ':', count))
+        if self.peak_memory is not None:
+            transactions = max(1, len(self.latencies))
+            lines.append('peak memory:   {} bytes'.format(self.peak_memory))
+            lines.append('retained:      {:.1f} bytes/transaction'.format(
+                self.retained_memory / transactions))
+        return '\n'.join(lines)
+
+
+def run_benchmark(handler, transactions, state=None):
+    """Applies each transaction with handler, committing the changes of
+    those that are valid.
+
+    Args:
+        handler (TransactionHandler): the handler to benchmark
+        transactions (iterable): the TpProcessRequests to apply
+        state (LocalState): the state to run against; defaults to an empty
+            one
+
+    Returns:
+        (BenchReport): the results, without memory
+    """
+    if state is None:
+        state = LocalState()
+    latencies = []
+    statuses = Counter()
+    start = time.perf_counter()
+    for transaction in transactions:
+        context = LocalContext.for_transaction(state, transaction)
+        applied = time.perf_counter()
+        try:
+            handler.apply(transaction, context)
+        except InvalidTransaction as err:
+            status = TpProcessResponse.INVALID_TRANSACTION
+            LOGGER.debug('Invalid transaction: %s', err)
+        except InternalError as err:
+            status = TpProcessResponse.INTERNAL_ERROR
+            LOGGER.debug('Internal error: %s', err)
+        else:
+            status = TpProcessResponse.OK
+            context.commit()
+        latencies.append(time.perf_counter() - applied)
+        statuses[status] += 1
+    return BenchReport(latencies, time.perf_counter() - start, statuses)
+
+
+def trace_memory(handler, transactions, state=None):
+    """Runs the benchmark with allocations traced by tracemalloc, which
+    slows it too much for its timings to be useful.
+
+    Returns:
+        (tuple): the peak and retained bytes allocated by the handler
+    """
+    # The transactions are generated before tracing, so that only the
+    # handler's allocations are counted.
+    transactions = list(transactions)
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        run_benchmark(handler, transactions, state)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - base, current - base
+
+
+def prefill(state, namespace, count, batch_size=10000):
+    """Sets count addresses in namespace, so that a benchmark runs against
+    state of a realistic size.
+    """
+    suffix_length = 70 - len(namespace)
+    for start in range(0, count, batch_size):
+        state.apply({
+            namespace + hashlib.sha512(
+                'prefill{}'.format(i).encode()).hexdigest()[:suffix_length]:
+            hashlib.sha256(str(i).encode()).digest()
+            for i in range(start, min(count, start + batch_size))
+        })
+
+
+def load(name):
+    """Returns the attribute named by module:attribute."""
+    module_name, _, attribute = name.partition(':')
+    if not attribute:
+        raise ValueError('{} is not of the form module:attribute'.format(
+            name))
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks a transaction handler against in-memory '
+        'state, without a validator.')
+    parser.add_argument(
+        'handler',
+        help='intkey, xo, or the module:class of a handler, which is '
+        'constructed without arguments')
+    parser.add_argument(
+        '-g', '--generator',
+        help='the module:function generating the transactions; required '
+        'unless the handler is intkey or xo')
+    parser.add_argument(
+        '-n', '--count',
+        type=int,
+        default=10000,
+        help='the number of transactions to apply')
+    parser.add_argument(
+        '-m', '--memory',
+        action='store_true',
+        help='also trace the memory allocated, in a second run')
+    parser.add_argument(
+        '--merkle',
+        action='store_true',
+        help='keep state in a Merkle-Radix tree, and report its root')
+    parser.add_argument(
+        '--lmdb',
+        metavar='PATH',
+        help='keep the Merkle-Radix tree in an LMDB file; implies --merkle')
+    parser.add_argument(
+        '--prefill',
+        type=int,
+        default=0,
+        help='the number of addresses set in the handler\'s namespace '
+        'before the run')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+
+    handler_name, generator_name = WORKLOADS.get(
+        opts.handler, (opts.handler, opts.generator))
+    if opts.generator is not None:
+        generator_name = opts.generator
+    if generator_name is None:
+        raise SystemExit('A generator is required for {}'.format(
+            opts.handler))
+    handler_class = load(handler_name)
+    generator = load(generator_name)
+
+    def make_state():
+        if opts.lmdb:
+            state = MerkleTree(LmdbNodeStore(opts.lmdb))
+        elif opts.merkle:
+            state = MerkleTree()
+        else:
+            state = LocalState()
+        if opts.prefill:
+            prefill(state, handler_class().namespaces[0], opts.prefill)
+        return state
+
+    state = make_state()
+    # The transactions are generated before the run, so that generating
+    # them is not timed.
+    report = run_benchmark(
+        handler_class(), list(generator(opts.count)), state)
+    if opts.memory:
+        report.peak_memory, report.retained_memory = trace_memory(
+            handler_class(), generator(opts.count), make_state())
+    print(report.format())
+    if isinstance(state, MerkleTree):
+        print('state root:    {}'.format(state.root))
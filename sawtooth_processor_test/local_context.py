@@ -0,0 +1,201 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import re
+
+from sawtooth_sdk.processor.context import ContextFuture
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.protobuf.events_pb2 import Event
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
+
+
+_ADDRESS = re.compile('^[0-9a-f]{70}$')
+
+
+class LocalState:
+    """State held in a dict, for use with LocalContext.
+
+    Any object with the get and apply methods of this class may be used
+    as the state of a LocalContext.
+    """
+
+    def __init__(self, data=None):
+        """
+        Args:
+            data (dict): the initial data, by address
+        """
+        self._data = dict(data) if data is not None else {}
+
+    def get(self, address):
+        """Returns the data at address, or None if it is unset."""
+        return self._data.get(address)
+
+    def apply(self, changes):
+        """Applies the changes of a transaction.
+
+        Args:
+            changes (dict): the data to set at each address, or None to
+                delete it
+        """
+        for address, data in changes.items():
+            if data is None:
+                self._data.pop(address, None)
+            else:
+                self._data[address] = data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(sorted(self._data.items()))
+
+
+class LocalContext:
+    """A Context for running a transaction handler without a validator.
+
+    It has the same methods as sawtooth_sdk.processor.context.Context, and
+    checks addresses as the validator does: an address may only be read if
+    it starts with one of the transaction's inputs, and only be set or
+    deleted if it starts with one of its outputs.
+
+    The changes made through the context are not applied to the state
+    until commit is called, which the caller does only if the transaction
+    is valid.
+
+    Attributes:
+        changes (dict): the data set at each address, or None for the
+            addresses deleted
+        receipt_data (list): the data added to the receipt
+        events (list): the events_pb2.Events added
+    """
+
+    def __init__(self, state, inputs, outputs):
+        """
+        Args:
+            state (LocalState): the state the transaction runs against
+            inputs (list): the addresses or address prefixes the
+                transaction may read
+            outputs (list): the addresses or address prefixes the
+                transaction may set or delete
+        """
+        self._state = state
+        self._inputs = tuple(inputs)
+        self._outputs = tuple(outputs)
+        self.changes = {}
+        self.receipt_data = []
+        self.events = []
+
+    @classmethod
+    def for_transaction(cls, state, transaction):
+        """Returns a LocalContext for a TpProcessRequest, authorized by the
+        inputs and outputs of its header.
+        """
+        header = transaction.header
+        return cls(state, header.inputs, header.outputs)
+
+    def commit(self):
+        """Applies the changes made through the context to its state."""
+        self._state.apply(self.changes)
+
+    def get_state(self, addresses, timeout=None):
+        """See Context.get_state."""
+        # pylint: disable=unused-argument
+        _check(addresses, self._inputs, 'get')
+        entries = []
+        for address in addresses:
+            if address in self.changes:
+                data = self.changes[address]
+            else:
+                data = self._state.get(address)
+            if data:
+                entries.append(TpStateEntry(address=address, data=data))
+        return entries
+
+    def set_state(self, entries, timeout=None):
+        """See Context.set_state."""
+        # pylint: disable=unused-argument
+        _check(entries, self._outputs, 'set')
+        for address in entries:
+            if not _ADDRESS.match(address):
+                raise InternalError(
+                    'Invalid address: {}'.format(address))
+        self.changes.update(entries)
+        return list(entries)
+
+    def delete_state(self, addresses, timeout=None):
+        """See Context.delete_state."""
+        # pylint: disable=unused-argument
+        _check(addresses, self._outputs, 'delete')
+        deleted = [
+            address for address in addresses
+            if (self.changes[address] if address in self.changes
+                else self._state.get(address))
+        ]
+        for address in addresses:
+            self.changes[address] = None
+        return deleted
+
+    def add_receipt_data(self, data, timeout=None):
+        """See Context.add_receipt_data."""
+        # pylint: disable=unused-argument
+        self.receipt_data.append(data)
+
+    def add_event(self, event_type, attributes=None, data=None, timeout=None):
+        """See Context.add_event."""
+        # pylint: disable=unused-argument
+        if attributes is None:
+            attributes = []
+        self.events.append(Event(
+            event_type=event_type,
+            attributes=[
+                Event.Attribute(key=key, value=value)
+                for key, value in attributes
+            ],
+            data=data))
+
+    def get_state_async(self, addresses):
+        """See Context.get_state_async."""
+        return _completed(self.get_state, addresses)
+
+    def set_state_async(self, entries):
+        """See Context.set_state_async."""
+        return _completed(self.set_state, entries)
+
+    def delete_state_async(self, addresses):
+        """See Context.delete_state_async."""
+        return _completed(self.delete_state, addresses)
+
+    def add_receipt_data_async(self, data):
+        """See Context.add_receipt_data_async."""
+        return _completed(self.add_receipt_data, data)
+
+    def add_event_async(self, event_type, attributes=None, data=None):
+        """See Context.add_event_async."""
+        return _completed(self.add_event, event_type, attributes, data)
+
+
+def _check(addresses, prefixes, verb):
+    for address in addresses:
+        if not address.startswith(prefixes):
+            raise AuthorizationException(
+                'Tried to {} unauthorized address: {}'.format(verb, address))
+
+
+def _completed(method, *args):
+    try:
+        return ContextFuture(result=method(*args))
+    except (AuthorizationException, InternalError) as err:
+        return ContextFuture(error=err)
@@ -0,0 +1,396 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""A Merkle-Radix tree computing the same state roots as the validator.
+
+As in the validator, an address is a path of 35 tokens of two hex
+characters, and each node is a map of "v", the data at a leaf or None, and
+"c", each child's token to its hash. A node is hashed as the first 64 hex
+characters of the SHA-512 of its canonical CBOR encoding, with keys sorted.
+Nodes are only ever added to the store, so every earlier root remains
+readable.
+"""
+
+import hashlib
+import struct
+
+try:
+    import lmdb
+except ImportError:
+    # lmdb is only needed when the tree is kept on disk.
+    lmdb = None
+
+
+_TOKEN_SIZE = 2
+
+_MAJOR_BYTES = 2
+_MAJOR_TEXT = 3
+_MAJOR_MAP = 5
+_NULL = 0xf6
+
+
+def _head(major, length):
+    """Returns the CBOR initial bytes of an item of major type and length.
+    """
+    major <<= 5
+    if length < 24:
+        return bytes([major | length])
+    if length < 0x100:
+        return bytes([major | 24, length])
+    if length < 0x10000:
+        return struct.pack('>BH', major | 25, length)
+    if length < 0x100000000:
+        return struct.pack('>BI', major | 26, length)
+    return struct.pack('>BQ', major | 27, length)
+
+
+# The heads of text strings and of maps of up to 256 entries, as latin-1
+# text, by length. Tokens and hashes are hex, so all of a node but its
+# value is built as text, and then encoded as latin-1, which maps each
+# character to the byte of its code point.
+_TEXT_HEADS = [
+    _head(_MAJOR_TEXT, length).decode('latin-1') for length in range(0x100)
+]
+_MAP_HEADS = [
+    _head(_MAJOR_MAP, length).decode('latin-1') for length in range(0x101)
+]
+
+# The head of a node and its "c" key.
+_NODE_START = _MAP_HEADS[2] + _TEXT_HEADS[1] + 'c'
+_V = _TEXT_HEADS[1] + 'v'
+_NULL_BYTES = bytes([_NULL])
+
+
+def encode_node(node):
+    """Returns the canonical CBOR encoding of a node, as cbor.dumps(node,
+    sort_keys=True) would in the validator.
+    """
+    children = node['c']
+    text = ''.join([_NODE_START, _MAP_HEADS[len(children)]] + [
+        _TEXT_HEADS[len(token)] + token
+        + _TEXT_HEADS[len(children[token])] + children[token]
+        for token in sorted(children)
+    ] + [_V]).encode('latin-1')
+    value = node['v']
+    if value is None:
+        return text + _NULL_BYTES
+    return text + _head(_MAJOR_BYTES, len(value)) + value
+
+
+def decode_node(data):
+    """Returns the node encoded by encode_node."""
+    node, _ = _decode(memoryview(data), 0)
+    return node
+
+
+def _decode(data, pos):
+    initial = data[pos]
+    pos += 1
+    if initial == _NULL:
+        return None, pos
+    major, length = initial >> 5, initial & 0x1f
+    if length >= 24:
+        size = 1 << (length - 24)
+        length = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    if major == _MAJOR_MAP:
+        decoded = {}
+        for _ in range(length):
+            key, pos = _decode(data, pos)
+            decoded[key], pos = _decode(data, pos)
+        return decoded, pos
+    if major == _MAJOR_BYTES:
+        return bytes(data[pos:pos + length]), pos + length
+    if major == _MAJOR_TEXT:
+        return str(data[pos:pos + length], 'utf-8'), pos + length
+    raise ValueError('Unexpected CBOR major type {}'.format(major))
+
+
+def _hash(encoded):
+    return hashlib.sha512(encoded).hexdigest()[:64]
+
+
+_EMPTY_NODE = {'v': None, 'c': {}}
+_EMPTY_ENCODED = encode_node(_EMPTY_NODE)
+
+# The state root of a tree with no leaves.
+EMPTY_ROOT = _hash(_EMPTY_ENCODED)
+
+
+class MemoryNodeStore:
+    """Holds the nodes of a MerkleTree in a dict, decoded, so that reading
+    a node costs no more than a dict lookup.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+
+    def get(self, node_hash):
+        """Returns the node with the hash.
+
+        Raises:
+            KeyError: if there is no such node
+        """
+        return self._nodes[node_hash]
+
+    def put(self, nodes):
+        """Adds nodes, a list of (hash, encoded node, node)."""
+        for node_hash, _, node in nodes:
+            self._nodes[node_hash] = node
+
+    def __contains__(self, node_hash):
+        return node_hash in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+class LmdbNodeStore:
+    """Holds the nodes of a MerkleTree, encoded, in an LMDB file, which is
+    memory-mapped, so that trees too large for memory can be used.
+
+    Requires the lmdb package, installed with the sawtooth-sdk[lmdb]
+    extra.
+
+    Args:
+        path (str): the file, which is created if it does not exist
+        map_size (int): the most bytes the file may grow to
+
+    Raises:
+        ImportError: if the lmdb package is not installed
+    """
+
+    def __init__(self, path, map_size=1 << 40):
+        if lmdb is None:
+            raise ImportError("LmdbNodeStore requires the lmdb package")
+        self._env = lmdb.open(
+            path, map_size=map_size, subdir=False, lock=False,
+            writemap=True, map_async=True, metasync=False, sync=False)
+
+    def get(self, node_hash):
+        """Returns the node with the hash.
+
+        Raises:
+            KeyError: if there is no such node
+        """
+        with self._env.begin(buffers=True) as txn:
+            encoded = txn.get(node_hash.encode())
+            if encoded is None:
+                raise KeyError(node_hash)
+            return decode_node(encoded)
+
+    def put(self, nodes):
+        """Adds nodes, a list of (hash, encoded node, node), in one
+        transaction.
+        """
+        with self._env.begin(write=True) as txn:
+            for node_hash, encoded, _ in nodes:
+                txn.put(node_hash.encode(), encoded, overwrite=False)
+
+    def __contains__(self, node_hash):
+        with self._env.begin() as txn:
+            return txn.get(node_hash.encode()) is not None
+
+    def __len__(self):
+        return self._env.stat()['entries']
+
+    def sync(self):
+        """Flushes the file to disk."""
+        self._env.sync(True)
+
+    def close(self):
+        self._env.close()
+
+
+class MerkleTree:
+    """A Merkle-Radix tree of state, for use as the state of a
+    LocalContext.
+
+    The tree is at one state root at a time. Updating it adds the nodes of
+    the new root to the store and moves the tree to it; set_root moves it
+    back to any earlier root, to simulate forks.
+
+    Args:
+        store (MemoryNodeStore): where the nodes are kept; defaults to a
+            new MemoryNodeStore
+        root (str): the root to start at; defaults to EMPTY_ROOT
+    """
+
+    def __init__(self, store=None, root=EMPTY_ROOT):
+        self._store = store if store is not None else MemoryNodeStore()
+        if EMPTY_ROOT not in self._store:
+            self._store.put([(EMPTY_ROOT, _EMPTY_ENCODED, _EMPTY_NODE)])
+        self._root = EMPTY_ROOT
+        self.set_root(root)
+
+    @property
+    def root(self):
+        """The current state root."""
+        return self._root
+
+    def set_root(self, root):
+        """Moves the tree to another root in its store.
+
+        Raises:
+            KeyError: if the store has no such root
+        """
+        self._store.get(root)
+        self._root = root
+
+    def get(self, address):
+        """Returns the data at address, or None if it is unset."""
+        node = self._store.get(self._root)
+        for start in range(0, len(address), _TOKEN_SIZE):
+            child = node['c'].get(address[start:start + _TOKEN_SIZE])
+            if child is None:
+                return None
+            node = self._store.get(child)
+        return node['v']
+
+    def leaves(self, prefix=''):
+        """Yields the (address, data) of each leaf whose address starts
+        with prefix, in order of address.
+        """
+        node = self._store.get(self._root)
+        path = ''
+        # Descends to the node of the longest whole-token part of prefix.
+        while len(path) + _TOKEN_SIZE <= len(prefix):
+            token = prefix[len(path):len(path) + _TOKEN_SIZE]
+            child = node['c'].get(token)
+            if child is None:
+                return
+            node = self._store.get(child)
+            path += token
+        stack = [(path, node)]
+        while stack:
+            path, node = stack.pop()
+            if node['v'] is not None:
+                yield path, node['v']
+            for token in sorted(node['c'], reverse=True):
+                child_path = path + token
+                if child_path.startswith(prefix) or \
+                        prefix.startswith(child_path):
+                    stack.append(
+                        (child_path, self._store.get(node['c'][token])))
+
+    def __iter__(self):
+        return self.leaves()
+
+    def update(self, set_items, delete_items=(), virtual=False):
+        """Computes the root after setting and deleting addresses, as the
+        validator does for a batch of changes.
+
+        Args:
+            set_items (dict): the data to set at each address
+            delete_items (iterable): the addresses to delete
+            virtual (bool): if True, only the root is computed; the store
+                and the tree's root are unchanged
+
+        Returns:
+            (str): the new state root
+
+        Raises:
+            KeyError: if an address to delete is not set
+        """
+        path_map = {'': self._copy(self._root)}
+        for address in sorted(set_items):
+            self._load_path(address, path_map)
+            path_map[address]['v'] = set_items[address]
+
+        delete_items = sorted(set(delete_items))
+        for address in delete_items:
+            if not self._load_path(address, path_map):
+                raise KeyError(address)
+        for address in delete_items:
+            del path_map[address]
+            branch = address
+            parent = branch[:-_TOKEN_SIZE]
+            while True:
+                children = path_map[parent]['c']
+                del children[branch[-_TOKEN_SIZE:]]
+                if children or not parent:
+                    break
+                del path_map[parent]
+                branch = parent
+                parent = branch[:-_TOKEN_SIZE]
+
+        nodes = []
+        # Deepest first, so that each node is hashed after its children.
+        for path in sorted(path_map, key=len, reverse=True):
+            node = path_map[path]
+            encoded = encode_node(node)
+            node_hash = _hash(encoded)
+            nodes.append((node_hash, encoded, node))
+            if path:
+                path_map[path[:-_TOKEN_SIZE]]['c'][
+                    path[-_TOKEN_SIZE:]] = node_hash
+
+        root = nodes[-1][0]
+        if not virtual:
+            self._store.put(nodes)
+            self._root = root
+        return root
+
+    def apply(self, changes):
+        """Applies the changes of a transaction, as LocalState.apply does,
+        and moves the tree to the new root.
+
+        Args:
+            changes (dict): the data to set at each address, or None to
+                delete it
+
+        Returns:
+            (str): the new state root
+        """
+        set_items = {}
+        delete_items = []
+        for address, data in changes.items():
+            if data is not None:
+                set_items[address] = data
+            elif self.get(address) is not None:
+                delete_items.append(address)
+        return self.update(set_items, delete_items)
+
+    def _copy(self, node_hash):
+        node = self._store.get(node_hash)
+        return {'v': node['v'], 'c': dict(node['c'])}
+
+    def _load_path(self, address, path_map):
+        """Adds copies of the nodes on the path to address to path_map,
+        with new nodes where there are none.
+
+        Returns:
+            (bool): whether there is data at address
+        """
+        length = len(address)
+        end = _TOKEN_SIZE
+        # Skips the part of the path loaded for an earlier address.
+        while end <= length and address[:end] in path_map:
+            end += _TOKEN_SIZE
+        node = path_map[address[:end - _TOKEN_SIZE]]
+        while end <= length:
+            child = node['c'].get(address[end - _TOKEN_SIZE:end])
+            if child is None:
+                break
+            node = self._copy(child)
+            path_map[address[:end]] = node
+            end += _TOKEN_SIZE
+        while end <= length:
+            # The new node's hash is filled in once it is known, but the
+            # entry keeps deletes from pruning its parent.
+            node['c'][address[end - _TOKEN_SIZE:end]] = None
+            node = {'v': None, 'c': {}}
+            path_map[address[:end]] = node
+            end += _TOKEN_SIZE
+        return path_map[address]['v'] is not None
@@ -0,0 +1,372 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Replays a capture written by TransactionProcessor.enable_capture to a
+transaction processor, standing in for the validator, and reports the
+throughput and latency of the processor.
+
+The processor is sent the captured TP_PROCESS_REQUESTs, and each state,
+receipt or event request it makes is answered with the response captured
+for the identical request. A request that was not captured is answered
+with an empty response, which the processor's Context reports as an
+error.
+"""
+
+import argparse
+from collections import defaultdict
+from collections import deque
+from collections import namedtuple
+import itertools
+import logging
+import sys
+import time
+
+import zmq
+
+from sawtooth_sdk.messaging.capture import INBOUND
+from sawtooth_sdk.messaging.capture import OUTBOUND
+from sawtooth_sdk.messaging.capture import read_capture
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
+from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterResponse
+from sawtooth_sdk.protobuf.processor_pb2 import TpUnregisterResponse
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+LOGGER = logging.getLogger(__name__)
+
+_RESPONSE_TYPES = {
+    Message.TP_STATE_GET_REQUEST: Message.TP_STATE_GET_RESPONSE,
+    Message.TP_STATE_SET_REQUEST: Message.TP_STATE_SET_RESPONSE,
+    Message.TP_STATE_DELETE_REQUEST: Message.TP_STATE_DELETE_RESPONSE,
+    Message.TP_RECEIPT_ADD_DATA_REQUEST:
+        Message.TP_RECEIPT_ADD_DATA_RESPONSE,
+    Message.TP_EVENT_ADD_REQUEST: Message.TP_EVENT_ADD_RESPONSE,
+}
+
+CapturedTransaction = namedtuple(
+    'CapturedTransaction', ['time', 'request', 'status'])
+
+
+class Capture:
+    """The transactions in a capture file, and the responses to the
+    requests made while processing them.
+
+    Attributes:
+        transactions (list): a CapturedTransaction for each
+            TP_PROCESS_REQUEST, in the order received; status is the
+            TpProcessResponse status the processor responded with, or None
+        responses (dict): (message type, content) of each request to a
+            deque of the contents of the responses it was given
+    """
+
+    def __init__(self, path):
+        requests = {}
+        statuses = {}
+        self.transactions = []
+        self.responses = defaultdict(deque)
+        for record in read_capture(path):
+            message = record.message
+            if record.direction == INBOUND:
+                if message.message_type == Message.TP_PROCESS_REQUEST:
+                    self.transactions.append((record.time, message))
+                elif message.correlation_id in requests:
+                    self.responses[
+                        requests.pop(message.correlation_id)
+                    ].append(message.content)
+            elif record.direction == OUTBOUND:
+                if message.message_type == Message.TP_PROCESS_RESPONSE:
+                    response = TpProcessResponse()
+                    response.ParseFromString(message.content)
+                    statuses[message.correlation_id] = response.status
+                elif message.message_type in _RESPONSE_TYPES:
+                    requests[message.correlation_id] = (
+                        message.message_type, message.content)
+        self.transactions = [
+            CapturedTransaction(
+                offset, request, statuses.get(request.correlation_id))
+            for offset, request in self.transactions
+        ]
+
+    def response(self, message_type, content):
+        """Returns the captured response content for a request, or None.
+        When an identical request was made several times, the responses are
+        returned in turn, and the last one is repeated.
+        """
+        responses = self.responses.get((message_type, content))
+        if not responses:
+            return None
+        if len(responses) > 1:
+            return responses.popleft()
+        return responses[0]
+
+
+class ReplayReport:
+    """The results of a replay.
+
+    Attributes:
+        latencies (list): the seconds from sending each request to
+            receiving its response, sorted
+        elapsed (float): the seconds from the first request to the last
+            response
+        mismatched (int): the number of responses whose status differed
+            from the captured status
+        unanswered (int): the number of requests made by the processor
+            that were not in the capture
+    """
+
+    def __init__(self, latencies, elapsed, mismatched, unanswered):
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+        self.mismatched = mismatched
+        self.unanswered = unanswered
+
+    @property
+    def throughput(self):
+        """Transactions per second."""
+        if not self.elapsed:
+            return 0.0
+        return len(self.latencies) / self.elapsed
+
+    def percentile(self, percent):
+        """The latency below which percent of the transactions completed,
+        by the nearest-rank method.
+        """
+        if not self.latencies:
+            return 0.0
+        rank = max(1, -(-len(self.latencies) * percent // 100))
+        return self.latencies[int(rank) - 1]
+
+    def format(self):
+        lines = [
+            'transactions:  {}'.format(len(self.latencies)),
+            'elapsed:       {:.3f}s'.format(self.elapsed),
+            'throughput:    {:.1f} transactions/s'.format(self.throughput),
+        ]
+        for percent in (50, 90, 99, 100):
+            lines.append('latency p{:<3}   {:.3f}ms'.format(
+                percent, self.percentile(percent) * 1000))
+        lines.append('status changed: {}'.format(self.mismatched))
+        lines.append('not captured:  {}'.format(self.unanswered))
+        return '\n'.join(lines)
+
+
+class Replayer:
+    """Binds a ROUTER socket for a transaction processor to connect to, as
+    it would to a validator, and replays a capture to it.
+
+    Args:
+        capture (Capture): what to replay
+        url (str): the endpoint to bind; a port of * picks a free port,
+            available from the url attribute
+    """
+
+    def __init__(self, capture, url='tcp://127.0.0.1:4004'):
+        self._capture = capture
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.ROUTER)
+        self._socket.bind(url)
+        self.url = self._socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self._poller = zmq.Poller()
+        self._poller.register(self._socket, zmq.POLLIN)
+        self._connection = None
+        self._correlation_ids = ('replay-{}'.format(i)
+                                 for i in itertools.count())
+
+    def close(self):
+        self._socket.close(linger=0)
+        self._context.term()
+
+    def wait_for_processor(self, timeout=None, settle=0.5):
+        """Waits for a processor to register, then for it to finish
+        registering each of its families.
+
+        Raises:
+            TimeoutError: if no processor registers within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._connection is None:
+            remaining = None if deadline is None \
+                else max(0, deadline - time.monotonic())
+            if remaining == 0 or not self._poll(remaining):
+                raise TimeoutError('No transaction processor registered')
+            self._handle(self._recv(), {})
+        while self._poll(settle):
+            self._handle(self._recv(), {})
+
+    def run(self, speed='max', window=1):
+        """Sends the captured transactions and waits for their responses.
+
+        Args:
+            speed (str): 'original' sends each transaction at the same
+                offset from the first as when it was captured; 'max' sends
+                them as fast as the processor responds
+            window (int): the most transactions outstanding at once when
+                speed is 'max'
+        Returns:
+            (ReplayReport): the results
+        """
+        transactions = self._capture.transactions
+        pending = {}
+        latencies = []
+        counts = {'mismatched': 0, 'unanswered': 0}
+        sent = 0
+        start = time.monotonic()
+        while sent < len(transactions) or pending:
+            if sent < len(transactions):
+                if speed == 'original':
+                    due = start + transactions[sent].time \
+                        - transactions[0].time
+                    ready = time.monotonic() >= due
+                    timeout = max(0, due - time.monotonic())
+                else:
+                    ready = len(pending) < window
+                    timeout = None if not ready else 0
+                if ready:
+                    self._send_transaction(transactions[sent], pending)
+                    sent += 1
+                    continue
+            else:
+                timeout = None
+            if self._poll(timeout):
+                message = self._recv()
+                if message.message_type == Message.TP_PROCESS_RESPONSE:
+                    self._complete(message, pending, latencies, counts)
+                else:
+                    self._handle(message, counts)
+        return ReplayReport(
+            latencies, time.monotonic() - start,
+            counts['mismatched'], counts['unanswered'])
+
+    def _send_transaction(self, transaction, pending):
+        correlation_id = next(self._correlation_ids)
+        pending[correlation_id] = (time.monotonic(), transaction)
+        self._send(
+            Message.TP_PROCESS_REQUEST, correlation_id,
+            transaction.request.content)
+
+    @staticmethod
+    def _complete(message, pending, latencies, counts):
+        try:
+            sent, transaction = pending.pop(message.correlation_id)
+        except KeyError:
+            LOGGER.warning(
+                'Response to unknown request %s', message.correlation_id)
+            return
+        latencies.append(time.monotonic() - sent)
+        response = TpProcessResponse()
+        response.ParseFromString(message.content)
+        if transaction.status is not None and \
+                response.status != transaction.status:
+            counts['mismatched'] += 1
+            LOGGER.warning(
+                'Transaction %s was %s, but is now %s: %s',
+                transaction.request.correlation_id,
+                TpProcessResponse.Status.Name(transaction.status),
+                TpProcessResponse.Status.Name(response.status),
+                response.message)
+
+    def _handle(self, message, counts):
+        """Answers a message from the processor other than a response to a
+        transaction.
+        """
+        message_type = message.message_type
+        if message_type == Message.TP_REGISTER_REQUEST:
+            self._send(
+                Message.TP_REGISTER_RESPONSE, message.correlation_id,
+                TpRegisterResponse(
+                    status=TpRegisterResponse.OK).SerializeToString())
+        elif message_type == Message.TP_UNREGISTER_REQUEST:
+            self._send(
+                Message.TP_UNREGISTER_RESPONSE, message.correlation_id,
+                TpUnregisterResponse(
+                    status=TpUnregisterResponse.OK).SerializeToString())
+        elif message_type in _RESPONSE_TYPES:
+            content = self._capture.response(message_type, message.content)
+            if content is None:
+                counts['unanswered'] = counts.get('unanswered', 0) + 1
+                LOGGER.warning(
+                    'No captured response to %s',
+                    Message.MessageType.Name(message_type))
+                content = b''
+            self._send(
+                _RESPONSE_TYPES[message_type], message.correlation_id,
+                content)
+        else:
+            LOGGER.debug(
+                'Ignoring %s', Message.MessageType.Name(message_type))
+
+    def _poll(self, timeout):
+        return bool(self._poller.poll(
+            None if timeout is None else timeout * 1000))
+
+    def _recv(self):
+        # pylint: disable=unbalanced-tuple-unpacking
+        self._connection, message_bytes = self._socket.recv_multipart()
+        message = Message()
+        message.ParseFromString(message_bytes)
+        return message
+
+    def _send(self, message_type, correlation_id, content):
+        self._socket.send_multipart([
+            self._connection,
+            Message(
+                message_type=message_type,
+                correlation_id=correlation_id,
+                content=content).SerializeToString()])
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Replays a capture of transaction processor traffic '
+        'to a transaction processor, and reports its throughput and '
+        'latency.')
+    parser.add_argument('capture', help='the capture file to replay')
+    parser.add_argument(
+        '-b', '--bind',
+        default='tcp://127.0.0.1:4004',
+        help='endpoint for the transaction processor to connect to')
+    parser.add_argument(
+        '-s', '--speed',
+        choices=['original', 'max'],
+        default='max',
+        help='send transactions at their captured times, or as fast as '
+        'they are processed')
+    parser.add_argument(
+        '-w', '--window',
+        type=int,
+        default=1,
+        help='the most transactions outstanding at once at max speed')
+    parser.add_argument(
+        '-t', '--timeout',
+        type=float,
+        default=60,
+        help='seconds to wait for the transaction processor to register')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+
+    replayer = Replayer(Capture(opts.capture), opts.bind)
+    try:
+        print('waiting for a transaction processor at {}'.format(
+            replayer.url))
+        replayer.wait_for_processor(opts.timeout)
+        report = replayer.run(speed=opts.speed, window=opts.window)
+        print(report.format())
+    finally:
+        replayer.close()
@@ -0,0 +1,518 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Simulates the validator's parallel scheduler on a BatchList, to show how
+much parallelism its transactions allow.
+
+The transactions are ordered as the validator schedules them, by batch and
+then within each batch. As in the validator, a transaction must follow
+each earlier transaction that writes an address it reads or writes, each
+earlier transaction that reads an address it writes, and the transactions
+named in its dependencies, where two addresses overlap if one is a prefix
+of the other.
+
+The transactions are applied with their handlers against a LocalState, in
+the order a pool of workers would start them, each worker starting the
+earliest transaction whose predecessors have completed. The handlers are
+not run concurrently, which the GIL would serialize anyway: each one is
+timed, and the pool runs in simulated time on those timings. The state is
+checked against the state of applying the batches one after another, so a
+schedule that broke serializability would be reported.
+"""
+
+import argparse
+from collections import Counter
+from collections import defaultdict
+import heapq
+import logging
+import sys
+import time
+
+from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from sawtooth_processor_test.bench import WORKLOADS
+from sawtooth_processor_test.bench import load
+from sawtooth_processor_test.local_context import LocalContext
+from sawtooth_processor_test.local_context import LocalState
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ScheduledTransaction:
+    """A transaction in schedule order, and its place in the conflict
+    graph.
+
+    Attributes:
+        index (int): its position in the schedule
+        batch (int): the index of its batch
+        request (TpProcessRequest): what its handler is applied to
+        predecessors (set): the indexes of the transactions it must follow
+        conflicts (dict): the index of each predecessor to the address or
+            prefix of the conflict, or None for a dependency
+    """
+
+    __slots__ = ('index', 'batch', 'request', 'predecessors', 'conflicts')
+
+    def __init__(self, index, batch, request):
+        self.index = index
+        self.batch = batch
+        self.request = request
+        self.predecessors = set()
+        self.conflicts = {}
+
+
+def read_batch_list(path):
+    """Returns the transactions of a serialized BatchList, as written by
+    intkey generate or populate, as ScheduledTransactions without
+    predecessors.
+    """
+    batch_list = BatchList()
+    with open(path, 'rb') as batch_file:
+        batch_list.ParseFromString(batch_file.read())
+    transactions = []
+    for batch_index, batch in enumerate(batch_list.batches):
+        for transaction in batch.transactions:
+            header = TransactionHeader()
+            header.ParseFromString(transaction.header)
+            transactions.append(ScheduledTransaction(
+                len(transactions), batch_index, TpProcessRequest(
+                    header=header,
+                    payload=transaction.payload,
+                    signature=transaction.header_signature,
+                    context_id='schedule')))
+    return transactions
+
+
+class _AddressNode:
+    """The transactions that last wrote, and have since read, an address or
+    prefix.
+    """
+
+    __slots__ = ('writer', 'readers')
+
+    def __init__(self):
+        self.writer = None
+        self.readers = []
+
+
+def build_conflict_graph(transactions):
+    """Sets the predecessors of each transaction, as the validator's
+    parallel scheduler would.
+
+    Only the last writer of each address, and its readers since, are
+    recorded as predecessors; earlier ones precede those transitively.
+
+    Args:
+        transactions (list): the ScheduledTransactions, in schedule order
+
+    Returns:
+        (int): the number of dependencies naming no earlier transaction,
+            which are ignored
+    """
+    # The address nodes overlapping an address are those of its prefixes
+    # and those it is a prefix of. Only the lengths of addresses used are
+    # looked up, and only prefixes as long as a short address are indexed.
+    lengths = set()
+    for transaction in transactions:
+        header = transaction.request.header
+        lengths.update(len(address) for address in header.inputs)
+        lengths.update(len(address) for address in header.outputs)
+    lengths = sorted(lengths)
+    prefix_lengths = [length for length in lengths if length < max(lengths)] \
+        if lengths else []
+
+    nodes = {}
+    under = defaultdict(list)
+
+    def node(address):
+        found = nodes.get(address)
+        if found is None:
+            found = nodes[address] = _AddressNode()
+            for length in prefix_lengths:
+                if length < len(address):
+                    under[address[:length]].append(address)
+        return found
+
+    def overlapping(address):
+        for length in lengths:
+            if length > len(address):
+                break
+            found = nodes.get(address[:length])
+            if found is not None:
+                yield address[:length], found
+        for longer in under.get(address, ()):
+            yield longer, nodes[longer]
+
+    by_signature = {}
+    missing = 0
+    for transaction in transactions:
+        header = transaction.request.header
+        conflicts = transaction.conflicts
+        for address in header.inputs:
+            for key, found in overlapping(address):
+                if found.writer is not None:
+                    conflicts.setdefault(found.writer, key)
+        for address in header.outputs:
+            for key, found in overlapping(address):
+                if found.writer is not None:
+                    conflicts.setdefault(found.writer, key)
+                for reader in found.readers:
+                    conflicts.setdefault(reader, key)
+        for dependency in header.dependencies:
+            if dependency in by_signature:
+                conflicts.setdefault(by_signature[dependency], None)
+            else:
+                missing += 1
+        conflicts.pop(transaction.index, None)
+        transaction.predecessors = set(conflicts)
+
+        for address in header.inputs:
+            node(address).readers.append(transaction.index)
+        for address in header.outputs:
+            written = node(address)
+            written.writer = transaction.index
+            written.readers = []
+        by_signature[transaction.request.signature] = transaction.index
+    return missing
+
+
+class _Handlers:
+    """Applies transactions with the handler of their family and version.
+    """
+
+    def __init__(self, handlers):
+        self._handlers = {}
+        for handler in handlers:
+            for version in handler.family_versions:
+                self._handlers[(handler.family_name, version)] = handler
+
+    def apply(self, request, state):
+        """Applies request against state.
+
+        Returns:
+            (LocalContext): the context, with the changes to commit, or
+                None if the transaction is invalid
+        """
+        header = request.header
+        try:
+            handler = self._handlers[
+                (header.family_name, header.family_version)]
+        except KeyError:
+            raise ValueError('No handler for {} {}'.format(
+                header.family_name, header.family_version)) from None
+        context = LocalContext.for_transaction(state, request)
+        try:
+            handler.apply(request, context)
+        except (InvalidTransaction, InternalError) as err:
+            LOGGER.debug('Transaction %s is invalid: %s',
+                         request.signature[:8], err)
+            return None
+        return context
+
+
+class _BatchState:
+    """The state seen by the transactions of one batch, whose changes are
+    applied to the underlying state only when the whole batch is valid.
+    """
+
+    def __init__(self, state):
+        self._state = state
+        self._changes = {}
+
+    def get(self, address):
+        if address in self._changes:
+            return self._changes[address]
+        return self._state.get(address)
+
+    def apply(self, changes):
+        self._changes.update(changes)
+
+    def commit(self):
+        self._state.apply(self._changes)
+
+
+def apply_serially(handlers, transactions, state):
+    """Applies the transactions one after another, discarding the changes
+    of invalid batches, as a block is applied.
+
+    Returns:
+        (set): the indexes of the invalid batches
+    """
+    invalid = set()
+    batch_state = None
+    batch = None
+    for transaction in transactions:
+        if transaction.batch != batch:
+            if batch is not None and batch not in invalid:
+                batch_state.commit()
+            batch = transaction.batch
+            batch_state = _BatchState(state)
+        if batch in invalid:
+            continue
+        context = handlers.apply(transaction.request, batch_state)
+        if context is None:
+            invalid.add(batch)
+        else:
+            context.commit()
+    if batch is not None and batch not in invalid:
+        batch_state.commit()
+    return invalid
+
+
+def simulate_pool(transactions, durations, workers, run=None):
+    """Runs the schedule on a pool of workers in simulated time.
+
+    Args:
+        transactions (list): the ScheduledTransactions, with predecessors
+        durations (list): the seconds each transaction takes, or None if
+            run is to measure them
+        workers (int): the size of the pool
+        run (callable): called with each transaction as it starts, and
+            returning its duration
+
+    Returns:
+        (float): the simulated seconds until the last transaction completes
+    """
+    successors = defaultdict(list)
+    waiting = []
+    for transaction in transactions:
+        waiting.append(len(transaction.predecessors))
+        for predecessor in transaction.predecessors:
+            successors[predecessor].append(transaction.index)
+
+    ready = [index for index, count in enumerate(waiting) if count == 0]
+    heapq.heapify(ready)
+    running = []
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < workers:
+            index = heapq.heappop(ready)
+            if run is not None:
+                duration = run(transactions[index])
+            else:
+                duration = durations[index]
+            heapq.heappush(running, (now + duration, index))
+        now, index = heapq.heappop(running)
+        for successor in successors[index]:
+            waiting[successor] -= 1
+            if waiting[successor] == 0:
+                heapq.heappush(ready, successor)
+    return now
+
+
+def critical_path(transactions, durations):
+    """Returns the seconds, and the number of transactions, of the longest
+    chain of transactions that must run one after another.
+    """
+    finish = []
+    length = []
+    for transaction, duration in zip(transactions, durations):
+        latest = max(
+            transaction.predecessors, key=finish.__getitem__, default=None)
+        if latest is None:
+            finish.append(duration)
+            length.append(1)
+        else:
+            finish.append(finish[latest] + duration)
+            length.append(length[latest] + 1)
+    if not finish:
+        return 0.0, 0
+    longest = max(range(len(finish)), key=finish.__getitem__)
+    return finish[longest], length[longest]
+
+
+class ScheduleReport:
+    """The results of a simulation.
+
+    Attributes:
+        transactions (int): the number of transactions
+        batches (int): the number of batches
+        invalid_batches (int): the number of batches with an invalid
+            transaction
+        edges (int): the number of predecessors of all transactions
+        serial (float): the seconds taken by the transactions in total
+        critical_seconds (float): the seconds of the longest chain
+        critical_length (int): the transactions in the longest chain
+        makespans (dict): pool size to the seconds the schedule takes
+        hotspots (list): (address prefix, conflicts) of the prefixes with
+            the most conflicts, most first
+        serializable (bool): whether the scheduled run left the same state
+            as the serial one
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, transactions, batches, invalid_batches, edges,
+                 serial, critical_seconds, critical_length, makespans,
+                 hotspots, serializable):
+        self.transactions = transactions
+        self.batches = batches
+        self.invalid_batches = invalid_batches
+        self.edges = edges
+        self.serial = serial
+        self.critical_seconds = critical_seconds
+        self.critical_length = critical_length
+        self.makespans = makespans
+        self.hotspots = hotspots
+        self.serializable = serializable
+
+    def speedup(self, workers):
+        makespan = self.makespans[workers]
+        if not makespan:
+            return 1.0
+        return self.serial / makespan
+
+    def format(self):
+        lines = [
+            'transactions:   {}'.format(self.transactions),
+            'batches:        {} ({} invalid)'.format(
+                self.batches, self.invalid_batches),
+            'conflicts:      {}'.format(self.edges),
+            'serial time:    {:.3f}ms'.format(self.serial * 1000),
+            'critical path:  {:.3f}ms, {} transactions'.format(
+                self.critical_seconds * 1000, self.critical_length),
+        ]
+        if self.critical_seconds:
+            lines.append('max speedup:    {:.2f}x'.format(
+                self.serial / self.critical_seconds))
+        for workers in sorted(self.makespans):
+            lines.append('{:>3} workers:    {:.3f}ms, {:.2f}x'.format(
+                workers, self.makespans[workers] * 1000,
+                self.speedup(workers)))
+        lines.append('serializable:   {}'.format(
+            'yes' if self.serializable else 'NO'))
+        if self.hotspots:
+            lines.append('hotspots:')
+            for prefix, count in self.hotspots:
+                lines.append('  {} {}'.format(prefix, count))
+        return '\n'.join(lines)
+
+
+def simulate(handlers, transactions, workers=(1, 2, 4, 8),
+             prefix_length=70, hotspots=10, state_factory=LocalState):
+    """Builds the conflict graph of the transactions, runs them on a
+    simulated pool of the largest size in workers, and reports on it.
+
+    Args:
+        handlers (list): the TransactionHandlers of the families used
+        transactions (list): the ScheduledTransactions, in schedule order
+        workers (iterable): the pool sizes to report on
+        prefix_length (int): the length of the address prefixes by which
+            conflicts are counted
+        hotspots (int): the number of prefixes to report
+        state_factory (callable): returns the initial state, empty or
+            prefilled, e.g. LocalState or MerkleTree
+
+    Returns:
+        (ScheduleReport): the results
+    """
+    handlers = _Handlers(handlers)
+    missing = build_conflict_graph(transactions)
+    if missing:
+        LOGGER.warning('Ignored %s dependencies on unknown transactions',
+                       missing)
+
+    serial_state = state_factory()
+    invalid = apply_serially(handlers, transactions, serial_state)
+
+    state = state_factory()
+    durations = [0.0] * len(transactions)
+
+    def run(transaction):
+        start = time.perf_counter()
+        context = handlers.apply(transaction.request, state)
+        durations[transaction.index] = time.perf_counter() - start
+        # The changes of an invalid batch are discarded, which the
+        # validator does by rescheduling the transactions following it.
+        if context is not None and transaction.batch not in invalid:
+            context.commit()
+        return durations[transaction.index]
+
+    workers = sorted(set(workers))
+    makespans = {workers[-1]: simulate_pool(
+        transactions, None, workers[-1], run)}
+    for count in workers[:-1]:
+        makespans[count] = simulate_pool(transactions, durations, count)
+    path, length = critical_path(transactions, durations)
+
+    conflicts = Counter(
+        address[:prefix_length] if address is not None else 'dependencies'
+        for transaction in transactions
+        for address in transaction.conflicts.values())
+
+    return ScheduleReport(
+        transactions=len(transactions),
+        batches=len({transaction.batch for transaction in transactions}),
+        invalid_batches=len(invalid),
+        edges=sum(len(transaction.predecessors)
+                  for transaction in transactions),
+        serial=sum(durations),
+        critical_seconds=path,
+        critical_length=length,
+        makespans=makespans,
+        hotspots=conflicts.most_common(hotspots),
+        serializable=list(state) == list(serial_state))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Simulates the parallel scheduling of a BatchList, and '
+        'reports the speedup its transactions allow.')
+    parser.add_argument(
+        'batches',
+        help='a file of a serialized BatchList, e.g. from intkey generate')
+    parser.add_argument(
+        '-H', '--handler',
+        action='append',
+        help='intkey, xo, or the module:class of a handler; may be given '
+        'once for each family in the batches (default: intkey)')
+    parser.add_argument(
+        '-w', '--workers',
+        default='1,2,4,8',
+        help='comma-separated pool sizes to report')
+    parser.add_argument(
+        '-p', '--prefix-length',
+        type=int,
+        default=70,
+        help='the length of the address prefixes by which conflicts are '
+        'counted')
+    parser.add_argument(
+        '--hotspots',
+        type=int,
+        default=10,
+        help='the number of address prefixes with the most conflicts to '
+        'report')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+
+    handlers = [
+        load(WORKLOADS.get(name, (name,))[0])()
+        for name in opts.handler or ['intkey']
+    ]
+    report = simulate(
+        handlers, read_batch_list(opts.batches),
+        workers=[int(count) for count in opts.workers.split(',')],
+        prefix_length=opts.prefix_length,
+        hotspots=opts.hotspots)
+    print(report.format())
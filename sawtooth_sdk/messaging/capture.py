@@ -0,0 +1,120 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Capture files of the messages exchanged between a transaction processor
+and its validator.
+
+A capture file starts with MAGIC, followed by one record per message. Each
+record is a header packed as _HEADER, holding the direction of the message,
+the seconds since the capture started and the length of the message,
+followed by the serialized validator_pb2.Message.
+"""
+
+from collections import namedtuple
+import struct
+from threading import Lock
+import time
+
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+MAGIC = b'SAWTOOTH-CAPTURE-1\n'
+
+# direction, seconds since the start of the capture, length
+_HEADER = struct.Struct('<BdI')
+
+# Messages received from the validator.
+INBOUND = 0
+# Messages sent to the validator.
+OUTBOUND = 1
+
+# The messages needed to replay the processing of transactions.
+CAPTURED_TYPES = frozenset([
+    Message.TP_PROCESS_REQUEST,
+    Message.TP_PROCESS_RESPONSE,
+    Message.TP_STATE_GET_REQUEST,
+    Message.TP_STATE_GET_RESPONSE,
+    Message.TP_STATE_SET_REQUEST,
+    Message.TP_STATE_SET_RESPONSE,
+    Message.TP_STATE_DELETE_REQUEST,
+    Message.TP_STATE_DELETE_RESPONSE,
+    Message.TP_RECEIPT_ADD_DATA_REQUEST,
+    Message.TP_RECEIPT_ADD_DATA_RESPONSE,
+    Message.TP_EVENT_ADD_REQUEST,
+    Message.TP_EVENT_ADD_RESPONSE,
+])
+
+
+class CaptureError(Exception):
+    pass
+
+
+CaptureRecord = namedtuple('CaptureRecord', ['direction', 'time', 'message'])
+
+
+class CaptureWriter:
+    """Appends messages to a capture file. May be used from any thread.
+
+    Args:
+        path (str): the file to write, which is truncated
+        message_types (set): the types of message to record
+    """
+
+    def __init__(self, path, message_types=CAPTURED_TYPES):
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._message_types = message_types
+        self._start = time.monotonic()
+        self._lock = Lock()
+
+    def record(self, direction, message_type, message_bytes):
+        """Records a serialized message, if it is of a captured type."""
+        if message_type not in self._message_types:
+            return
+        header = _HEADER.pack(
+            direction, time.monotonic() - self._start, len(message_bytes))
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(header)
+            self._file.write(message_bytes)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """Yields the CaptureRecords in a capture file, in the order they were
+    recorded.
+
+    Raises:
+        CaptureError: if the file is not a capture file, or is truncated
+    """
+    with open(path, 'rb') as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise CaptureError('{} is not a capture file'.format(path))
+        while True:
+            header = capture.read(_HEADER.size)
+            if not header:
+                return
+            if len(header) < _HEADER.size:
+                raise CaptureError('{} is truncated'.format(path))
+            direction, offset, length = _HEADER.unpack(header)
+            message_bytes = capture.read(length)
+            if len(message_bytes) < length:
+                raise CaptureError('{} is truncated'.format(path))
+            message = Message()
+            message.ParseFromString(message_bytes)
+            yield CaptureRecord(direction, offset, message)
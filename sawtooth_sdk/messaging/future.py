@@ -13,14 +13,20 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
-from threading import Condition
-from threading import RLock
+from threading import Lock
 
 from sawtooth_sdk.messaging.exceptions import ValidatorConnectionError
 from sawtooth_sdk.protobuf import validator_pb2
 
 
+# Guards the done callbacks of every Future. Callbacks are rare, so one
+# shared lock avoids allocating a lock per Future.
+_CALLBACK_LOCK = Lock()
+
+
 class FutureResult:
+    __slots__ = ('message_type', 'content')
+
     def __init__(self, message_type, content):
         self.message_type = message_type
         self.content = content
@@ -43,30 +49,65 @@ class FutureError:
 
 
 class Future:
+    """The pending response to a message sent through a Stream.
+
+    Waiting is done on a single lock that is held from creation until the
+    result is set, which is cheaper to create than a Condition.
+    """
+
+    __slots__ = ('correlation_id', '_result', '_waiter', '_request_type',
+                 '_callbacks')
+
     def __init__(self, correlation_id, request_type=None):
         self.correlation_id = correlation_id
         self._result = None
-        self._condition = Condition()
+        self._waiter = Lock()
+        self._waiter.acquire()
         self._request_type = request_type
+        self._callbacks = None
 
     def done(self):
         return self._result is not None
 
     def result(self, timeout=None):
-        with self._condition:
-            if self._result is None:
-                if not self._condition.wait(timeout):
-                    message_type = validator_pb2.Message.MessageType.Name(
-                        self._request_type) if self._request_type else None
-                    raise FutureTimeoutError(
-                        'Future timed out waiting for response to {}'.format(
-                            message_type))
+        if self._result is None:
+            if not self._waiter.acquire(
+                    timeout=-1 if timeout is None else timeout):
+                message_type = validator_pb2.Message.MessageType.Name(
+                    self._request_type) if self._request_type else None
+                raise FutureTimeoutError(
+                    'Future timed out waiting for response to {}'.format(
+                        message_type))
+            # let any other waiters through as well
+            self._waiter.release()
         return self._result
 
     def set_result(self, result):
-        with self._condition:
+        # Only the call that sets the first result releases the waiters,
+        # which must happen once however many threads set a result.
+        with _CALLBACK_LOCK:
+            first = self._result is None
             self._result = result
-            self._condition.notify()
+            if not first:
+                return
+            callbacks, self._callbacks = self._callbacks, None
+        self._waiter.release()
+        if callbacks is not None:
+            for callback in callbacks:
+                callback(result)
+
+    def add_done_callback(self, callback):
+        """Registers a callable to be invoked with the result once it is
+        set. The callable runs on the thread that sets the result, or
+        immediately if the result has already been set.
+        """
+        with _CALLBACK_LOCK:
+            if self._result is None:
+                if self._callbacks is None:
+                    self._callbacks = []
+                self._callbacks.append(callback)
+                return
+        callback(self._result)
 
 
 class FutureCollectionKeyError(Exception):
@@ -78,33 +119,45 @@ class FutureTimeoutError(Exception):
 
 
 class FutureCollection:
+    """The Futures awaiting a response, by correlation id.
+
+    Every operation is a single dict operation, which is atomic, so no
+    lock is needed between the threads sending messages and the thread
+    resolving them.
+    """
+
     def __init__(self):
         self._futures = {}
-        self._lock = RLock()
 
     def put(self, future):
-        with self._lock:
-            self._futures[future.correlation_id] = future
+        self._futures[future.correlation_id] = future
+
+    def resolve(self, correlation_id, result):
+        """Removes the future with the given correlation id and sets its
+        result.
+
+        :return (bool): whether there was a future with that correlation id
+        """
+        future = self._futures.pop(correlation_id, None)
+        if future is None:
+            return False
+        future.set_result(result)
+        return True
 
     def set_result(self, correlation_id, result):
-        with self._lock:
-            future = self.get(correlation_id)
-            future.set_result(result)
+        self.get(correlation_id).set_result(result)
 
     def get(self, correlation_id):
-        with self._lock:
-            if correlation_id not in self._futures:
-                raise FutureCollectionKeyError(
-                    "no such correlation id: {}".format(correlation_id))
+        try:
             return self._futures[correlation_id]
+        except KeyError:
+            raise FutureCollectionKeyError(
+                "no such correlation id: {}".format(correlation_id)) from None
 
     def remove(self, correlation_id):
-        with self._lock:
-            if correlation_id not in self._futures:
-                raise FutureCollectionKeyError(
-                    "no such correlation id: {}".format(correlation_id))
-            del self._futures[correlation_id]
+        if self._futures.pop(correlation_id, None) is None:
+            raise FutureCollectionKeyError(
+                "no such correlation id: {}".format(correlation_id))
 
     def future_values(self):
-        with self._lock:
-            return self._futures.values()
+        return list(self._futures.values())
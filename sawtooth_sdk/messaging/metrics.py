@@ -0,0 +1,322 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import abc
+import bisect
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import logging
+from socketserver import ThreadingMixIn
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Counter:
+    """A value that only increases."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Gauge:
+    """A value that may go up and down, or that is read from a function
+    each time it is collected.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._function = None
+        self._lock = Lock()
+
+    def set_function(self, function):
+        """Makes the value of the gauge the result of calling function."""
+        self._function = function
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+class Histogram:
+    """Counts observations in cumulative buckets, as well as their number
+    and sum.
+
+    Args:
+        buckets (list): the increasing upper bounds of the buckets; an
+            unbounded bucket is always added
+    """
+
+    def __init__(self, buckets):
+        self._bounds = list(buckets)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def buckets(self):
+        """Returns a list of (upper bound, cumulative count) pairs, ending
+        with float('inf').
+        """
+        with self._lock:
+            counts = list(self._counts)
+        cumulative = 0
+        result = []
+        for bound, count in zip(self._bounds + [float('inf')], counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+
+# Upper bounds, in seconds, for histograms of latencies.
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds for histograms of the number of messages handled at once.
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+# Upper bounds for histograms of the number of requests made for a task.
+REQUEST_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MetricsRegistry:
+    """Holds the metrics recorded by the SDK, by name and labels, so that
+    they can be read by an exporter.
+
+    Asking for a metric that already exists returns the existing one.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def counter(self, name, **labels):
+        return self._get(name, labels, Counter)
+
+    def gauge(self, name, **labels):
+        return self._get(name, labels, Gauge)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        return self._get(name, labels, lambda: Histogram(buckets))
+
+    def _get(self, name, labels, factory):
+        key = (name, tuple(sorted(labels.items())))
+        try:
+            return self._metrics[key]
+        except KeyError:
+            pass
+        with self._lock:
+            return self._metrics.setdefault(key, factory())
+
+    def collect(self):
+        """Returns a list of (name, labels, metric) tuples, where labels is
+        a tuple of (label, value) pairs, sorted by name and labels.
+        """
+        with self._lock:
+            items = list(self._metrics.items())
+        return sorted(
+            ((name, labels, metric) for (name, labels), metric in items),
+            key=lambda item: (item[0], item[1]))
+
+
+def format_prometheus(registry):
+    """Returns the metrics in registry in the Prometheus text exposition
+    format.
+    """
+    lines = []
+    typed = set()
+    for name, labels, metric in registry.collect():
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} {}'.format(name, _TYPES[type(metric)]))
+        if isinstance(metric, Histogram):
+            for bound, count in metric.buckets():
+                lines.append('{}_bucket{} {}'.format(
+                    name,
+                    _format_labels(labels + (('le', _format_value(bound)),)),
+                    count))
+            lines.append('{}_sum{} {}'.format(
+                name, _format_labels(labels), _format_value(metric.sum)))
+            lines.append('{}_count{} {}'.format(
+                name, _format_labels(labels), metric.count))
+        else:
+            lines.append('{}{} {}'.format(
+                name, _format_labels(labels), _format_value(metric.value)))
+    return '\n'.join(lines) + '\n'
+
+
+_TYPES = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            label,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+        for label, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsExporter(metaclass=abc.ABCMeta):
+    """Makes the metrics in a registry available outside the process."""
+
+    @abc.abstractmethod
+    def start(self, registry):
+        """Starts exporting the metrics in registry."""
+
+    @abc.abstractmethod
+    def stop(self):
+        """Stops exporting."""
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PrometheusExporter(MetricsExporter):
+    """Serves the metrics over HTTP in the Prometheus text format, from a
+    background thread.
+
+    Args:
+        port (int): the port to listen on; 0 picks a free port, which is
+            then available as the port attribute once started
+        host (str): the address to listen on
+    """
+
+    def __init__(self, port, host='127.0.0.1'):
+        self._address = (host, port)
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        if self._server is None:
+            return self._address[1]
+        return self._server.server_address[1]
+
+    def start(self, registry):
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # pylint: disable=invalid-name
+                body = format_prometheus(registry).encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # pylint: disable=redefined-builtin
+                LOGGER.debug(format, *args)
+
+        self._server = _ThreadingHTTPServer(self._address, _Handler)
+        self._thread = Thread(
+            target=self._server.serve_forever,
+            name='PrometheusExporter',
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+
+class LogExporter(MetricsExporter):
+    """Logs the metrics periodically from a background thread.
+
+    Args:
+        interval (float): the seconds between each dump
+        logger (logging.Logger): where the metrics are logged, at INFO
+    """
+
+    def __init__(self, interval=60.0, logger=None):
+        self._interval = interval
+        self._logger = logger if logger is not None else LOGGER
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self, registry):
+        self._stopped.clear()
+        self._thread = Thread(
+            target=self._run,
+            args=(registry,),
+            name='LogExporter',
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, registry):
+        while not self._stopped.wait(self._interval):
+            self._logger.info("metrics:\n%s", format_prometheus(registry))
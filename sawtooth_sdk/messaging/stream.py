@@ -14,24 +14,35 @@
 # ------------------------------------------------------------------------------
 
 import asyncio
+from collections import deque
+import concurrent.futures
+import itertools
 import uuid
 import logging
 from queue import Queue
 from threading import Event
 from threading import Thread
 from threading import Condition
+import time
 
+from google.protobuf.message import DecodeError
 import zmq
 import zmq.asyncio
+from zmq.utils.monitor import parse_monitor_message
 
 from sawtooth_sdk.protobuf import validator_pb2
+from sawtooth_sdk.protobuf.network_pb2 import PingResponse
 
+from sawtooth_sdk.messaging.capture import INBOUND
+from sawtooth_sdk.messaging.capture import OUTBOUND
 from sawtooth_sdk.messaging.exceptions import ValidatorConnectionError
 from sawtooth_sdk.messaging.future import Future
 from sawtooth_sdk.messaging.future import FutureCollection
-from sawtooth_sdk.messaging.future import FutureCollectionKeyError
 from sawtooth_sdk.messaging.future import FutureResult
 from sawtooth_sdk.messaging.future import FutureError
+from sawtooth_sdk.messaging.metrics import BATCH_SIZE_BUCKETS
+from sawtooth_sdk.messaging.metrics import LATENCY_BUCKETS
+from sawtooth_sdk.messaging.metrics import MetricsRegistry
 
 LOGGER = logging.getLogger(__file__)
 
@@ -42,17 +53,210 @@ LOGGER = logging.getLogger(__file__)
 RECONNECT_EVENT = -1
 _NO_ERROR = -1
 
+_RESPONSE_TYPES = frozenset(
+    value for name, value in validator_pb2.Message.MessageType.items()
+    if name.endswith('_RESPONSE'))
+
+# The most messages sent or received per wakeup of the event loop.
+DEFAULT_MAX_BATCH = 128
+
+# The seconds waited before the first attempt to reconnect to the
+# validator, which doubles after each failed attempt up to the maximum.
+DEFAULT_RECONNECT_INTERVAL = 0.1
+DEFAULT_MAX_RECONNECT_INTERVAL = 2.0
+
 
 def _generate_id():
     return uuid.uuid4().hex.encode()
 
 
+class _FrameMessage:
+    """A validator_pb2.Message received without copying, with the same
+    fields, whose content is a memoryview of the ZMQ frame it arrived in
+    rather than a copy of it, so that the request it carries is parsed
+    straight from ZMQ's memory.
+    """
+
+    __slots__ = ('message_type', 'correlation_id', 'content')
+
+    def __init__(self, message_type, correlation_id, content):
+        self.message_type = message_type
+        self.correlation_id = correlation_id
+        self.content = content
+
+
+def _read_varint(view, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _parse_frame(buffer):
+    """Parses a serialized validator_pb2.Message into a _FrameMessage,
+    slicing its content out of the buffer instead of copying it.
+
+    :param buffer: the buffer of a ZMQ frame
+    :return (_FrameMessage):
+    :raises DecodeError: if the buffer is not a Message
+    """
+    view = memoryview(buffer)
+    message_type = 0
+    correlation_id = ''
+    content = view[0:0]
+    pos = 0
+    end = len(view)
+    try:
+        while pos < end:
+            key, pos = _read_varint(view, pos)
+            field, wire_type = key >> 3, key & 0x7
+            if wire_type == 0:
+                value, pos = _read_varint(view, pos)
+                if field == 1:
+                    message_type = value
+            elif wire_type == 2:
+                length, pos = _read_varint(view, pos)
+                value = view[pos:pos + length]
+                pos += length
+                if field == 2:
+                    correlation_id = str(value, 'utf-8')
+                elif field == 3:
+                    content = value
+            elif wire_type == 1:
+                pos += 8
+            elif wire_type == 5:
+                pos += 4
+            else:
+                raise DecodeError('Unexpected wire type {}'.format(wire_type))
+    except IndexError:
+        raise DecodeError('Truncated message') from None
+    if pos != end:
+        raise DecodeError('Truncated message')
+    return _FrameMessage(message_type, correlation_id, content)
+
+
+class _CorrelationIdGenerator:
+    """Generates the correlation ids of the messages sent through a Stream.
+
+    Each id is a random prefix, fixed for the generator, followed by a
+    counter. This is unique per stream without the cost of a uuid per
+    message, and next() on an itertools.count is atomic so no lock is
+    needed between sending threads.
+    """
+
+    __slots__ = ('_prefix', '_counter')
+
+    def __init__(self):
+        self._prefix = uuid.uuid4().hex[0:16]
+        self._counter = itertools.count()
+
+    def __call__(self):
+        return self._prefix + format(next(self._counter), 'x')
+
+
+class _ReceiveQueue:
+    """Hands messages from the event loop to the threads calling
+    Stream.receive.
+
+    Messages are appended to a deque, which needs no lock, and the
+    condition is only notified when a thread is actually waiting.
+
+    :param wait_seconds (Histogram): where the time each message spends in
+           the queue is recorded, or None
+    """
+
+    def __init__(self, wait_seconds=None):
+        self._messages = deque()
+        self._condition = Condition()
+        self._waiting = 0
+        self._wait_seconds = wait_seconds
+
+    def put(self, message):
+        self._messages.append((message, time.monotonic()))
+        if self._waiting:
+            with self._condition:
+                self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        :raises (concurrent.futures.TimeoutError): if no message arrives
+            within the timeout
+        """
+        try:
+            return self._taken(self._messages.popleft())
+        except IndexError:
+            pass
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    try:
+                        return self._taken(self._messages.popleft())
+                    except IndexError:
+                        pass
+                    remaining = None if deadline is None \
+                        else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise concurrent.futures.TimeoutError()
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def _taken(self, entry):
+        message, queued = entry
+        if self._wait_seconds is not None:
+            self._wait_seconds.observe(time.monotonic() - queued)
+        return message
+
+    def clear(self):
+        self._messages.clear()
+
+    def __len__(self):
+        return len(self._messages)
+
+
+class _ReceiveFuture:
+    """The next message received that is not a response, as returned by
+    Stream.receive. It is taken off the queue the first time result is
+    called, and kept for any later calls.
+    """
+
+    __slots__ = ('_queue', '_message', '_received')
+
+    def __init__(self, receive_queue):
+        self._queue = receive_queue
+        self._message = None
+        self._received = False
+
+    def result(self, timeout=None):
+        """
+        :raises (concurrent.futures.TimeoutError): if no message arrives
+            within the timeout
+        """
+        if not self._received:
+            self._message = self._queue.get(timeout)
+            self._received = True
+        return self._message
+
+
 class _SendReceiveThread(Thread):
     """
     Internal thread to Stream class that runs the asyncio event loop.
     """
 
-    def __init__(self, url, futures, ready_event, error_queue):
+    def __init__(self, url, futures, ready_event, error_queue,
+                 max_batch=DEFAULT_MAX_BATCH, metrics=None,
+                 answer_pings=False,
+                 reconnect_interval=DEFAULT_RECONNECT_INTERVAL,
+                 max_reconnect_interval=DEFAULT_MAX_RECONNECT_INTERVAL,
+                 recv_queue=None, labels=None, connect_events=False):
         """constructor for background thread
 
         :param url (str): the address to connect to the validator on
@@ -61,6 +265,22 @@ class _SendReceiveThread(Thread):
         :param ready_event (threading.Event): used to notify waiting/asking
                classes that the background thread of Stream is ready after
                a disconnect event.
+        :param max_batch (int): the most messages sent, or received, each
+               time the corresponding coroutine wakes up
+        :param metrics (MetricsRegistry): where the batch sizes, queue
+               depths and waits, rejected messages, reconnects and ping
+               latency are recorded
+        :param answer_pings (bool): whether PING_REQUEST messages are
+               answered by this thread rather than handed to receive
+        :param reconnect_interval (float): the seconds before the first
+               attempt to reconnect after a disconnect
+        :param max_reconnect_interval (float): the most seconds between
+               attempts to reconnect
+        :param recv_queue: where received messages are put, if not on a
+               _ReceiveQueue of the thread's own
+        :param labels (dict): labels of each metric recorded
+        :param connect_events (bool): whether RECONNECT_EVENT is also put
+               on the recv_queue on first connecting
         """
         super().__init__()
         self._futures = futures
@@ -70,12 +290,50 @@ class _SendReceiveThread(Thread):
         self._sock = None
         self._monitor_sock = None
         self._monitor_fd = None
-        self._recv_queue = None
-        self._send_queue = None
+        if metrics is None:
+            metrics = MetricsRegistry()
+        if labels is None:
+            labels = {}
+        if recv_queue is None:
+            recv_queue = _ReceiveQueue(metrics.histogram(
+                'stream_receive_queue_seconds', buckets=LATENCY_BUCKETS))
+            metrics.gauge('stream_receive_queue_depth').set_function(
+                lambda: len(self._recv_queue))
+        self._recv_queue = recv_queue
+        self._max_queued = None
+        self._reject = None
+        self._send_queue = deque()
+        self._send_wakeup = None
+        self._send_scheduled = False
+        # Counts the connections to the validator that have dropped.
+        self._connection = 0
         self._context = None
         self._ready_event = ready_event
         self._error_queue = error_queue
         self._condition = Condition()
+        self._max_batch = max_batch
+        self._reconnect_interval = reconnect_interval
+        self._max_reconnect_interval = max_reconnect_interval
+        self._connect_events = connect_events
+        self._send_batch_sizes = metrics.histogram(
+            'stream_send_batch_size', buckets=BATCH_SIZE_BUCKETS, **labels)
+        self._receive_batch_sizes = metrics.histogram(
+            'stream_receive_batch_size', buckets=BATCH_SIZE_BUCKETS,
+            **labels)
+        metrics.gauge('stream_send_queue_depth', **labels).set_function(
+            lambda: len(self._send_queue))
+        self._reconnects = metrics.counter(
+            'stream_reconnects_total', **labels)
+        self._reconnect_seconds = metrics.histogram(
+            'stream_reconnect_seconds', buckets=LATENCY_BUCKETS, **labels)
+        self._rejected = metrics.counter(
+            'stream_receive_rejected_total', **labels)
+        self._answer_pings = answer_pings
+        self.capture = None
+        self.zero_copy = False
+        self._ping_latency = metrics.histogram(
+            'stream_ping_response_seconds', buckets=LATENCY_BUCKETS,
+            **labels)
         self.identity = _generate_id()[0:16]
 
     @asyncio.coroutine
@@ -85,99 +343,201 @@ class _SendReceiveThread(Thread):
         them on the recv_queue
         """
         while True:
-            if not self._ready_event.is_set():
-                break
-            msg_bytes = yield from self._sock.recv()
-            message = validator_pb2.Message()
-            message.ParseFromString(msg_bytes)
-            try:
-                self._futures.set_result(
-                    message.correlation_id,
-                    FutureResult(message_type=message.message_type,
-                                 content=message.content))
-                self._futures.remove(message.correlation_id)
-            except FutureCollectionKeyError:
-                # if we are getting an initial message, not a response
-                if not self._ready_event.is_set():
+            copy = not self.zero_copy
+            frames = [(yield from self._sock.recv(copy=copy))]
+            # take whatever else has already arrived without waiting
+            while len(frames) < self._max_batch:
+                try:
+                    frames.append(
+                        (yield from self._sock.recv(zmq.NOBLOCK, copy=copy)))
+                except zmq.Again:
                     break
-                self._recv_queue.put_nowait(message)
-
-    @asyncio.coroutine
-    def _send_message(self):
-        """
-        internal coroutine that sends messages from the send_queue
-        """
-        while True:
-            if not self._ready_event.is_set():
-                break
-            msg = yield from self._send_queue.get()
-            yield from self._sock.send_multipart([msg.SerializeToString()])
+            received = time.monotonic()
+            self._receive_batch_sizes.observe(len(frames))
+
+            for frame in frames:
+                if copy:
+                    message = validator_pb2.Message()
+                    message.ParseFromString(frame)
+                else:
+                    # The content is left in the memory ZMQ received it
+                    # into, from which the receiver parses it.
+                    message = _parse_frame(frame.buffer)
+                if self.capture is not None:
+                    self.capture.record(
+                        INBOUND, message.message_type,
+                        frame if copy else frame.bytes)
+                if not self._futures.resolve(
+                        message.correlation_id,
+                        FutureResult(message_type=message.message_type,
+                                     content=message.content)):
+                    # if we are getting an initial message, not a response
+                    if message.message_type in _RESPONSE_TYPES:
+                        # The response to a request whose future failed
+                        # when the connection dropped.
+                        LOGGER.debug("Dropping response %s to no request",
+                                     message.correlation_id)
+                        continue
+                    if self._answer_pings and message.message_type == \
+                            validator_pb2.Message.PING_REQUEST:
+                        yield from self._answer_ping(message, received)
+                        continue
+                    if self._max_queued is not None and \
+                            len(self._recv_queue) >= self._max_queued and \
+                            self._reject(message):
+                        self._rejected.inc()
+                        continue
+                    self._recv_queue.put(message)
 
     @asyncio.coroutine
-    def _put_message(self, message):
+    def _answer_ping(self, message, received):
+        """Replies to a ping from the validator straight away, so that the
+        reply does not wait behind the messages queued for receive.
         """
-        Puts a message on the send_queue. Not to be accessed directly.
-        :param message: protobuf generated validator_pb2.Message
-        """
-        self._send_queue.put_nowait(message)
+        yield from self._sock.send_multipart([
+            validator_pb2.Message(
+                message_type=validator_pb2.Message.PING_RESPONSE,
+                correlation_id=message.correlation_id,
+                content=PingResponse().SerializeToString()
+            ).SerializeToString()])
+        self._ping_latency.observe(time.monotonic() - received)
 
     @asyncio.coroutine
-    def _get_message(self):
+    def _send_message(self):
         """
-        Gets a message from the recv_queue. Not to be accessed directly.
+        internal coroutine that sends messages from the send_queue
         """
-        with self._condition:
-            self._condition.wait_for(lambda: self._recv_queue is not None)
-        msg = yield from self._recv_queue.get()
-
-        return msg
+        while True:
+            yield from self._send_wakeup
+            self._send_wakeup = self._event_loop.create_future()
+            # Cleared before draining, so a message queued after this
+            # point schedules another wakeup.
+            self._send_scheduled = False
+            while self._send_queue:
+                batch = []
+                while self._send_queue and len(batch) < self._max_batch:
+                    batch.append(self._send_queue.popleft())
+                self._send_batch_sizes.observe(len(batch))
+
+                connection = self._connection
+                for msg in batch:
+                    # The rest of a batch queued for a connection that has
+                    # since dropped is not sent over the new one.
+                    if self._connection != connection:
+                        break
+                    yield from self._sock.send_multipart([msg])
+
+    def _wake_sender(self):
+        if not self._send_wakeup.done():
+            self._send_wakeup.set_result(None)
 
     @asyncio.coroutine
-    def _monitor_disconnects(self):
-        """Monitors the client socket for disconnects
+    def _monitor_connection(self):
+        """Monitors the socket's connection to the validator.
+
+        The socket is kept when the connection drops, and ZMQ reconnects
+        it by itself, backing off between attempts. The event loop keeps
+        running throughout, so all that is needed is to fail what was
+        outstanding when the connection dropped, and to tell receivers
+        once it is back, so that they can register again.
         """
-        yield from self._monitor_sock.recv_multipart()
-        self._sock.disable_monitor()
-        self._monitor_sock.disconnect(self._monitor_fd)
-        self._monitor_sock.close(linger=0)
-        self._monitor_sock = None
-        self._sock.disconnect(self._url)
+        disconnected = None
+        while True:
+            event = parse_monitor_message(
+                (yield from self._monitor_sock.recv_multipart()))
+            if event['event'] == zmq.EVENT_DISCONNECTED:
+                if disconnected is None:
+                    disconnected = time.monotonic()
+                    self._disconnected()
+            elif event['event'] == zmq.EVENT_CONNECTED:
+                if disconnected is not None:
+                    self._reconnect_seconds.observe(
+                        time.monotonic() - disconnected)
+                    disconnected = None
+                    self._reconnected()
+                elif self._connect_events:
+                    LOGGER.info("Connected to the validator at %s",
+                                self._url)
+                    self._connect_events = False
+                    self._recv_queue.put(RECONNECT_EVENT)
+
+    def _disconnected(self):
+        LOGGER.warning("Disconnected from the validator at %s", self._url)
         self._ready_event.clear()
-        LOGGER.debug("monitor socket received disconnect event")
+        self._connection += 1
+        # Connecting again starts a new session, so that messages ZMQ
+        # still holds for, or from, the old connection are dropped rather
+        # than delivered over the new one. The validator will not answer
+        # the requests that were sent over the old connection.
+        self._sock.disconnect(self._url)
+        self._sock.connect(self._url)
+        self._send_queue.clear()
+        self._recv_queue.clear()
         for future in self._futures.future_values():
-            future.set_result(FutureError())
-        tasks = list(asyncio.Task.all_tasks(self._event_loop))
-        for task in tasks:
-            task.cancel()
-        self._event_loop.stop()
-        self._send_queue = None
-        self._recv_queue = None
+            self._futures.resolve(future.correlation_id, FutureError())
+
+    def _reconnected(self):
+        LOGGER.info("Reconnected to the validator at %s", self._url)
+        self._reconnects.inc()
+        self._ready_event.set()
+        self._recv_queue.put(RECONNECT_EVENT)
+
+    @property
+    def connection(self):
+        """The number of connections to the validator that have dropped."""
+        return self._connection
 
     def put_message(self, message):
         """
-        :param message: protobuf generated validator_pb2.Message
+        :param message: serialized validator_pb2.Message, serialized on the
+            calling thread so the event loop only does socket I/O
         """
         if not self._ready_event.is_set():
             return
 
-        with self._condition:
-            self._condition.wait_for(
-                lambda: self._event_loop is not None
-                and self._send_queue is not None
-            )
-
-        asyncio.run_coroutine_threadsafe(
-            self._put_message(message),
-            self._event_loop)
+        if self._event_loop is None:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._event_loop is not None)
+
+        # The message is queued before checking whether the sender needs
+        # waking, so that a sender draining the queue concurrently either
+        # sees the message or has already cleared the flag.
+        self._send_queue.append(message)
+        if not self._send_scheduled:
+            self._send_scheduled = True
+            self._event_loop.call_soon_threadsafe(self._wake_sender)
+
+    def set_admission_limit(self, max_queued, reject):
+        """Bounds the messages waiting to be received.
+
+        :param max_queued (int): the most messages waiting, or None for no
+               bound
+        :param reject (callable): called, on this thread, with each message
+               received while max_queued are waiting; it returns True if it
+               has disposed of the message, or False if it should be queued
+               regardless
+        """
+        # The reject function is set first, as the receive coroutine reads
+        # the two without a lock.
+        self._reject = reject
+        self._max_queued = max_queued
 
     def get_message(self):
         """
-        :return message: concurrent.futures.Future
+        :return message: a future for the next message that is not a
+            response, whose result method accepts a timeout
+        """
+        return _ReceiveFuture(self._recv_queue)
+
+    def run_coroutine(self, coro):
+        """
+        :param coro: the coroutine to run on the event loop
+        :return: concurrent.futures.Future
         """
         with self._condition:
             self._condition.wait_for(lambda: self._event_loop is not None)
-        return asyncio.run_coroutine_threadsafe(self._get_message(),
-                                                self._event_loop)
+        return asyncio.run_coroutine_threadsafe(coro, self._event_loop)
 
     def _cancel_tasks_yet_to_be_done(self):
         """Cancels all the tasks (pending coroutines and futures)
@@ -195,70 +555,90 @@ class _SendReceiveThread(Thread):
         self._cancel_tasks_yet_to_be_done()
 
     def _done_callback(self):
-        """Stops the event loop, closes the socket, and destroys the context
-
-        :param future: concurrent.futures.Future not used
+        """Stops the event loop, after which run closes the sockets and
+        destroys the context.
         """
-        self._event_loop.call_soon_threadsafe(self._event_loop.stop)
+        self._event_loop.call_soon(self._event_loop.stop)
+
+    def run(self):
+        try:
+            self._event_loop = zmq.asyncio.ZMQEventLoop()
+            asyncio.set_event_loop(self._event_loop)
+            self._context = zmq.asyncio.Context()
+            self._sock = self._context.socket(zmq.DEALER)
+            self._sock.identity = self.identity
+            self._sock.setsockopt(
+                zmq.RECONNECT_IVL, int(self._reconnect_interval * 1000))
+            self._sock.setsockopt(
+                zmq.RECONNECT_IVL_MAX,
+                int(self._max_reconnect_interval * 1000))
+
+            # The monitor is started first, so that no event is missed.
+            self._monitor_fd = "inproc://monitor.s-{}".format(
+                _generate_id()[0:5])
+            self._monitor_sock = self._sock.get_monitor_socket(
+                zmq.EVENT_CONNECTED | zmq.EVENT_DISCONNECTED,
+                addr=self._monitor_fd)
+
+            self._sock.connect(self._url)
+            self._send_wakeup = self._event_loop.create_future()
+            with self._condition:
+                self._condition.notify_all()
+            asyncio.ensure_future(self._send_message(),
+                                  loop=self._event_loop)
+            asyncio.ensure_future(self._receive_message(),
+                                  loop=self._event_loop)
+            asyncio.ensure_future(self._monitor_connection(),
+                                  loop=self._event_loop)
+            # pylint: disable=broad-except
+        except Exception as e:
+            LOGGER.error("Exception connecting to validator "
+                         "address %s, so shutting down", self._url)
+            self._error_queue.put_nowait(e)
+            return
+
+        self._error_queue.put_nowait(_NO_ERROR)
+        self._ready_event.set()
+        # Runs until shutdown, across any number of reconnects.
+        self._event_loop.run_forever()
         self._sock.close(linger=0)
         self._monitor_sock.close(linger=0)
         self._context.destroy(linger=0)
 
-    def run(self):
-        first_time = True
-        while True:
-            try:
-                if self._event_loop is None:
-                    self._event_loop = zmq.asyncio.ZMQEventLoop()
-                    asyncio.set_event_loop(self._event_loop)
-                if self._context is None:
-                    self._context = zmq.asyncio.Context()
-                if self._sock is None:
-                    self._sock = self._context.socket(zmq.DEALER)
-                self._sock.identity = self.identity
-
-                self._sock.connect(self._url)
-
-                self._monitor_fd = "inproc://monitor.s-{}".format(
-                    _generate_id()[0:5])
-                self._monitor_sock = self._sock.get_monitor_socket(
-                    zmq.EVENT_DISCONNECTED,
-                    addr=self._monitor_fd)
-                self._send_queue = asyncio.Queue(loop=self._event_loop)
-                self._recv_queue = asyncio.Queue(loop=self._event_loop)
-                if first_time is False:
-                    self._recv_queue.put_nowait(RECONNECT_EVENT)
-                with self._condition:
-                    self._condition.notify_all()
-                asyncio.ensure_future(self._send_message(),
-                                      loop=self._event_loop)
-                asyncio.ensure_future(self._receive_message(),
-                                      loop=self._event_loop)
-                asyncio.ensure_future(self._monitor_disconnects(),
-                                      loop=self._event_loop)
-                # pylint: disable=broad-except
-            except Exception as e:
-                LOGGER.error("Exception connecting to validator "
-                             "address %s, so shutting down", self._url)
-                self._error_queue.put_nowait(e)
-                break
-
-            self._error_queue.put_nowait(_NO_ERROR)
-            self._ready_event.set()
-            self._event_loop.run_forever()
-            if self._shutdown:
-                self._sock.close(linger=0)
-                self._monitor_sock.close(linger=0)
-                self._context.destroy(linger=0)
-                break
-            if first_time is True:
-                first_time = False
-
 
 class Stream:
-    def __init__(self, url):
+    def __init__(self, url, max_batch=DEFAULT_MAX_BATCH, metrics=None,
+                 answer_pings=False,
+                 reconnect_interval=DEFAULT_RECONNECT_INTERVAL,
+                 max_reconnect_interval=DEFAULT_MAX_RECONNECT_INTERVAL,
+                 receive_queue=None, labels=None, connect_events=False):
+        """
+        :param url (str): the address to connect to the validator on
+        :param max_batch (int): the most messages sent, or received, each
+               time the event loop services the socket
+        :param metrics (MetricsRegistry): where the stream records its
+               metrics; a new registry is used if not given
+        :param answer_pings (bool): whether pings from the validator are
+               answered on the stream's own thread, as soon as they are
+               received, instead of being returned by receive
+        :param reconnect_interval (float): the seconds before the first
+               attempt to reconnect after the connection drops, which
+               doubles after each failed attempt
+        :param max_reconnect_interval (float): the most seconds between
+               attempts to reconnect
+        :param receive_queue: the queue, shared with other streams, that
+               messages are received on, as used by StreamGroup; if
+               given, receive is not used
+        :param labels (dict): labels of each metric the stream records,
+               to tell apart the streams recording to one registry
+        :param connect_events (bool): whether receive returns
+               RECONNECT_EVENT on first connecting too, as well as on
+               reconnecting
+        """
         self._url = url
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
         self._futures = FutureCollection()
+        self._generate_correlation_id = _CorrelationIdGenerator()
         self._event = Event()
         self._event.set()
         error_queue = Queue()
@@ -266,7 +646,15 @@ class Stream:
             url,
             futures=self._futures,
             ready_event=self._event,
-            error_queue=error_queue)
+            error_queue=error_queue,
+            max_batch=max_batch,
+            metrics=self.metrics,
+            answer_pings=answer_pings,
+            reconnect_interval=reconnect_interval,
+            max_reconnect_interval=max_reconnect_interval,
+            recv_queue=receive_queue,
+            labels=labels,
+            connect_events=connect_events)
         self._send_recieve_thread.start()
         err = error_queue.get()
         if err is not _NO_ERROR:
@@ -291,16 +679,19 @@ class Stream:
         :raises: (ValidatorConnectionError)
         """
 
+        connection = self._send_recieve_thread.connection
         if not self._event.is_set():
             raise ValidatorConnectionError()
-        message = validator_pb2.Message(
-            message_type=message_type,
-            correlation_id=_generate_id(),
-            content=content)
-        future = Future(message.correlation_id, request_type=message_type)
+        correlation_id = self._generate_correlation_id()
+        future = Future(correlation_id, request_type=message_type)
         self._futures.put(future)
 
-        self._send_recieve_thread.put_message(message)
+        self._put_message(message_type, correlation_id, content)
+        # Had the connection dropped since it was found ready, the message
+        # may have been dropped, after the futures then outstanding were
+        # failed, and so the future is failed too.
+        if self._send_recieve_thread.connection != connection:
+            self._futures.resolve(correlation_id, FutureError())
         return future
 
     def send_back(self, message_type, correlation_id, content):
@@ -313,11 +704,17 @@ class Stream:
         """
         if not self._event.is_set():
             raise ValidatorConnectionError()
-        message = validator_pb2.Message(
+        self._put_message(message_type, correlation_id, content)
+
+    def _put_message(self, message_type, correlation_id, content):
+        message_bytes = validator_pb2.Message(
             message_type=message_type,
             correlation_id=correlation_id,
-            content=content)
-        self._send_recieve_thread.put_message(message)
+            content=content).SerializeToString()
+        capture = self._send_recieve_thread.capture
+        if capture is not None:
+            capture.record(OUTBOUND, message_type, message_bytes)
+        self._send_recieve_thread.put_message(message_bytes)
 
     def receive(self):
         """
@@ -326,6 +723,15 @@ class Stream:
         """
         return self._send_recieve_thread.get_message()
 
+    def run_coroutine(self, coro):
+        """
+        Run a coroutine on the event loop that services the connection.
+        Futures returned by send are resolved on this loop.
+        :param coro: the coroutine to run
+        :return: concurrent.futures.Future
+        """
+        return self._send_recieve_thread.run_coroutine(coro)
+
     def wait_for_ready(self):
         """Blocks until the background thread has recovered
         from a disconnect with the validator.
@@ -340,5 +746,179 @@ class Stream:
         """
         return self._event.is_set()
 
+    def set_capture(self, capture):
+        """Records the messages sent and received by the stream.
+
+        :param capture (capture.CaptureWriter): where messages are
+               recorded, or None to stop recording
+        """
+        self._send_recieve_thread.capture = capture
+
+    def set_admission_limit(self, max_queued, reject):
+        """Bounds the number of messages that have been received but not
+        yet returned by receive. Messages beyond the bound are passed to
+        reject, on the stream's own thread, which should answer them
+        without blocking, e.g. with a status telling the sender to retry.
+
+        Receiving is never paused instead, as the responses to the
+        requests of the threads calling receive arrive on the same
+        connection, and pausing would keep those threads from ever taking
+        further messages.
+
+        :param max_queued (int): the most messages waiting to be received,
+               or None for no bound
+        :param reject (callable): called with each message received while
+               max_queued are waiting; it returns True if it has answered
+               the message, or False if the message should be queued anyway
+        """
+        if max_queued is not None and max_queued < 1:
+            raise ValueError("max_queued must be at least 1")
+        self._send_recieve_thread.set_admission_limit(max_queued, reject)
+
+    def set_zero_copy(self, enabled):
+        """Sets whether messages are parsed directly from the frames ZMQ
+        receives them into, rather than from a copy of each frame. The
+        content of each message received is then a memoryview of its
+        frame, rather than bytes, so that it is only copied when parsed by
+        the receiver. This saves two copies of every message, which is
+        worthwhile when messages are large, but adds a few microseconds to
+        each message, so it is off by default.
+
+        :param enabled (bool): whether frames are not copied
+        """
+        self._send_recieve_thread.zero_copy = enabled
+
     def close(self):
         self._send_recieve_thread.shutdown()
+
+
+class _StreamQueue:
+    """A Stream's view of the _ReceiveQueue it shares with the other
+    streams of a StreamGroup. Each message is queued along with the view,
+    so that the group can tell which stream received it.
+
+    Clearing the view cannot take the stream's messages out of the shared
+    queue, from among those of the other streams, so it marks them stale
+    instead, and the group skips them.
+    """
+
+    __slots__ = ('stream', '_queue', '_connection')
+
+    def __init__(self, queue):
+        self.stream = None
+        self._queue = queue
+        self._connection = 0
+
+    def put(self, message):
+        self._queue.put((self, self._connection, message))
+
+    def clear(self):
+        self._connection += 1
+
+    def is_current(self, connection):
+        return connection == self._connection
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class _GroupReceiveFuture:
+    """The next message received by any stream of a StreamGroup that is
+    not a response, as returned by StreamGroup.receive.
+    """
+
+    __slots__ = ('_queue', '_result')
+
+    def __init__(self, receive_queue):
+        self._queue = receive_queue
+        self._result = None
+
+    def result(self, timeout=None):
+        """
+        :return (tuple): the Stream that received the message, and the
+            message
+        :raises (concurrent.futures.TimeoutError): if no message arrives
+            within the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._result is None:
+            remaining = None if deadline is None \
+                else max(0, deadline - time.monotonic())
+            view, connection, message = self._queue.get(remaining)
+            if view.is_current(connection):
+                self._result = (view.stream, message)
+        return self._result
+
+
+class StreamGroup:
+    """Connections to several validators, through a Stream each, whose
+    messages are received together.
+
+    Each stream connects, and reconnects, on its own, so while one
+    validator is unreachable the messages of the others are still
+    received, and answered over the streams they came from.
+    """
+
+    def __init__(self, urls, metrics=None, **kwargs):
+        """
+        :param urls (list of str): the addresses of the validators
+        :param metrics (MetricsRegistry): where the streams record their
+               metrics, labelled with the address of their validator when
+               there is more than one; a new registry is used if not given
+        :param kwargs: the other arguments of each Stream
+        """
+        if not urls:
+            raise ValueError("At least one validator url is required")
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._queue = _ReceiveQueue(self.metrics.histogram(
+            'stream_receive_queue_seconds', buckets=LATENCY_BUCKETS))
+        self.metrics.gauge('stream_receive_queue_depth').set_function(
+            lambda: len(self._queue))
+        self.streams = []
+        self._views = {}
+        try:
+            for url in urls:
+                view = _StreamQueue(self._queue)
+                view.stream = Stream(
+                    url, metrics=self.metrics, receive_queue=view,
+                    labels={'validator': url} if len(urls) > 1 else None,
+                    **kwargs)
+                self.streams.append(view.stream)
+                self._views[view.stream] = view
+        except Exception:
+            self.close()
+            raise
+
+    def receive(self):
+        """
+        :return: a future for the next message received by any of the
+            streams that is not a response, whose result is the stream
+            and the message
+        """
+        return _GroupReceiveFuture(self._queue)
+
+    def notify(self, stream, event):
+        """Queues an event for receive, as if stream had received it, e.g.
+        to hand the thread receiving the outcome of work done elsewhere.
+
+        :param stream (Stream): one of the group's streams; the event is
+               dropped if it has been removed
+        :param event: returned by receive with the stream
+        """
+        view = self._views.get(stream)
+        if view is not None:
+            view.put(event)
+
+    def remove(self, stream):
+        """Closes one of the group's streams, and skips the messages it has
+        received that have yet to be returned by receive.
+
+        :param stream (Stream): one of the group's streams
+        """
+        self.streams.remove(stream)
+        self._views.pop(stream).clear()
+        stream.close()
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
@@ -12,6 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ------------------------------------------------------------------------------
+import asyncio
+import time
+
+from sawtooth_sdk.messaging.future import FutureTimeoutError
 from sawtooth_sdk.protobuf.validator_pb2 import Message
 from sawtooth_sdk.protobuf import state_context_pb2
 from sawtooth_sdk.protobuf import events_pb2
@@ -19,21 +23,177 @@ from sawtooth_sdk.processor.exceptions import InternalError
 from sawtooth_sdk.processor.exceptions import AuthorizationException
 
 
+class ContextFuture:
+    """
+    ContextFuture is the pending result of a request made through one of
+    the non-blocking Context methods. The response is checked the first
+    time result is called.
+    """
+
+    def __init__(self, future=None, parse=None, result=None, error=None,
+                 deadline=None):
+        """
+        Args:
+            future (sawtooth_sdk.messaging.future.Future): the future for
+                the validator's response, or None if the result is known
+            parse (callable): turns the response content into the result,
+                raising if the validator reported an error
+            result: the result, when no request was needed
+            error (Exception): the error result raises, when no request
+                was needed
+            deadline (float): the time.monotonic() after which waiting for
+                the response raises InternalError, or None
+        """
+        self._future = future
+        self._deadline = deadline
+        self._parse = parse
+        self._result = result
+        self._error = error
+        self._resolved = future is None
+
+    def done(self):
+        return self._resolved or self._future.done()
+
+    def result(self, timeout=None):
+        """
+        Args:
+            timeout: optional timeout, in seconds
+        Returns:
+            the result of the request, as returned by the equivalent
+            blocking Context method
+
+        Raises:
+            AuthorizationException
+            InternalError: also if the transaction's deadline passes
+            FutureTimeoutError
+        """
+        if not self._resolved:
+            if self._deadline is None:
+                content = self._future.result(timeout).content
+            else:
+                content = _within_deadline(
+                    self._future.result, self._deadline, timeout).content
+            try:
+                self._result = self._parse(content)
+            except (AuthorizationException, InternalError) as err:
+                self._error = err
+            self._resolved = True
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _within_deadline(wait, deadline, timeout):
+    """Calls wait with the lesser of timeout and the time left before
+    deadline, raising InternalError if it is deadline that runs out.
+    """
+    remaining = max(deadline - time.monotonic(), 0)
+    if timeout is not None and timeout < remaining:
+        return wait(timeout)
+    try:
+        return wait(remaining)
+    except FutureTimeoutError:
+        raise InternalError('Transaction deadline exceeded') from None
+
+
+def gather(futures, timeout=None):
+    """Waits for each of the given ContextFutures and returns their results
+    in the same order. The timeout applies to the wait as a whole.
+
+    Args:
+        futures (list): ContextFutures from the non-blocking Context methods
+        timeout: optional timeout, in seconds
+    Returns:
+        results (list): the result of each future
+
+    Raises:
+        AuthorizationException
+        InternalError
+        FutureTimeoutError
+    """
+    if timeout is None:
+        return [f.result() for f in futures]
+
+    deadline = time.monotonic() + timeout
+    return [
+        f.result(max(deadline - time.monotonic(), 0)) for f in futures
+    ]
+
+
 class Context:
     """
     Context provides an interface for getting, setting, and deleting
     validator state. All validator interactions by a handler should be
     through a Context instance.
 
+    Each method blocks until the validator has responded. Each also has
+    a non-blocking variant, suffixed with _async, that sends the request
+    and returns a ContextFuture, so that several independent requests can
+    be outstanding at once and waited on together with gather.
+
+    When the cache is enabled, the data at each address read, set or
+    deleted through the Context is remembered for the rest of the
+    transaction, and later reads of those addresses are answered locally.
+    With write_back enabled as well, set_state and delete_state only
+    record the change; the changes are sent to the validator by flush,
+    which the TransactionProcessor calls once apply has returned.
+
     Attributes:
         _stream (sawtooth.client.stream.Stream): client grpc communication
         _context_id (str): the context_id passed in from the validator
+        _caching (bool): whether the state cache is enabled
+        _cache (dict): address to data for the addresses known this
+            transaction, with b'' for unset addresses; empty unless
+            caching is enabled
+        _pending (dict): address to data for the changes not yet flushed,
+            with None for deletions
+        _metrics (MetricsRegistry): where the latency of each request is
+            recorded, or None
+        _span (tracing.Span): the span of the transaction, under which
+            each request is traced, or None
+        _recorder (memo.ExecutionRecorder): what each request is passed
+            to, or None
+        _deadline (float): the time.monotonic() by which the transaction
+            must be done, after which waiting for any response raises
+            InternalError, or None
 
     """
 
-    def __init__(self, stream, context_id):
+    def __init__(self, stream, context_id, cache=False, write_back=False,
+                 metrics=None, span=None, deadline=None):
         self._stream = stream
         self._context_id = context_id
+        self._caching = cache or write_back
+        self._cache = {}
+        self._write_back = write_back
+        self._pending = {}
+        self._metrics = metrics
+        self._span = span
+        self._request_count = 0
+        self._recorder = None
+        self._deadline = deadline
+
+    @property
+    def request_count(self):
+        """The number of requests sent to the validator so far."""
+        return self._request_count
+
+    def record(self, recorder):
+        """Passes each request sent from now on, and the future of its
+        response, to recorder.sent.
+        """
+        self._recorder = recorder
+
+    def _future(self, future, parse):
+        return ContextFuture(future, parse, deadline=self._deadline)
+
+    def _send(self, message_type, content):
+        self._request_count += 1
+        future = _send(
+            self._stream, message_type, content, self._metrics, self._span)
+        if self._recorder is not None:
+            self._recorder.sent(message_type, content, future)
+        return future
 
     def get_state(self, addresses, timeout=None):
         """
@@ -51,21 +211,63 @@ class Context:
         Raises:
             AuthorizationException
         """
-        request = state_context_pb2.TpStateGetRequest(
-            context_id=self._context_id,
-            addresses=addresses)
-        response_string = self._stream.send(
-            Message.TP_STATE_GET_REQUEST,
-            request.SerializeToString()).result(timeout).content
-        response = state_context_pb2.TpStateGetResponse()
-        response.ParseFromString(response_string)
-        if response.status == \
-                state_context_pb2.TpStateGetResponse.AUTHORIZATION_ERROR:
-            raise AuthorizationException(
-                'Tried to get unauthorized address: {}'.format(addresses))
-        entries = response.entries if response is not None else []
-        results = [e for e in entries if len(e.data) != 0]
-        return results
+        return self.get_state_async(addresses).result(timeout)
+
+    def get_state_async(self, addresses):
+        """
+        The non-blocking variant of get_state.
+
+        Args:
+            addresses (list): the addresses to fetch
+        Returns:
+            (ContextFuture): resolves to the result of get_state
+        """
+        if not self._caching:
+            return self._future(
+                self._send(
+                    Message.TP_STATE_GET_REQUEST,
+                    _get_request(self._context_id, addresses)),
+                lambda content: _parse_get_response(content, addresses))
+
+        known = {a: self._cache[a] for a in addresses if a in self._cache}
+        missing = [a for a in addresses if a not in known]
+        if not missing:
+            return ContextFuture(result=_entries(addresses, known))
+
+        def parse(content):
+            fetched = dict.fromkeys(missing, b'')
+            fetched.update(
+                (e.address, e.data)
+                for e in _parse_get_response(content, missing))
+            # Anything cached since the request was sent is newer.
+            for address, data in fetched.items():
+                self._cache.setdefault(address, data)
+            fetched.update(known)
+            return _entries(addresses, fetched)
+
+        return self._future(
+            self._send(
+                Message.TP_STATE_GET_REQUEST,
+                _get_request(self._context_id, missing)),
+            parse)
+
+    def prefetch(self, addresses, timeout=None):
+        """
+        prefetch reads the given addresses into the cache with a single
+        request, so that the handler's later reads of them are answered
+        locally. If the validator refuses any of the addresses nothing is
+        cached, and the handler's own reads report the error.
+
+        Args:
+            addresses (list): the addresses to fetch
+            timeout: optional timeout, in seconds
+        """
+        if not self._caching:
+            raise ValueError("prefetch requires the cache to be enabled")
+        try:
+            self.get_state(addresses, timeout)
+        except AuthorizationException:
+            pass
 
     def set_state(self, entries, timeout=None):
         """
@@ -73,6 +275,9 @@ class Context:
         set in validator state to its corresponding value. A list is
         returned containing the successfully set addresses.
 
+        With write_back enabled the addresses are only recorded, so every
+        address is returned and authorization is checked on flush.
+
         Args:
             entries (dict): dictionary where addresses are the keys and data is
                 the value.
@@ -84,23 +289,29 @@ class Context:
         Raises:
             AuthorizationException
         """
-        state_entries = [
-            state_context_pb2.TpStateEntry(address=e, data=entries[e])
-            for e in entries
-        ]
-        request = state_context_pb2.TpStateSetRequest(
-            entries=state_entries,
-            context_id=self._context_id).SerializeToString()
-        response = state_context_pb2.TpStateSetResponse()
-        response.ParseFromString(
-            self._stream.send(Message.TP_STATE_SET_REQUEST,
-                              request).result(timeout).content)
-        if response.status == \
-                state_context_pb2.TpStateSetResponse.AUTHORIZATION_ERROR:
-            addresses = [e.address for e in state_entries]
-            raise AuthorizationException(
-                'Tried to set unauthorized address: {}'.format(addresses))
-        return response.addresses
+        return self.set_state_async(entries).result(timeout)
+
+    def set_state_async(self, entries):
+        """
+        The non-blocking variant of set_state.
+
+        Args:
+            entries (dict): dictionary where addresses are the keys and data is
+                the value.
+        Returns:
+            (ContextFuture): resolves to the result of set_state
+        """
+        if self._caching:
+            self._cache.update(entries)
+        if self._write_back:
+            self._pending.update(entries)
+            return ContextFuture(result=list(entries))
+
+        return self._future(
+            self._send(
+                Message.TP_STATE_SET_REQUEST,
+                _set_request(self._context_id, entries)),
+            lambda content: _parse_set_response(content, entries))
 
     def delete_state(self, addresses, timeout=None):
         """
@@ -108,6 +319,9 @@ class Context:
         in validator state. A list of successfully deleted addresses
         is returned.
 
+        With write_back enabled the addresses are only recorded, so every
+        address is returned and authorization is checked on flush.
+
         Args:
             addresses (list): list of addresses to delete
             timeout: optional timeout, in seconds
@@ -118,18 +332,61 @@ class Context:
         Raises:
             AuthorizationException
         """
-        request = state_context_pb2.TpStateDeleteRequest(
-            context_id=self._context_id,
-            addresses=addresses).SerializeToString()
-        response = state_context_pb2.TpStateDeleteResponse()
-        response.ParseFromString(
-            self._stream.send(Message.TP_STATE_DELETE_REQUEST,
-                              request).result(timeout).content)
-        if response.status == \
-                state_context_pb2.TpStateDeleteResponse.AUTHORIZATION_ERROR:
-            raise AuthorizationException(
-                'Tried to delete unauthorized address: {}'.format(addresses))
-        return response.addresses
+        return self.delete_state_async(addresses).result(timeout)
+
+    def delete_state_async(self, addresses):
+        """
+        The non-blocking variant of delete_state.
+
+        Args:
+            addresses (list): list of addresses to delete
+        Returns:
+            (ContextFuture): resolves to the result of delete_state
+        """
+        if self._caching:
+            self._cache.update(dict.fromkeys(addresses, b''))
+        if self._write_back:
+            self._pending.update(dict.fromkeys(addresses))
+            return ContextFuture(result=list(addresses))
+
+        return self._future(
+            self._send(
+                Message.TP_STATE_DELETE_REQUEST,
+                _delete_request(self._context_id, addresses)),
+            lambda content: _parse_delete_response(content, addresses))
+
+    def flush(self, timeout=None):
+        """Sends the changes recorded with write_back enabled to the
+        validator, as at most one set and one delete request. Only the
+        last change made to each address is sent.
+
+        Args:
+            timeout: optional timeout, in seconds
+
+        Raises:
+            AuthorizationException
+        """
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        entries = {a: d for a, d in pending.items() if d is not None}
+        deletions = [a for a, d in pending.items() if d is None]
+
+        futures = []
+        if entries:
+            futures.append(self._future(
+                self._send(
+                    Message.TP_STATE_SET_REQUEST,
+                    _set_request(self._context_id, entries)),
+                lambda content: _parse_set_response(content, entries)))
+        if deletions:
+            futures.append(self._future(
+                self._send(
+                    Message.TP_STATE_DELETE_REQUEST,
+                    _delete_request(self._context_id, deletions)),
+                lambda content: _parse_delete_response(content, deletions)))
+        gather(futures, timeout)
 
     def add_receipt_data(self, data, timeout=None):
         """Add a blob to the execution result for this transaction.
@@ -137,17 +394,22 @@ class Context:
         Args:
             data (bytes): The data to add.
         """
-        request = state_context_pb2.TpReceiptAddDataRequest(
-            context_id=self._context_id,
-            data=data).SerializeToString()
-        response = state_context_pb2.TpReceiptAddDataResponse()
-        response.ParseFromString(
-            self._stream.send(
+        self.add_receipt_data_async(data).result(timeout)
+
+    def add_receipt_data_async(self, data):
+        """
+        The non-blocking variant of add_receipt_data.
+
+        Args:
+            data (bytes): The data to add.
+        Returns:
+            (ContextFuture): resolves to None once the data is added
+        """
+        return self._future(
+            self._send(
                 Message.TP_RECEIPT_ADD_DATA_REQUEST,
-                request).result(timeout).content)
-        if response.status == state_context_pb2.TpReceiptAddDataResponse.ERROR:
-            raise InternalError(
-                "Failed to add receipt data: {}".format((data)))
+                _receipt_request(self._context_id, data)),
+            lambda content: _parse_receipt_response(content, data))
 
     def add_event(self, event_type, attributes=None, data=None, timeout=None):
         """Add a new event to the execution result for this transaction.
@@ -162,25 +424,265 @@ class Context:
             data (bytes): Additional information about the event that is opaque
                 to the validator.
         """
+        self.add_event_async(event_type, attributes, data).result(timeout)
+
+    def add_event_async(self, event_type, attributes=None, data=None):
+        """
+        The non-blocking variant of add_event.
+
+        Args:
+            event_type (str): see add_event
+            attributes (list of (str, str) tuples): see add_event
+            data (bytes): see add_event
+        Returns:
+            (ContextFuture): resolves to None once the event is added
+        """
         if attributes is None:
             attributes = []
 
-        event = events_pb2.Event(
-            event_type=event_type,
-            attributes=[
-                events_pb2.Event.Attribute(key=key, value=value)
-                for key, value in attributes
-            ],
-            data=data,
-        )
-        request = state_context_pb2.TpEventAddRequest(
-            context_id=self._context_id, event=event).SerializeToString()
-        response = state_context_pb2.TpEventAddResponse()
-        response.ParseFromString(
-            self._stream.send(
+        return self._future(
+            self._send(
                 Message.TP_EVENT_ADD_REQUEST,
-                request).result(timeout).content)
-        if response.status == state_context_pb2.TpEventAddResponse.ERROR:
-            raise InternalError(
-                "Failed to add event: ({}, {}, {})".format(
-                    event_type, attributes, data))
+                _event_request(
+                    self._context_id, event_type, attributes, data)),
+            lambda content: _parse_event_response(
+                content, event_type, attributes, data))
+
+
+class AsyncContext:
+    """
+    AsyncContext provides the same interface as Context for use by an
+    AsyncTransactionHandler, except that every method is a coroutine.
+    The responses from the validator are resolved directly on the event
+    loop of the Stream, so a handler awaiting state does not occupy a
+    thread while the request is outstanding.
+
+    Attributes:
+        _stream (sawtooth.client.stream.Stream): client grpc communication
+        _context_id (str): the context_id passed in from the validator
+        _deadline (float): see Context
+    """
+
+    def __init__(self, stream, context_id, metrics=None, span=None,
+                 deadline=None):
+        self._stream = stream
+        self._deadline = deadline
+        self._metrics = metrics
+        self._span = span
+        self._request_count = 0
+        self._context_id = context_id
+
+    async def get_state(self, addresses, timeout=None):
+        """See Context.get_state."""
+        content = await self._send(
+            Message.TP_STATE_GET_REQUEST,
+            _get_request(self._context_id, addresses),
+            timeout)
+        return _parse_get_response(content, addresses)
+
+    async def set_state(self, entries, timeout=None):
+        """See Context.set_state."""
+        content = await self._send(
+            Message.TP_STATE_SET_REQUEST,
+            _set_request(self._context_id, entries),
+            timeout)
+        return _parse_set_response(content, entries)
+
+    async def delete_state(self, addresses, timeout=None):
+        """See Context.delete_state."""
+        content = await self._send(
+            Message.TP_STATE_DELETE_REQUEST,
+            _delete_request(self._context_id, addresses),
+            timeout)
+        return _parse_delete_response(content, addresses)
+
+    async def add_receipt_data(self, data, timeout=None):
+        """See Context.add_receipt_data."""
+        content = await self._send(
+            Message.TP_RECEIPT_ADD_DATA_REQUEST,
+            _receipt_request(self._context_id, data),
+            timeout)
+        _parse_receipt_response(content, data)
+
+    async def add_event(self, event_type, attributes=None, data=None,
+                        timeout=None):
+        """See Context.add_event."""
+        if attributes is None:
+            attributes = []
+
+        content = await self._send(
+            Message.TP_EVENT_ADD_REQUEST,
+            _event_request(self._context_id, event_type, attributes, data),
+            timeout)
+        _parse_event_response(content, event_type, attributes, data)
+
+    @property
+    def request_count(self):
+        """See Context.request_count."""
+        return self._request_count
+
+    async def _send(self, message_type, content, timeout):
+        self._request_count += 1
+        future = _send(
+            self._stream, message_type, content, self._metrics, self._span)
+        waiter = asyncio.get_event_loop().create_future()
+
+        def _resolve(result):
+            if not waiter.done():
+                waiter.set_result(result)
+
+        # The Stream resolves its futures on its own event loop, which is
+        # the loop this coroutine runs on, so the waiter can be resolved
+        # directly from the callback.
+        future.add_done_callback(_resolve)
+        deadline_first = False
+        if self._deadline is not None:
+            remaining = max(self._deadline - time.monotonic(), 0)
+            if timeout is None or remaining <= timeout:
+                timeout = remaining
+                deadline_first = True
+        try:
+            result = await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            if deadline_first:
+                raise InternalError('Transaction deadline exceeded') from None
+            raise FutureTimeoutError(
+                'Future timed out waiting for response to {}'.format(
+                    Message.MessageType.Name(message_type))) from None
+        return result.content
+
+
+# The request label of the tp_context_request_seconds histogram, and the
+# name of the span of each request.
+_REQUEST_NAMES = {
+    Message.TP_STATE_GET_REQUEST: 'get',
+    Message.TP_STATE_SET_REQUEST: 'set',
+    Message.TP_STATE_DELETE_REQUEST: 'delete',
+    Message.TP_RECEIPT_ADD_DATA_REQUEST: 'add_receipt_data',
+    Message.TP_EVENT_ADD_REQUEST: 'add_event',
+}
+
+
+def _send(stream, message_type, content, metrics, span):
+    """Sends a request, recording the time until its response arrives in
+    metrics and as a child of span, if given.
+    """
+    future = stream.send(message_type, content)
+    if metrics is None and span is None:
+        return future
+
+    name = _REQUEST_NAMES[message_type]
+    latency = None
+    if metrics is not None:
+        latency = metrics.histogram('tp_context_request_seconds', request=name)
+    child = None
+    if span is not None:
+        child = span.child('context.' + name, bytes=len(content))
+    sent = time.monotonic()
+
+    def record(_):
+        if latency is not None:
+            latency.observe(time.monotonic() - sent)
+        if child is not None:
+            child.end()
+
+    future.add_done_callback(record)
+    return future
+
+
+def _entries(addresses, data):
+    return [
+        state_context_pb2.TpStateEntry(address=a, data=data[a])
+        for a in addresses if data[a]
+    ]
+
+
+def _get_request(context_id, addresses):
+    return state_context_pb2.TpStateGetRequest(
+        context_id=context_id,
+        addresses=addresses).SerializeToString()
+
+
+def _parse_get_response(response_string, addresses):
+    response = state_context_pb2.TpStateGetResponse()
+    response.ParseFromString(response_string)
+    if response.status == \
+            state_context_pb2.TpStateGetResponse.AUTHORIZATION_ERROR:
+        raise AuthorizationException(
+            'Tried to get unauthorized address: {}'.format(addresses))
+    entries = response.entries if response is not None else []
+    results = [e for e in entries if len(e.data) != 0]
+    return results
+
+
+def _set_request(context_id, entries):
+    state_entries = [
+        state_context_pb2.TpStateEntry(address=e, data=entries[e])
+        for e in entries
+    ]
+    return state_context_pb2.TpStateSetRequest(
+        entries=state_entries,
+        context_id=context_id).SerializeToString()
+
+
+def _parse_set_response(response_string, entries):
+    response = state_context_pb2.TpStateSetResponse()
+    response.ParseFromString(response_string)
+    if response.status == \
+            state_context_pb2.TpStateSetResponse.AUTHORIZATION_ERROR:
+        addresses = list(entries)
+        raise AuthorizationException(
+            'Tried to set unauthorized address: {}'.format(addresses))
+    return response.addresses
+
+
+def _delete_request(context_id, addresses):
+    return state_context_pb2.TpStateDeleteRequest(
+        context_id=context_id,
+        addresses=addresses).SerializeToString()
+
+
+def _parse_delete_response(response_string, addresses):
+    response = state_context_pb2.TpStateDeleteResponse()
+    response.ParseFromString(response_string)
+    if response.status == \
+            state_context_pb2.TpStateDeleteResponse.AUTHORIZATION_ERROR:
+        raise AuthorizationException(
+            'Tried to delete unauthorized address: {}'.format(addresses))
+    return response.addresses
+
+
+def _receipt_request(context_id, data):
+    return state_context_pb2.TpReceiptAddDataRequest(
+        context_id=context_id,
+        data=data).SerializeToString()
+
+
+def _parse_receipt_response(response_string, data):
+    response = state_context_pb2.TpReceiptAddDataResponse()
+    response.ParseFromString(response_string)
+    if response.status == state_context_pb2.TpReceiptAddDataResponse.ERROR:
+        raise InternalError(
+            "Failed to add receipt data: {}".format((data)))
+
+
+def _event_request(context_id, event_type, attributes, data):
+    event = events_pb2.Event(
+        event_type=event_type,
+        attributes=[
+            events_pb2.Event.Attribute(key=key, value=value)
+            for key, value in attributes
+        ],
+        data=data,
+    )
+    return state_context_pb2.TpEventAddRequest(
+        context_id=context_id, event=event).SerializeToString()
+
+
+def _parse_event_response(response_string, event_type, attributes, data):
+    response = state_context_pb2.TpEventAddResponse()
+    response.ParseFromString(response_string)
+    if response.status == state_context_pb2.TpEventAddResponse.ERROR:
+        raise InternalError(
+            "Failed to add event: ({}, {}, {})".format(
+                event_type, attributes, data))
@@ -13,23 +13,38 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+import asyncio
 from concurrent.futures import CancelledError
+from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
+import functools
 import itertools
 import logging
+from threading import BoundedSemaphore
+from threading import Lock
+from threading import Thread
+import time
 
 from enum import Enum
 
+from sawtooth_sdk.messaging.capture import CaptureWriter
 from sawtooth_sdk.messaging.exceptions import ValidatorConnectionError
 from sawtooth_sdk.messaging.exceptions import ValidatorVersionError
 from sawtooth_sdk.messaging.future import FutureTimeoutError
+from sawtooth_sdk.messaging.metrics import REQUEST_COUNT_BUCKETS
 from sawtooth_sdk.messaging.stream import RECONNECT_EVENT
-from sawtooth_sdk.messaging.stream import Stream
+from sawtooth_sdk.messaging.stream import StreamGroup
 
+from sawtooth_sdk.processor.context import AsyncContext
 from sawtooth_sdk.processor.context import Context
 from sawtooth_sdk.processor.exceptions import InvalidTransaction
 from sawtooth_sdk.processor.exceptions import InternalError
 from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.handler import AsyncTransactionHandler
+from sawtooth_sdk.processor.memo import ExecutionMemo
+from sawtooth_sdk.processor.profiling import ApplyProfiler
+from sawtooth_sdk.processor.watchdog import Watchdog
+from sawtooth_sdk.processor import tracing
 
 from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterRequest
 from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterResponse
@@ -38,12 +53,23 @@ from sawtooth_sdk.protobuf.processor_pb2 import TpUnregisterResponse
 from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
 from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
 from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
-from sawtooth_sdk.protobuf.network_pb2 import PingResponse
 from sawtooth_sdk.protobuf.validator_pb2 import Message
 
 
 LOGGER = logging.getLogger(__name__)
 
+# The length of a fully-qualified state address, in hex characters. Only
+# inputs of this length are prefetched; shorter inputs are prefixes.
+_ADDRESS_LENGTH = 70
+
+
+def _unhandled_error(err):
+    """Returns the InternalError a transaction is answered with when its
+    handler raises an unexpected error.
+    """
+    return InternalError("Unhandled {} in the transaction processor".format(
+        type(err).__name__))
+
 
 class TransactionProcessor:
     """TransactionProcessor is a generic class for communicating with a
@@ -61,26 +87,93 @@ class TransactionProcessor:
         FEATURE_CUSTOM_HEADER_STYLE = 1
         SDK_PROTOCOL_VERSION = 1
 
-    def __init__(self, url):
+    def __init__(self, url, max_workers=None):
         """
         Args:
-            url (string): The URL of the validator
+            url (string or list of string): The URL of the validator, or
+                the URLs of several validators. The processor keeps a
+                connection to each, registers with each as it connects,
+                and answers each validator's requests over its own
+                connection, so that it goes on serving the others while
+                one is unreachable.
+            max_workers (int, optional): The number of transactions that
+                may be processed concurrently. When set, requests are
+                dispatched to a pool of that many worker threads and the
+                capacity is advertised to the validator as max_occupancy.
+                When unset, transactions are processed one at a time on
+                the thread that called start().
         """
-        self._stream = Stream(url)
+        if max_workers is not None and max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        # Pings are answered by the stream's I/O thread, so that a busy
+        # handler does not delay the reply and make the validator consider
+        # the processor unresponsive. Registering is done as each stream
+        # connects, so that one validator being down does not hold up the
+        # others.
+        self._streams = StreamGroup(
+            [url] if isinstance(url, str) else list(url),
+            answer_pings=True, connect_events=True)
         self._url = url
         self._handlers = []
         self._highest_sdk_feature_requested = \
             self._FeatureVersion.FEATURE_UNUSED
         self._header_style = TpRegisterRequest.HEADER_STYLE_UNSET
+        self._max_workers = max_workers
+        self._executor = None
+        self._pool_lock = Lock()
+        self._occupancy = None
+        self._state_cache = False
+        self._write_back = False
+        self._prefetch_inputs = False
+        self._exporters = []
+        self._tracer = None
+        self._profiler = None
+        self._capture = None
+        self._memo = None
+        self._deadline = None
+        self._watchdog = None
+        # The watches of the transactions whose workers are stuck past
+        # their deadline, to whether another worker took their place, and
+        # of those whose workers returned before they were counted stuck.
+        self._stuck = {}
+        self._returned = set()
+        self._max_stuck = 0
+        # Bounds the transactions async handlers apply at once, when
+        # admission control is enabled.
+        self._async_slots = None
+        # The watches of the transactions being applied by async handlers,
+        # to the futures of their coroutines, which are cancelled at the
+        # deadline rather than counted stuck.
+        self._async_pending = {}
+        self._stop_lock = Lock()
+        self._stopped = False
 
     @property
     def zmq_id(self):
-        return self._stream.zmq_id
+        """The ZMQ identity of the connection to the first validator."""
+        return self._streams.streams[0].zmq_id
+
+    @property
+    def metrics(self):
+        """The MetricsRegistry in which the processor and its connection to
+        the validator record their metrics.
+        """
+        return self._streams.metrics
+
+    def add_metrics_exporter(self, exporter):
+        """Adds an exporter of the processor's metrics, which is started by
+        start() and stopped by stop().
+        Args:
+            exporter (MetricsExporter): e.g. a PrometheusExporter or
+                LogExporter
+        """
+        self._exporters.append(exporter)
 
     def add_handler(self, handler):
         """Adds a transaction family handler
         Args:
-            handler (TransactionHandler): the handler to be added
+            handler (TransactionHandler or AsyncTransactionHandler): the
+                handler to be added
         """
         self._handlers.append(handler)
 
@@ -96,6 +189,221 @@ class TransactionProcessor:
                 self._FeatureVersion.FEATURE_CUSTOM_HEADER_STYLE
         self._header_style = style
 
+    def enable_state_cache(self, write_back=False, prefetch_inputs=False):
+        """Enables the per-transaction state cache of the Context passed to
+        handlers, so that repeated reads of an address, or reads of an
+        address the handler has set or deleted, are answered without a
+        request to the validator. The AsyncContext passed to async
+        handlers has no cache, so their reads and writes are always sent
+        at once.
+        Args:
+            write_back (bool): whether to also hold back the handler's
+                set_state and delete_state calls and send them together
+                once apply has returned
+            prefetch_inputs (bool): whether to read every fully-qualified
+                address in the transaction's declared inputs with a single
+                request before apply is called
+        """
+        self._state_cache = True
+        self._write_back = write_back
+        self._prefetch_inputs = prefetch_inputs
+
+    def enable_tracing(self, exporter):
+        """Traces the processing of each transaction: a span is started for
+        each TP_PROCESS_REQUEST, with a child span for each request its
+        Context sends to the validator and for the response. Handlers may
+        add their own child spans with tracing.traced().
+        Args:
+            exporter (tracing.SpanExporter): receives each span as it ends,
+                e.g. a JsonLinesSpanExporter or HttpSpanExporter
+        """
+        self._tracer = tracing.Tracer(exporter)
+
+    def enable_profiling(self, every=0, signum=None, window=30.0,
+                         output_dir=None):
+        """Allows calls to the apply method of handlers to be profiled while
+        the processor runs. Async handlers are not profiled.
+        Args:
+            every (int): profile every Nth call; 0 profiles none until the
+                returned profiler's set_sampling or start_window is called
+            signum (int): if given, receiving this signal profiles every
+                call for the following window seconds; must be enabled from
+                the main thread
+            window (float): the length, in seconds, of the signal-triggered
+                window
+            output_dir (str): where the profiles are written; defaults to
+                the directory returned by get_log_dir()
+        Returns:
+            (ApplyProfiler): the profiler, which may be used to change what
+                is profiled at any time
+        """
+        self._profiler = ApplyProfiler(output_dir=output_dir)
+        self._profiler.set_sampling(every)
+        if signum is not None:
+            self._profiler.install_signal(signum, window)
+        return self._profiler
+
+    def enable_capture(self, path):
+        """Records each TP_PROCESS_REQUEST, the state and receipt requests
+        made while processing it with their responses, and the response to
+        the validator, in a capture file that can be replayed with
+        sawtooth_processor_test.replay.
+        Args:
+            path (str): the capture file to write
+        """
+        self._capture = CaptureWriter(path)
+        for stream in self._streams.streams:
+            stream.set_capture(self._capture)
+
+    def enable_memoization(self, max_entries=10000):
+        """Memoizes the executions of handlers whose deterministic property
+        is True, so that a transaction the validator sends again, for
+        another block or fork, is answered by replaying the handler's
+        changes when the state it read is unchanged. Async handlers are not
+        memoized.
+        Args:
+            max_entries (int): the most executions remembered; the least
+                recently used are forgotten first
+        Returns:
+            (ExecutionMemo): the memo, whose hit_rate may be read at any
+                time
+        """
+        self._memo = ExecutionMemo(max_entries, metrics=self.metrics)
+        return self._memo
+
+    def enable_zero_copy(self):
+        """Parses each TP_PROCESS_REQUEST received from the validator
+        directly from the frame ZMQ receives it into, rather than from a
+        copy of the frame and then from a copy of the message's content.
+        The request's TransactionHeader is still decoded in full, as it is
+        needed to route the request, and the payload is copied once more
+        when the handler reads it. Worthwhile when transactions carry
+        large payloads; see Stream.set_zero_copy.
+        """
+        for stream in self._streams.streams:
+            stream.set_zero_copy(True)
+
+    def enable_deadline(self, seconds, max_stuck_workers=None):
+        """Gives each transaction a deadline, after which it is answered
+        with INTERNAL_ERROR, which the validator retries later, whether or
+        not its handler has returned. Requests the handler's Context sends
+        only wait for the time left, and raise InternalError once it runs
+        out; what the handler does after its deadline is not sent.
+
+        With a worker pool, the worker still applying a transaction at its
+        deadline is left to finish on its own, as a thread cannot be
+        stopped, but the transaction's slot is freed and the pool may start
+        another worker in its place, so that the stuck worker does not
+        reduce the pool's throughput. Once max_stuck_workers are stuck, the
+        slots of further transactions are only freed when their workers
+        return. Without a pool, the transaction is answered, but the next
+        is only received once the handler returns. The coroutine of an
+        async handler is cancelled at its deadline instead, so it is never
+        counted stuck. Must be called before start.
+
+        Deadlines passed are counted by tp_deadline_exceeded_total, workers
+        found stuck by tp_workers_quarantined_total, and the workers stuck
+        at any time by tp_workers_stuck.
+        Args:
+            seconds (float): the time allowed for each transaction
+            max_stuck_workers (int, optional): the most stuck workers
+                replaced at once, which defaults to max_workers; the pool
+                has at most max_workers + max_stuck_workers threads
+        """
+        if seconds <= 0:
+            raise ValueError("seconds must be positive")
+        if max_stuck_workers is None:
+            max_stuck_workers = self._max_workers or 0
+        if max_stuck_workers < 0:
+            raise ValueError("max_stuck_workers must not be negative")
+        self._deadline = seconds
+        self._max_stuck = max_stuck_workers
+        if self._watchdog is None:
+            self._watchdog = Watchdog()
+            self.metrics.gauge('tp_workers_stuck').set_function(
+                lambda: len(self._stuck))
+
+    def _watch(self, stream, msg):
+        """Returns a Watch of the deadline of a TP_PROCESS_REQUEST, or None
+        if deadlines are disabled.
+        """
+        if self._watchdog is None or \
+                msg.message_type != Message.TP_PROCESS_REQUEST:
+            return None
+        return self._watchdog.watch(
+            time.monotonic() + self._deadline,
+            functools.partial(self._expire, stream, msg.correlation_id))
+
+    def _expire(self, stream, correlation_id, watch):
+        """Answers a transaction whose deadline has passed. Called on the
+        watchdog's thread.
+        """
+        LOGGER.warning("Transaction %s exceeded its deadline of %s seconds",
+                       correlation_id, self._deadline)
+        self.metrics.counter('tp_deadline_exceeded_total').inc()
+        self._respond(
+            stream, correlation_id,
+            InternalError('Transaction deadline exceeded'))
+        with self._pool_lock:
+            pending = self._async_pending.pop(watch, None)
+        if pending is not None:
+            pending.cancel()
+        elif self._max_workers is not None:
+            self._quarantine_worker(watch)
+
+    def enable_admission_control(self, max_queued):
+        """Bounds the TP_PROCESS_REQUESTs received but not yet handed to a
+        handler, so that a processor whose handlers fall behind does not
+        grow without bound. Requests received beyond the bound are answered
+        at once with INTERNAL_ERROR, which the validator retries later.
+        The requests rejected are counted by stream_receive_rejected_total,
+        and the time requests wait by stream_receive_queue_seconds.
+
+        Async handlers are handed each request as soon as it is received,
+        so at most max_queued transactions are applied by them at once;
+        requests received beyond that are answered in the same way, and
+        counted by tp_async_rejected_total.
+        Args:
+            max_queued (int): the most requests waiting for a handler, in
+                addition to those being processed, from all validators
+        """
+        for stream in self._streams.streams:
+            stream.set_admission_limit(
+                max_queued, functools.partial(self._reject, stream))
+        self._async_slots = None if max_queued is None \
+            else BoundedSemaphore(max_queued)
+
+    def _reject(self, stream, msg):
+        """Answers a request received while too many are waiting. Called
+        on the stream's thread, so it must not block.
+
+        Returns:
+            (bool): whether the message was answered
+        """
+        if msg.message_type != Message.TP_PROCESS_REQUEST:
+            return False
+        LOGGER.debug("Rejecting request %s: too many requests are waiting",
+                     msg.correlation_id)
+        try:
+            self._send_response(
+                stream, msg.correlation_id,
+                TpProcessResponse(
+                    status=TpProcessResponse.INTERNAL_ERROR,
+                    message='Transaction processor is overloaded'))
+        except ValidatorConnectionError:
+            pass
+        return True
+
+    def _start_span(self, request, header):
+        if self._tracer is None:
+            return None
+        return self._tracer.start_span(
+            'tp_process',
+            signature=request.signature,
+            family=header.family_name,
+            version=header.family_version,
+            context_id=request.context_id)
+
     def _matches(self, handler, header):
         return header.family_name == handler.family_name \
             and header.family_version in handler.family_versions
@@ -124,6 +432,7 @@ class TransactionProcessor:
                     family=n,
                     version=v,
                     namespaces=h.namespaces,
+                    max_occupancy=self._max_workers or 0,
                     protocol_version=self._highest_sdk_feature_requested.value,
                     request_header_style=self._header_style)
                  for n, v in itertools.product(
@@ -139,94 +448,286 @@ class TransactionProcessor:
         """
         return TpUnregisterRequest()
 
-    def _process(self, msg):
+    def _process(self, stream, msg, watch=None):
+        """Processes a TP_PROCESS_REQUEST.
+
+        :param stream (Stream): the stream the request was received on,
+            over which its state is read and it is responded to
+        :param watch (watchdog.Watch): the watch of the request's deadline,
+            which is cancelled when it is responded to, or None
+        :return (concurrent.futures.Future): when the request was handed to
+            an AsyncTransactionHandler, a future that completes once it has
+            been responded to; otherwise None.
+        """
         if msg.message_type != Message.TP_PROCESS_REQUEST:
             LOGGER.debug(
                 "Transaction Processor recieved invalid message type. "
                 "Message type should be TP_PROCESS_REQUEST,"
                 " but is %s", Message.MessageType.Name(msg.message_type))
-            return
+            return None
 
         request = TpProcessRequest()
         request.ParseFromString(msg.content)
-        state = Context(self._stream, request.context_id)
         if self._header_style == TpRegisterRequest.RAW:
             header = TransactionHeader()
             header.ParseFromString(request.header_bytes)
         else:
             header = request.header
+        state = None
+        start = time.monotonic()
+        span = self._start_span(request, header)
         try:
-            if not self._stream.is_ready():
+            if not stream.is_ready():
                 raise ValidatorConnectionError()
             handler = self._find_handler(header)
             if handler is None:
+                if watch is not None:
+                    watch.cancel()
+                return None
+            deadline = None if watch is None else watch.deadline
+            if isinstance(handler, AsyncTransactionHandler):
+                return self._start_async(
+                    stream, msg, handler, request, header, span, watch)
+            state = Context(
+                stream,
+                request.context_id,
+                cache=self._state_cache,
+                write_back=self._write_back,
+                metrics=self.metrics,
+                span=span,
+                deadline=deadline)
+            self._execute(handler, request, header, state, span)
+        except (InvalidTransaction, InternalError, AuthorizationException,
+                ValidatorConnectionError) as err:
+            status = self._respond(
+                stream, msg.correlation_id, err, span, watch)
+        else:
+            status = self._respond(
+                stream, msg.correlation_id, span=span, watch=watch)
+        self._record(header, status, start, state)
+        self._end_span(span, status)
+        return None
+
+    def _execute(self, handler, request, header, state, span):
+        """Applies the handler to the transaction, or replays its memoized
+        execution.
+        """
+        recorder = None
+        if self._memo is not None and handler.deterministic:
+            # Recording starts before the replay checks the state the
+            # memoized execution read, and before the prefetch, as with
+            # the cache enabled both answer the handler's reads without
+            # further requests.
+            recorder = self._memo.recorder(request.signature)
+            state.record(recorder)
+            if self._memo.replay(request.signature, state):
+                state.record(None)
+                state.flush()
                 return
+        if self._prefetch_inputs:
+            state.prefetch([
+                address for address in header.inputs
+                if len(address) == _ADDRESS_LENGTH])
+        try:
+            self._apply(handler, request, state, span)
+            state.flush()
+        except InvalidTransaction as err:
+            if recorder is not None:
+                recorder.finish(err)
+            raise
+        if recorder is not None:
+            recorder.finish()
+
+    def _apply(self, handler, request, state, span):
+        if span is not None:
+            with tracing.activate(span):
+                self._apply(handler, request, state, None)
+        elif self._profiler is not None:
+            self._profiler.call(handler.apply, request, state)
+        else:
             handler.apply(request, state)
-            self._stream.send_back(
-                message_type=Message.TP_PROCESS_RESPONSE,
-                correlation_id=msg.correlation_id,
-                content=TpProcessResponse(
-                    status=TpProcessResponse.OK
-                ).SerializeToString())
-        except InvalidTransaction as it:
-            LOGGER.warning("Invalid Transaction %s", it)
-            try:
-                self._stream.send_back(
-                    message_type=Message.TP_PROCESS_RESPONSE,
-                    correlation_id=msg.correlation_id,
-                    content=TpProcessResponse(
-                        status=TpProcessResponse.INVALID_TRANSACTION,
-                        message=str(it),
-                        extended_data=it.extended_data
-                    ).SerializeToString())
-            except ValidatorConnectionError as vce:
-                # TP_PROCESS_REQUEST has made it through the
-                # handler.apply and an INVALID_TRANSACTION would have been
-                # sent back but the validator has disconnected and so it
-                # doesn't care about the response.
-                LOGGER.warning("during invalid transaction response: %s", vce)
-        except InternalError as ie:
-            LOGGER.warning("internal error: %s", ie)
-            try:
-                self._stream.send_back(
-                    message_type=Message.TP_PROCESS_RESPONSE,
-                    correlation_id=msg.correlation_id,
-                    content=TpProcessResponse(
-                        status=TpProcessResponse.INTERNAL_ERROR,
-                        message=str(ie),
-                        extended_data=ie.extended_data
-                    ).SerializeToString())
-            except ValidatorConnectionError as vce:
-                # Same as the prior except block, but an internal error has
-                # happened, but because of the disconnect the validator
-                # probably doesn't care about the response.
-                LOGGER.warning("during internal error response: %s", vce)
-        except ValidatorConnectionError as vce:
+
+    def _start_async(self, stream, msg, handler, request, header, span,
+                     watch):
+        """Starts applying an async handler on the stream's event loop,
+        unless admission control is enabled and max_queued transactions
+        are already being applied, in which case the request is rejected.
+        The coroutine is cancelled should its deadline pass.
+
+        :return (concurrent.futures.Future): a future that completes once
+            the request has been responded to, or None if it was rejected
+            or its deadline passed before it started
+        """
+        slots = self._async_slots
+        if slots is not None and not slots.acquire(blocking=False):
+            if watch is not None:
+                watch.cancel()
+            self.metrics.counter('tp_async_rejected_total').inc()
+            self._reject(stream, msg)
+            self._end_span(span, TpProcessResponse.INTERNAL_ERROR)
+            return None
+        coroutine = self._process_async(
+            stream, handler, request, header, msg.correlation_id, span, watch)
+        with self._pool_lock:
+            # _expire takes the watch's future under the same lock, once
+            # the watch has expired.
+            if watch is not None and watch.expired:
+                coroutine.close()
+                pending = None
+            else:
+                pending = stream.run_coroutine(coroutine)
+                if watch is not None:
+                    self._async_pending[watch] = pending
+        if pending is None:
+            if slots is not None:
+                slots.release()
+            self._end_span(span, None)
+            return None
+        if watch is not None:
+            pending.add_done_callback(
+                lambda _: self._forget_async(watch))
+        if slots is not None:
+            pending.add_done_callback(lambda _: slots.release())
+        return pending
+
+    def _forget_async(self, watch):
+        # Once a watch has expired, _expire takes its future instead.
+        if watch.cancel():
+            with self._pool_lock:
+                self._async_pending.pop(watch, None)
+
+    async def _process_async(self, stream, handler, request, header,
+                             correlation_id, span=None, watch=None):
+        state = AsyncContext(
+            stream, request.context_id, metrics=self.metrics, span=span,
+            deadline=None if watch is None else watch.deadline)
+        start = time.monotonic()
+        try:
+            await handler.apply(request, state)
+        except asyncio.CancelledError:
+            # Cancelled by _expire, which has already responded.
+            self._end_span(span, None)
+            raise
+        except (InvalidTransaction, InternalError, AuthorizationException,
+                ValidatorConnectionError) as err:
+            status = self._respond(stream, correlation_id, err, span, watch)
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.exception("Unhandled error in async handler")
+            status = self._respond(
+                stream, correlation_id,
+                _unhandled_error(err),
+                span, watch)
+        else:
+            status = self._respond(
+                stream, correlation_id, span=span, watch=watch)
+        self._record(header, status, start, state)
+        self._end_span(span, status)
+
+    @staticmethod
+    def _end_span(span, status):
+        if span is None:
+            return
+        if status is not None:
+            span.set_attribute('status', TpProcessResponse.Status.Name(status))
+        span.end()
+
+    def _record(self, header, status, start, state):
+        """Records the outcome of a transaction in the metrics.
+
+        Args:
+            header (TransactionHeader): the transaction's header
+            status (TpProcessResponse.Status): the status responded with,
+                or None if no response was sent
+            start (float): the time.monotonic() at which processing began
+            state (Context): the context given to the handler, or None if
+                the handler was not called
+        """
+        labels = {
+            'family': header.family_name,
+            'version': header.family_version,
+        }
+        if state is not None:
+            self.metrics.histogram('tp_apply_seconds', **labels).observe(
+                time.monotonic() - start)
+            self.metrics.histogram(
+                'tp_context_requests_per_transaction',
+                buckets=REQUEST_COUNT_BUCKETS,
+                **labels).observe(state.request_count)
+        if status is not None:
+            self.metrics.counter(
+                'tp_transactions_total',
+                status=TpProcessResponse.Status.Name(status),
+                **labels).inc()
+
+    def _respond(self, stream, correlation_id, error=None, span=None,
+                 watch=None):
+        """Sends the TpProcessResponse for a transaction that raised the
+        given error, or an OK response if error is None.
+
+        Returns:
+            (TpProcessResponse.Status): the status of the response, or None
+                if the validator has disconnected, or the transaction's
+                deadline has passed and it has already been answered
+        """
+        if watch is not None and not watch.cancel():
+            LOGGER.warning("Transaction %s finished after its deadline",
+                           correlation_id)
+            return None
+
+        if isinstance(error, ValidatorConnectionError):
             # Somewhere within handler.apply a future resolved with an
             # error status that the validator has disconnected. There is
             # nothing left to do but reconnect.
             LOGGER.warning("during handler.apply a future was resolved "
-                           "with error status: %s", vce)
-        except AuthorizationException as ae:
-            LOGGER.warning("AuthorizationException: %s", ae)
-            try:
-                self._stream.send_back(
-                    message_type=Message.TP_PROCESS_RESPONSE,
-                    correlation_id=msg.correlation_id,
-                    content=TpProcessResponse(
-                        status=TpProcessResponse.INVALID_TRANSACTION,
-                        message=str(ae),
-                    ).SerializeToString())
-            except ValidatorConnectionError as vce:
-                # TP_PROCESS_REQUEST has made it through the
-                # handler.apply and an INVALID_TRANSACTION would have been
-                # sent back but the validator has disconnected and so it
-                # doesn't care about the response.
-                LOGGER.warning("during invalid transaction response: %s", vce)
+                           "with error status: %s", error)
+            return None
+
+        if error is None:
+            response = TpProcessResponse(status=TpProcessResponse.OK)
+        elif isinstance(error, InvalidTransaction):
+            LOGGER.warning("Invalid Transaction %s", error)
+            response = TpProcessResponse(
+                status=TpProcessResponse.INVALID_TRANSACTION,
+                message=str(error),
+                extended_data=error.extended_data)
+        elif isinstance(error, InternalError):
+            LOGGER.warning("internal error: %s", error)
+            response = TpProcessResponse(
+                status=TpProcessResponse.INTERNAL_ERROR,
+                message=str(error),
+                extended_data=error.extended_data)
+        else:
+            LOGGER.warning("AuthorizationException: %s", error)
+            response = TpProcessResponse(
+                status=TpProcessResponse.INVALID_TRANSACTION,
+                message=str(error))
+
+        try:
+            if span is None:
+                self._send_response(stream, correlation_id, response)
+            else:
+                with span.child('send_back'):
+                    self._send_response(stream, correlation_id, response)
+        except ValidatorConnectionError as vce:
+            # TP_PROCESS_REQUEST has made it through the handler.apply and
+            # a response would have been sent back but the validator has
+            # disconnected and so it doesn't care about the response.
+            LOGGER.warning("during %s response: %s",
+                           TpProcessResponse.Status.Name(response.status),
+                           vce)
+            return None
+        return response.status
+
+    @staticmethod
+    def _send_response(stream, correlation_id, response):
+        stream.send_back(
+            message_type=Message.TP_PROCESS_RESPONSE,
+            correlation_id=correlation_id,
+            content=response.SerializeToString())
 
     def _process_future(self, future, timeout=None, sigint=False):
         try:
-            msg = future.result(timeout)
+            stream, msg = future.result(timeout)
         except CancelledError:
             # This error is raised when Task.cancel is called on
             # disconnect from the validator in stream.py, for
@@ -234,26 +735,160 @@ class TransactionProcessor:
             return
         if msg is RECONNECT_EVENT:
             if sigint is False:
-                LOGGER.info("reregistering with validator")
-                self._stream.wait_for_ready()
-                self._register()
+                self._register_in_background(stream)
+        elif isinstance(msg, Exception):
+            self._registration_failed(stream, msg)
         else:
             LOGGER.debug(
                 'received message of type: %s',
                 Message.MessageType.Name(msg.message_type))
-            if msg.message_type == Message.PING_REQUEST:
-                self._stream.send_back(
-                    message_type=Message.PING_RESPONSE,
-                    correlation_id=msg.correlation_id,
-                    content=PingResponse().SerializeToString())
+            self._dispatch(stream, msg)
+
+    def _register_in_background(self, stream):
+        """Registers with a validator on a thread of its own, so that a
+        validator slow to answer does not hold up the requests of others.
+        A failure is handed back to the thread receiving as an event of
+        the validator's stream.
+        """
+        def register():
+            LOGGER.info("registering with validator at %s", stream.url)
+            try:
+                self._register(stream)
+            except ValidatorConnectionError as vce:
+                # The stream is registered again once it reconnects.
+                LOGGER.info("during registration: %s", vce)
+            except (ValidatorVersionError, RuntimeError) as err:
+                self._streams.notify(stream, err)
+
+        Thread(target=register, name='TransactionProcessorRegistration',
+               daemon=True).start()
+
+    def _registration_failed(self, stream, err):
+        """Stops serving a validator the processor failed to register
+        with, or, if it is the only one left, stops the processor.
+        """
+        if len(self._streams.streams) == 1:
+            raise err
+        LOGGER.error("Failed to register with the validator at %s, so no "
+                     "longer serving it: %s", stream.url, err)
+        # The validator drops the processor's registration along with
+        # the connection.
+        self._streams.remove(stream)
+
+    def _dispatch(self, stream, msg):
+        """Processes the message on the calling thread, or hands it to the
+        worker pool once a worker is available.
+        """
+        if self._executor is None:
+            self._process(stream, msg, self._watch(stream, msg))
+            return
+
+        # Blocks receiving further requests while every worker is busy, so
+        # that the number of in-flight transactions never exceeds the
+        # occupancy advertised to the validator.
+        self._occupancy.acquire()
+        try:
+            with self._pool_lock:
+                self._executor.submit(self._process_in_worker, stream, msg)
+        except RuntimeError:
+            # The executor has been shut down.
+            self._occupancy.release()
+            raise
+
+    def _process_in_worker(self, stream, msg):
+        pending = None
+        watch = self._watch(stream, msg)
+        try:
+            pending = self._process(stream, msg, watch)
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.exception("Unhandled error processing message %s",
+                             msg.correlation_id)
+            # The validator waits for a response to every request, which
+            # it would not get were the error only logged.
+            self._respond(
+                stream, msg.correlation_id,
+                _unhandled_error(err),
+                watch=watch)
+        finally:
+            if pending is None:
+                self._release(watch)
+            else:
+                # An async handler keeps the slot until it has responded,
+                # or has been cancelled at its deadline, so it is never
+                # counted stuck.
+                pending.add_done_callback(
+                    lambda _: self._occupancy.release())
+
+    def _release(self, watch):
+        """Frees the slot of a transaction once its worker has returned,
+        unless its deadline passed and _quarantine_worker has already
+        freed it.
+        """
+        if watch is None or watch.cancel():
+            self._occupancy.release()
+            return
+        with self._pool_lock:
+            if watch in self._stuck:
+                release = not self._stuck.pop(watch)
+                stuck = len(self._stuck)
+            else:
+                # _expire has yet to count the worker stuck.
+                self._returned.add(watch)
                 return
-            self._process(msg)
+        LOGGER.info("A worker stuck past its deadline has returned, "
+                    "%s remain stuck", stuck)
+        if release:
+            self._occupancy.release()
+
+    def _quarantine_worker(self, watch):
+        """Counts the worker applying a transaction whose deadline has
+        passed as stuck, and frees the transaction's slot, so that another
+        worker takes its place, unless max_stuck_workers are already stuck.
+        """
+        with self._pool_lock:
+            if watch in self._returned:
+                # The worker returned just as the deadline passed.
+                self._returned.remove(watch)
+                stuck = None
+                release = True
+            else:
+                release = len(self._stuck) < self._max_stuck
+                self._stuck[watch] = release
+                stuck = len(self._stuck)
+        if stuck is not None:
+            self.metrics.counter('tp_workers_quarantined_total').inc()
+            LOGGER.warning("%s workers are stuck applying transactions past "
+                           "their deadline", stuck)
+        if release:
+            self._occupancy.release()
 
-    def _register(self):
+    def _new_pool(self):
+        # Beyond max_workers, threads are only started in place of stuck
+        # workers, as the occupancy bounds the transactions in flight.
+        return ThreadPoolExecutor(
+            max_workers=self._max_workers + self._max_stuck,
+            thread_name_prefix='TransactionProcessorWorker')
+
+    def _start_workers(self):
+        if self._max_workers is None or self._executor is not None:
+            return
+        self._occupancy = BoundedSemaphore(self._max_workers)
+        self._executor = self._new_pool()
+
+    def _stop_workers(self, wait=True):
+        """Stops accepting work and, if wait is True, blocks until the
+        transactions already handed to the pool have been responded to.
+        """
+        with self._pool_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _register(self, stream):
         futures = []
         for message in self._register_requests():
-            self._stream.wait_for_ready()
-            future = self._stream.send(
+            stream.wait_for_ready()
+            future = stream.send(
                 message_type=Message.TP_REGISTER_REQUEST,
                 content=message.SerializeToString())
             futures.append(future)
@@ -282,45 +917,55 @@ class TransactionProcessor:
 
     def _unregister(self):
         message = self._unregister_request()
-        self._stream.wait_for_ready()
-        future = self._stream.send(
-            message_type=Message.TP_UNREGISTER_REQUEST,
-            content=message.SerializeToString())
-        response = TpUnregisterResponse()
-        try:
-            response.ParseFromString(future.result(1).content)
-            LOGGER.info("unregister attempt: %s",
-                        TpUnregisterResponse.Status.Name(response.status))
-        except ValidatorConnectionError as vce:
-            LOGGER.info("during waiting for response on unregistration: %s",
-                        vce)
+        futures = []
+        for stream in self._streams.streams:
+            # A validator that is disconnected has already dropped the
+            # processor's registration.
+            if not stream.is_ready():
+                continue
+            futures.append(stream.send(
+                message_type=Message.TP_UNREGISTER_REQUEST,
+                content=message.SerializeToString()))
+        for future in futures:
+            response = TpUnregisterResponse()
+            try:
+                response.ParseFromString(future.result(1).content)
+                LOGGER.info("unregister attempt: %s",
+                            TpUnregisterResponse.Status.Name(response.status))
+            except ValidatorConnectionError as vce:
+                LOGGER.info("during waiting for response on "
+                            "unregistration: %s", vce)
 
     def start(self):
-        """Connects the transaction processor to a validator and starts
-        listening for requests and routing them to an appropriate
-        transaction handler.
+        """Registers the transaction processor with each validator as it
+        connects, and starts listening for requests and routing them to an
+        appropriate transaction handler.
         """
         fut = None
+        self._warn_unsupported_by_async()
+        for exporter in self._exporters:
+            exporter.start(self.metrics)
+        self._start_workers()
         try:
-            self._register()
             while True:
                 # During long running processing this
                 # is where the transaction processor will
                 # spend most of its time
-                fut = self._stream.receive()
+                fut = self._streams.receive()
                 self._process_future(fut)
         except (KeyboardInterrupt, ValidatorVersionError):
             try:
                 # tell the validator to not send any more messages
                 self._unregister()
-                while True:
-                    if fut is not None:
-                        # process futures as long as the tp has them,
-                        # if the TP_PROCESS_REQUEST doesn't come from
-                        # zeromq->asyncio in 1 second raise a
-                        # concurrent.futures.TimeOutError and be done.
-                        self._process_future(fut, 1, sigint=True)
-                        fut = self._stream.receive()
+                # when interrupted during registration, there is nothing
+                # to drain
+                while fut is not None:
+                    # process futures as long as the tp has them,
+                    # if the TP_PROCESS_REQUEST doesn't come from
+                    # zeromq->asyncio in 1 second raise a
+                    # concurrent.futures.TimeOutError and be done.
+                    self._process_future(fut, 1, sigint=True)
+                    fut = self._streams.receive()
             except concurrent.futures.TimeoutError:
                 # Where the tp will usually exit after
                 # a KeyboardInterrupt. Caused by the 1 second
@@ -330,12 +975,49 @@ class TransactionProcessor:
                 # If the validator is not able to respond to the
                 # unregister request, exit.
                 pass
+            # let the transactions already handed to workers finish so
+            # their responses reach the validator
+            self._stop_workers()
         except RuntimeError as e:
             LOGGER.error("Error: %s", e)
             self.stop()
 
+    def _warn_unsupported_by_async(self):
+        """Logs the enabled features that async handlers do without, as
+        they only apply to the other handlers.
+        """
+        if not any(isinstance(handler, AsyncTransactionHandler)
+                   for handler in self._handlers):
+            return
+        unsupported = [
+            name for name, enabled in (
+                ('state cache', self._state_cache),
+                ('profiling', self._profiler is not None),
+                ('memoization', self._memo is not None))
+            if enabled]
+        if unsupported:
+            LOGGER.warning("Async handlers are applied without %s",
+                           ', '.join(unsupported))
+
     def stop(self):
         """Closes the connection between the TransactionProcessor and the
-        validator.
+        validator. Calling it again has no effect.
         """
-        self._stream.close()
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self._stop_workers(wait=False)
+        if self._watchdog is not None:
+            self._watchdog.stop()
+        for exporter in self._exporters:
+            exporter.stop()
+        if self._tracer is not None:
+            self._tracer.shutdown()
+        if self._profiler is not None:
+            self._profiler.stop()
+        if self._capture is not None:
+            for stream in self._streams.streams:
+                stream.set_capture(None)
+            self._capture.close()
+        self._streams.close()
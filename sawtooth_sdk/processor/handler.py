@@ -46,6 +46,17 @@ class TransactionHandler(metaclass=abc.ABCMeta):
         namespaces, e.g. ["abcdef"]
         """
 
+    @property
+    def deterministic(self):
+        """
+        deterministic should return True if apply depends only on the
+        transaction and the state it reads, and changes nothing but
+        state, receipt data and events. When the processor's memoization
+        is enabled, the executions of such handlers are replayed for
+        transactions the validator sends again.
+        """
+        return False
+
     @abc.abstractmethod
     def apply(self, transaction, context):
         """
@@ -55,3 +66,44 @@ class TransactionHandler(metaclass=abc.ABCMeta):
         handler understands and will pass in the TpProcessRequest and an
         initialized instance of the Context type.
         """
+
+
+class AsyncTransactionHandler(metaclass=abc.ABCMeta):
+    """
+    AsyncTransactionHandler is the Abstract Base Class for transaction
+    families whose business logic is written as a coroutine. It is routed
+    to by the same properties as a TransactionHandler, but is not one, as
+    its apply must be awaited.
+
+    The processor runs apply on the event loop that services the
+    validator connection, so many transactions can wait on state at once
+    without a thread per transaction. Long-running, blocking work in
+    apply stalls that loop and should be avoided.
+    """
+
+    @abc.abstractproperty
+    def family_name(self):
+        """
+        See TransactionHandler.family_name.
+        """
+
+    @abc.abstractproperty
+    def family_versions(self):
+        """
+        See TransactionHandler.family_versions.
+        """
+
+    @abc.abstractproperty
+    def namespaces(self):
+        """
+        See TransactionHandler.namespaces.
+        """
+
+    @abc.abstractmethod
+    async def apply(self, transaction, context):
+        """
+        Apply is the coroutine where all the business logic for a
+        transaction family is defined. It is passed the TpProcessRequest
+        and an initialized instance of the AsyncContext type, whose
+        methods must be awaited.
+        """
@@ -0,0 +1,353 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from collections import OrderedDict
+import logging
+import threading
+
+from sawtooth_sdk.processor.context import gather
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf import state_context_pb2
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+LOGGER = logging.getLogger(__name__)
+
+# The response type of each request whose status is checked before an
+# execution is memoized.
+_RESPONSES = {
+    Message.TP_STATE_GET_REQUEST: state_context_pb2.TpStateGetResponse,
+    Message.TP_STATE_SET_REQUEST: state_context_pb2.TpStateSetResponse,
+    Message.TP_STATE_DELETE_REQUEST: state_context_pb2.TpStateDeleteResponse,
+    Message.TP_RECEIPT_ADD_DATA_REQUEST:
+        state_context_pb2.TpReceiptAddDataResponse,
+    Message.TP_EVENT_ADD_REQUEST: state_context_pb2.TpEventAddResponse,
+}
+
+
+class _Execution:
+    """What a deterministic handler did for a transaction.
+
+    Attributes:
+        reads (dict): each address read before the handler changed it, to
+            its data, or b'' if it was unset
+        writes (dict): each address changed to its final data, or None if
+            it was deleted
+        results (list): the receipt data, as bytes, and events, as
+            events_pb2.Events, added, in order
+        error (tuple): the message and extended data of the
+            InvalidTransaction the handler raised, or None
+    """
+
+    __slots__ = ('reads', 'writes', 'results', 'error')
+
+    def __init__(self, reads, writes, results, error):
+        self.reads = reads
+        self.writes = writes
+        self.results = results
+        self.error = error
+
+
+class ExecutionRecorder:
+    """Records the requests a Context sends while a handler is applied to a
+    transaction, and memoizes them once the handler is done.
+    """
+
+    def __init__(self, memo, signature):
+        self._memo = memo
+        self._signature = signature
+        self._gets = []
+        self._writes = {}
+        self._results = []
+        self._futures = []
+
+    def sent(self, message_type, content, future):
+        """Called by the Context with each request it sends."""
+        if message_type == Message.TP_STATE_GET_REQUEST:
+            request = state_context_pb2.TpStateGetRequest()
+            request.ParseFromString(content)
+            # Reads of addresses the handler has already changed depend on
+            # the change, not on the state the transaction started from.
+            self._gets.append((
+                [a for a in request.addresses if a not in self._writes],
+                future))
+        elif message_type == Message.TP_STATE_SET_REQUEST:
+            request = state_context_pb2.TpStateSetRequest()
+            request.ParseFromString(content)
+            self._writes.update(
+                (entry.address, entry.data) for entry in request.entries)
+        elif message_type == Message.TP_STATE_DELETE_REQUEST:
+            request = state_context_pb2.TpStateDeleteRequest()
+            request.ParseFromString(content)
+            self._writes.update(dict.fromkeys(request.addresses))
+        elif message_type == Message.TP_RECEIPT_ADD_DATA_REQUEST:
+            request = state_context_pb2.TpReceiptAddDataRequest()
+            request.ParseFromString(content)
+            self._results.append(request.data)
+        elif message_type == Message.TP_EVENT_ADD_REQUEST:
+            request = state_context_pb2.TpEventAddRequest()
+            request.ParseFromString(content)
+            self._results.append(request.event)
+        self._futures.append((message_type, future))
+
+    def finish(self, error=None):
+        """Memoizes the execution, unless a request is unanswered or was
+        refused, since the handler may then not have run to completion.
+
+        Args:
+            error (InvalidTransaction): what the handler raised, if it did
+        """
+        responses = {}
+        for message_type, future in self._futures:
+            if not future.done():
+                return
+            response = _RESPONSES[message_type]()
+            response.ParseFromString(future.result().content)
+            if response.status != response.OK:
+                return
+            responses[future] = response
+
+        reads = {}
+        for addresses, future in self._gets:
+            found = {
+                entry.address: entry.data
+                for entry in responses[future].entries
+            }
+            for address in addresses:
+                reads.setdefault(address, found.get(address, b''))
+        if error is not None:
+            error = (str(error), error.extended_data)
+        self._memo.put(
+            self._signature,
+            _Execution(reads, self._writes, self._results, error))
+
+
+class ExecutionMemo:
+    """A bounded, least-recently-used memo of the executions of
+    deterministic handlers, keyed by transaction signature.
+
+    The validator may send the same transaction many times, for each block
+    or fork it is considered for. When it is sent again, and the addresses
+    the handler read still hold the same data, the handler's changes,
+    receipt data and events, or its InvalidTransaction, are replayed
+    without calling it.
+
+    Lookups are counted by the tp_memo_lookups_total counter, labelled
+    result=hit, miss (not memoized) or stale (memoized, but the state read
+    has changed).
+
+    Args:
+        max_entries (int): the most executions remembered
+        metrics (MetricsRegistry): where lookups are counted, or None
+    """
+
+    def __init__(self, max_entries=10000, metrics=None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self._max_entries = max_entries
+        self._executions = OrderedDict()
+        self._lock = threading.Lock()
+        self._lookups = {'hit': 0, 'miss': 0, 'stale': 0}
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.gauge('tp_memo_entries').set_function(self.__len__)
+
+    def __len__(self):
+        return len(self._executions)
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups replayed from the memo."""
+        lookups = sum(self._lookups.values())
+        if not lookups:
+            return 0.0
+        return self._lookups['hit'] / lookups
+
+    def recorder(self, signature):
+        """Returns an ExecutionRecorder for the transaction with the given
+        signature, to be passed to Context.record.
+        """
+        return ExecutionRecorder(self, signature)
+
+    def put(self, signature, execution):
+        with self._lock:
+            self._executions[signature] = execution
+            self._executions.move_to_end(signature)
+            if len(self._executions) > self._max_entries:
+                self._executions.popitem(last=False)
+
+    def replay(self, signature, context, timeout=None):
+        """Replays the execution of a transaction through context, if it is
+        memoized and the state it read is unchanged.
+
+        Args:
+            signature (str): the transaction's signature
+            context (Context): the context for the transaction
+            timeout: optional timeout, in seconds, for each request
+
+        Returns:
+            (bool): whether the execution was replayed
+
+        Raises:
+            InvalidTransaction: if the execution was memoized as invalid
+        """
+        with self._lock:
+            execution = self._executions.get(signature)
+            if execution is not None:
+                self._executions.move_to_end(signature)
+        if execution is None:
+            self._count('miss')
+            return False
+
+        if execution.reads:
+            addresses = list(execution.reads)
+            current = dict.fromkeys(addresses, b'')
+            current.update(
+                (entry.address, entry.data)
+                for entry in context.get_state(addresses, timeout))
+            if current != execution.reads:
+                LOGGER.debug("State read by %s has changed", signature[:8])
+                self._count('stale')
+                return False
+        self._count('hit')
+
+        if execution.error is not None:
+            message, extended_data = execution.error
+            raise InvalidTransaction(message, extended_data=extended_data)
+        entries = {
+            address: data for address, data in execution.writes.items()
+            if data is not None
+        }
+        deletions = [
+            address for address, data in execution.writes.items()
+            if data is None
+        ]
+        futures = []
+        if entries:
+            futures.append(context.set_state_async(entries))
+        if deletions:
+            futures.append(context.delete_state_async(deletions))
+        gather(futures, timeout)
+        # Receipt data and events are added one at a time, so that they
+        # keep their order.
+        for result in execution.results:
+            if isinstance(result, bytes):
+                context.add_receipt_data(result, timeout)
+            else:
+                context.add_event(
+                    result.event_type,
+                    [(attribute.key, attribute.value)
+                     for attribute in result.attributes],
+                    result.data,
+                    timeout)
+        return True
+
+    def _count(self, result):
+        with self._lock:
+            self._lookups[result] += 1
+        if self._metrics is not None:
+            self._metrics.counter(
+                'tp_memo_lookups_total', result=result).inc()
+
+
+class PayloadCache:
+    """A bounded, least-recently-used cache of what a handler decodes from
+    transaction payloads, keyed by transaction signature.
+
+    The payload of a transaction never changes, but the validator may send
+    the transaction many times. A handler decodes and validates the payload
+    through the cache, so that this is done once per transaction, and an
+    InvalidTransaction raised for a malformed payload is remembered and
+    raised again for later deliveries. The cached results are shared
+    between deliveries, so handlers must not modify them.
+
+    Lookups are counted by the tp_payload_cache_lookups_total counter,
+    labelled result=hit or miss.
+
+    Args:
+        max_entries (int): the most payloads remembered
+        metrics (MetricsRegistry): where lookups are counted, or None
+    """
+
+    def __init__(self, max_entries=10000, metrics=None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self._max_entries = max_entries
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+        self._lookups = {'hit': 0, 'miss': 0}
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.gauge('tp_payload_cache_entries').set_function(
+                self.__len__)
+
+    def __len__(self):
+        return len(self._payloads)
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups answered from the cache."""
+        lookups = sum(self._lookups.values())
+        if not lookups:
+            return 0.0
+        return self._lookups['hit'] / lookups
+
+    def decode(self, transaction, function):
+        """Returns function(transaction), which is only called the first
+        time the transaction is seen.
+
+        Args:
+            transaction (TpProcessRequest): the transaction
+            function (callable): decodes and validates the transaction's
+                payload, without reading state
+
+        Raises:
+            InvalidTransaction: if function raised it for the transaction
+        """
+        signature = transaction.signature
+        with self._lock:
+            entry = self._payloads.get(signature)
+            if entry is not None:
+                self._payloads.move_to_end(signature)
+        if entry is not None:
+            self._count('hit')
+            result, error = entry
+            if error is not None:
+                message, extended_data = error
+                raise InvalidTransaction(message, extended_data=extended_data)
+            return result
+
+        self._count('miss')
+        try:
+            result = function(transaction)
+        except InvalidTransaction as err:
+            self._put(signature, (None, (str(err), err.extended_data)))
+            raise
+        self._put(signature, (result, None))
+        return result
+
+    def _put(self, signature, entry):
+        with self._lock:
+            self._payloads[signature] = entry
+            self._payloads.move_to_end(signature)
+            if len(self._payloads) > self._max_entries:
+                self._payloads.popitem(last=False)
+
+    def _count(self, result):
+        with self._lock:
+            self._lookups[result] += 1
+        if self._metrics is not None:
+            self._metrics.counter(
+                'tp_payload_cache_lookups_total', result=result).inc()
@@ -0,0 +1,226 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import cProfile
+from collections import Counter
+import itertools
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+from sawtooth_sdk.processor.config import get_log_dir
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ApplyProfiler:
+    """Profiles calls to handler.apply in a running transaction processor.
+
+    Profiling is off until it is turned on, at any time and from any
+    thread, in either of two ways:
+
+    - set_sampling(every) profiles every Nth call until it is set to 0.
+    - start_window(seconds) profiles every call for a while. The window
+      may also be started by sending the process a signal; see
+      install_signal.
+
+    Each profiled call is run under cProfile, and its thread's stack is
+    sampled every interval seconds while it runs. The results are
+    aggregated, and written by dump() to the output directory as a pstats
+    file and as a file of collapsed stacks, one "frame;frame;... count"
+    line per stack, as read by flamegraph.pl and speedscope. dump() is
+    called at the end of each window, after every dump_every calls
+    profiled by sampling, and when the processor stops.
+
+    Args:
+        output_dir (str): where the profiles are written; defaults to the
+            directory returned by get_log_dir()
+        interval (float): the seconds between stack samples
+        dump_every (int): the number of calls profiled by sampling after
+            which the results are written
+    """
+
+    def __init__(self, output_dir=None, interval=0.001, dump_every=1000):
+        self._output_dir = output_dir
+        self._interval = interval
+        self._dump_every = dump_every
+        self._every = 0
+        self._calls = itertools.count(1)
+        self._window_end = 0.0
+        self._window_timer = None
+        self._lock = threading.Lock()
+        self._stats = None
+        self._stacks = Counter()
+        self._profiled = 0
+        # thread id to the frame of the call being profiled on it
+        self._sampled_threads = {}
+        self._sampler = None
+        self._dumps = itertools.count()
+
+    def set_sampling(self, every):
+        """Profiles every Nth call to apply, or none if every is 0."""
+        if every < 0:
+            raise ValueError("every must not be negative")
+        self._every = every
+
+    def start_window(self, seconds):
+        """Profiles every call to apply for the given number of seconds,
+        then writes the results.
+        """
+        LOGGER.info("profiling handler.apply for %ss", seconds)
+        with self._lock:
+            self._window_end = time.monotonic() + seconds
+            if self._window_timer is not None:
+                self._window_timer.cancel()
+            self._window_timer = threading.Timer(seconds, self.dump)
+            self._window_timer.daemon = True
+            self._window_timer.start()
+
+    def install_signal(self, signum=signal.SIGUSR1, seconds=30.0):
+        """Starts a window of the given seconds whenever the process
+        receives signum. Must be called from the main thread.
+        """
+        def handle(signum, frame):
+            # pylint: disable=unused-argument
+            # The timer can not be started while the interrupted thread
+            # holds the lock, so the window is started from a new thread.
+            threading.Thread(
+                target=self.start_window, args=(seconds,),
+                daemon=True).start()
+
+        signal.signal(signum, handle)
+
+    def call(self, function, *args):
+        """Calls function with args, profiling the call if it is chosen to
+        be profiled.
+        """
+        every = self._every
+        in_window = time.monotonic() < self._window_end
+        sampled = not in_window and every and next(self._calls) % every == 0
+        if not (in_window or sampled):
+            return function(*args)
+
+        ident = threading.get_ident()
+        profile = cProfile.Profile()
+        # pylint: disable=protected-access
+        self._start_sampling(ident, sys._getframe())
+        profile.enable()
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            self._stop_sampling(ident)
+            self._add(profile, sampled)
+
+    def dump(self):
+        """Writes the results gathered since the last dump, if any.
+
+        Returns:
+            (list): the paths of the files written
+        """
+        with self._lock:
+            stats, self._stats = self._stats, None
+            stacks, self._stacks = self._stacks, Counter()
+            self._profiled = 0
+        if stats is None and not stacks:
+            return []
+
+        output_dir = self._output_dir
+        if output_dir is None:
+            output_dir = get_log_dir()
+        base = os.path.join(output_dir, 'apply-profile-{}-{}-{}'.format(
+            os.getpid(), time.strftime('%Y%m%d%H%M%S'), next(self._dumps)))
+        paths = []
+        if stats is not None:
+            stats.dump_stats(base + '.pstats')
+            paths.append(base + '.pstats')
+        with open(base + '.collapsed', 'w') as collapsed:
+            for stack, count in sorted(stacks.items()):
+                collapsed.write('{} {}\n'.format(stack, count))
+        paths.append(base + '.collapsed')
+        LOGGER.info("wrote handler.apply profile to %s", base)
+        return paths
+
+    def stop(self):
+        """Ends any window and writes the remaining results."""
+        with self._lock:
+            if self._window_timer is not None:
+                self._window_timer.cancel()
+            self._window_end = 0.0
+        self.dump()
+
+    def _add(self, profile, sampled):
+        dump = False
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            if sampled:
+                self._profiled += 1
+                dump = self._profiled >= self._dump_every
+        if dump:
+            self.dump()
+
+    def _start_sampling(self, ident, caller):
+        with self._lock:
+            self._sampled_threads[ident] = caller
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name='ApplyProfilerSampler',
+                    daemon=True)
+                self._sampler.start()
+
+    def _stop_sampling(self, ident):
+        with self._lock:
+            self._sampled_threads.pop(ident, None)
+
+    def _sample(self):
+        """Samples the stacks of the threads being profiled until there
+        are none left.
+        """
+        while True:
+            with self._lock:
+                if not self._sampled_threads:
+                    self._sampler = None
+                    return
+                threads = list(self._sampled_threads.items())
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            samples = [
+                _collapse(frames[ident], caller) for ident, caller in threads
+                if ident in frames
+            ]
+            with self._lock:
+                self._stacks.update(samples)
+            time.sleep(self._interval)
+
+
+def _collapse(frame, caller):
+    """Returns the stack ending at frame, up to but excluding caller, as
+    "outer;...;inner" frames.
+    """
+    names = []
+    while frame is not None and frame is not caller:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename),
+            code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
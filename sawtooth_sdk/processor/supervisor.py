@@ -0,0 +1,379 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+
+from sawtooth_sdk.processor.core import TransactionProcessor
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _SupervisedProcessor(TransactionProcessor):
+    """A TransactionProcessor that tells the supervisor once it has
+    registered with a validator.
+    """
+
+    def __init__(self, url, registered, max_workers=None):
+        super().__init__(url, max_workers=max_workers)
+        self._registered = registered
+
+    def _register(self, stream):
+        super()._register(stream)
+        self._registered.set()
+
+
+class _Worker:
+    """The supervisor's record of one worker process."""
+
+    def __init__(self, index, process, registered):
+        self.index = index
+        self.process = process
+        self.registered = registered
+        self.started = time.monotonic()
+
+
+class TransactionProcessorSupervisor:
+    """Runs a TransactionProcessor, with the same handlers, in each of
+    several worker processes, so that CPU-bound handlers are not limited
+    to one core by the GIL.
+
+    Each worker has its own connection to the validator and registers
+    separately; the validator shares transactions between them as it
+    would between separately started processors. Workers are started one
+    at a time, each once the previous one has registered. A worker that
+    exits while the supervisor is running is started again, after a delay
+    that grows while it keeps exiting soon after it is started.
+
+    On SIGINT or SIGTERM, or when stop() is called, each worker is sent
+    SIGINT, which unregisters it from the validator and lets it finish
+    the transactions it has already received before it exits.
+
+    The options of TransactionProcessor are set for every worker through
+    the methods of the same name. Exporters and capture files are not
+    shared between processes: add_metrics_exporter and enable_tracing
+    take a factory called in each worker, and enable_capture writes a
+    file for each worker.
+    """
+
+    def __init__(self, url, processes=None, max_workers=None,
+                 restart_delay=1.0, drain_timeout=30.0,
+                 max_restart_delay=60.0):
+        """
+        Args:
+            url (string or list of string): The URL of the validator, or
+                the URLs of several validators, passed to the
+                TransactionProcessor of each worker.
+            processes (int, optional): The number of worker processes.
+                Defaults to the number of CPUs.
+            max_workers (int, optional): Passed to the TransactionProcessor
+                of each worker.
+            restart_delay (float): The seconds to wait before starting a
+                worker again after it has exited. The delay doubles each
+                time the worker exits again without having run for
+                max_restart_delay seconds.
+            drain_timeout (float): The seconds to wait for the workers to
+                exit once they have been asked to stop, after which they
+                are terminated.
+            max_restart_delay (float): The most seconds to wait before
+                starting a worker again.
+        """
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self._url = url
+        self._processes = processes
+        self._max_workers = max_workers
+        self._restart_delay = restart_delay
+        self._max_restart_delay = max_restart_delay
+        self._drain_timeout = drain_timeout
+        self._handlers = []
+        self._header_style = None
+        self._state_cache = None
+        self._deadline = None
+        self._zero_copy = False
+        self._admission_limit = None
+        self._memoization = None
+        self._exporter_factories = []
+        self._tracing_factory = None
+        self._profiling = None
+        self._capture_path = None
+        self._workers = {}
+        # The times at which exited workers are to be started again, and
+        # the delay before each is started again should it exit soon.
+        self._restarts = {}
+        self._delays = {}
+        self._stopping = threading.Event()
+        self._context = multiprocessing.get_context('fork')
+
+    def add_handler(self, handler):
+        """Adds a transaction family handler to every worker.
+        Args:
+            handler (TransactionHandler or AsyncTransactionHandler): the
+                handler to be added; each worker process has its own copy
+        """
+        self._handlers.append(handler)
+
+    def set_header_style(self, style):
+        """See TransactionProcessor.set_header_style."""
+        self._header_style = style
+
+    def enable_state_cache(self, write_back=False, prefetch_inputs=False):
+        """See TransactionProcessor.enable_state_cache."""
+        self._state_cache = (write_back, prefetch_inputs)
+
+    def enable_zero_copy(self):
+        """See TransactionProcessor.enable_zero_copy."""
+        self._zero_copy = True
+
+    def enable_deadline(self, seconds, max_stuck_workers=None):
+        """See TransactionProcessor.enable_deadline."""
+        if seconds <= 0:
+            raise ValueError("seconds must be positive")
+        self._deadline = (seconds, max_stuck_workers)
+
+    def enable_admission_control(self, max_queued):
+        """See TransactionProcessor.enable_admission_control. The bound
+        applies to each worker separately.
+        """
+        self._admission_limit = max_queued
+
+    def enable_memoization(self, max_entries=10000):
+        """See TransactionProcessor.enable_memoization. Each worker
+        remembers up to max_entries executions of its own; the memos are
+        not returned, as they live in the workers.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self._memoization = max_entries
+
+    def add_metrics_exporter(self, factory):
+        """Adds an exporter of each worker's metrics.
+        Args:
+            factory (callable): called in each worker with the worker's
+                index, returning the worker's MetricsExporter, e.g.
+                lambda index: PrometheusExporter(9100 + index)
+        """
+        self._exporter_factories.append(factory)
+
+    def enable_tracing(self, factory):
+        """Traces the processing of each transaction in every worker.
+        Args:
+            factory (callable): called in each worker with the worker's
+                index, returning the worker's SpanExporter, e.g.
+                lambda index: JsonLinesSpanExporter(
+                    'spans-{}.jsonl'.format(index))
+        """
+        self._tracing_factory = factory
+
+    def enable_profiling(self, every=0, signum=None, window=30.0,
+                         output_dir=None):
+        """See TransactionProcessor.enable_profiling. The profiles of each
+        worker are named with its process id. If signum is given, the
+        supervisor passes the signal on to every worker, so it must be
+        started from the main thread; the profilers are not returned, as
+        they live in the workers.
+        """
+        self._profiling = (every, signum, window, output_dir)
+
+    def enable_capture(self, path):
+        """See TransactionProcessor.enable_capture. Each worker writes its
+        own capture file, named path followed by a dot and the worker's
+        index.
+        """
+        self._capture_path = path
+
+    @property
+    def pids(self):
+        """The process ids of the running workers, by worker index."""
+        return {
+            index: worker.process.pid
+            for index, worker in self._workers.items()
+        }
+
+    def start(self):
+        """Starts the workers and supervises them until the supervisor is
+        stopped, then waits for them to exit.
+        """
+        self._stopping.clear()
+        self._install_signal_handlers()
+        try:
+            for index in range(self._processes):
+                if self._stopping.is_set():
+                    break
+                self._start_worker(index)
+            while not self._stopping.is_set():
+                self._restart_exited_workers()
+        except KeyboardInterrupt:
+            self._stopping.set()
+        finally:
+            self._stop_workers()
+
+    def stop(self):
+        """Asks the supervisor to stop its workers; start() returns once
+        they have exited.
+        """
+        self._stopping.set()
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        def handle(signum, frame):
+            # pylint: disable=unused-argument
+            self._stopping.set()
+
+        signal.signal(signal.SIGINT, handle)
+        signal.signal(signal.SIGTERM, handle)
+
+        if self._profiling is not None and self._profiling[1] is not None:
+            def relay(signum, frame):
+                # pylint: disable=unused-argument
+                for pid in self.pids.values():
+                    try:
+                        os.kill(pid, signum)
+                    except ProcessLookupError:
+                        pass
+
+            signal.signal(self._profiling[1], relay)
+
+    def _start_worker(self, index):
+        registered = self._context.Event()
+        process = self._context.Process(
+            target=self._run_worker,
+            args=(index, registered),
+            name='TransactionProcessor-{}'.format(index),
+            daemon=True)
+        process.start()
+        worker = _Worker(index, process, registered)
+        self._workers[index] = worker
+        LOGGER.info("started worker %s (pid %s)", index, process.pid)
+
+        # Register one worker at a time, so the validator is not asked
+        # to register all of them at once.
+        while not self._stopping.is_set() and process.is_alive():
+            if registered.wait(0.1):
+                break
+
+    def _run_worker(self, index, registered):
+        # The worker is moved to its own process group, so that a SIGINT
+        # sent to the supervisor's group from a terminal reaches only the
+        # supervisor, which then asks each worker to stop once.
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        processor = _SupervisedProcessor(
+            self._url, registered, max_workers=self._max_workers)
+        for handler in self._handlers:
+            processor.add_handler(handler)
+        if self._header_style is not None:
+            processor.set_header_style(self._header_style)
+        if self._state_cache is not None:
+            write_back, prefetch_inputs = self._state_cache
+            processor.enable_state_cache(
+                write_back=write_back, prefetch_inputs=prefetch_inputs)
+        if self._deadline is not None:
+            processor.enable_deadline(*self._deadline)
+        if self._zero_copy:
+            processor.enable_zero_copy()
+        if self._admission_limit is not None:
+            processor.enable_admission_control(self._admission_limit)
+        if self._memoization is not None:
+            processor.enable_memoization(self._memoization)
+        for factory in self._exporter_factories:
+            processor.add_metrics_exporter(factory(index))
+        if self._tracing_factory is not None:
+            processor.enable_tracing(self._tracing_factory(index))
+        if self._profiling is not None:
+            every, signum, window, output_dir = self._profiling
+            processor.enable_profiling(
+                every=every, signum=signum, window=window,
+                output_dir=output_dir)
+        if self._capture_path is not None:
+            processor.enable_capture(
+                '{}.{}'.format(self._capture_path, index))
+        try:
+            processor.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            processor.stop()
+
+    def _restart_exited_workers(self):
+        sentinels = {
+            worker.process.sentinel: worker
+            for worker in self._workers.values()
+            if worker.index not in self._restarts
+        }
+        timeout = 0.5
+        if self._restarts:
+            timeout = max(0, min(
+                timeout, min(self._restarts.values()) - time.monotonic()))
+        if sentinels:
+            exited = multiprocessing.connection.wait(
+                list(sentinels), timeout=timeout)
+        else:
+            self._stopping.wait(timeout)
+            exited = []
+        for sentinel in exited:
+            worker = sentinels[sentinel]
+            uptime = time.monotonic() - worker.started
+            delay = self._delays.get(worker.index, self._restart_delay)
+            if uptime >= self._max_restart_delay:
+                delay = self._restart_delay
+            self._delays[worker.index] = min(
+                delay * 2, self._max_restart_delay)
+            LOGGER.warning(
+                "worker %s (pid %s) exited with code %s after %.1fs, "
+                "starting it again in %.1fs",
+                worker.index, worker.process.pid, worker.process.exitcode,
+                uptime, delay)
+            self._restarts[worker.index] = time.monotonic() + delay
+
+        for index, restart_at in sorted(self._restarts.items()):
+            if self._stopping.is_set():
+                return
+            if restart_at <= time.monotonic():
+                del self._restarts[index]
+                self._start_worker(index)
+
+    def _stop_workers(self):
+        for worker in self._workers.values():
+            if worker.process.is_alive():
+                try:
+                    os.kill(worker.process.pid, signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+
+        deadline = time.monotonic() + self._drain_timeout
+        for worker in self._workers.values():
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                LOGGER.warning(
+                    "worker %s (pid %s) did not stop within %ss, "
+                    "terminating it",
+                    worker.index, worker.process.pid, self._drain_timeout)
+                worker.process.terminate()
+                worker.process.join()
+        self._workers = {}
+        self._restarts = {}
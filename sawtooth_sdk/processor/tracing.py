@@ -0,0 +1,323 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import abc
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+
+LOGGER = logging.getLogger(__name__)
+
+_CURRENT = threading.local()
+
+
+class Span:
+    """A timed operation within the processing of a transaction.
+
+    Spans are created by a Tracer, or as children of another span, and are
+    handed to the tracer's exporter when ended.
+
+    Attributes:
+        name (str): what the span measures
+        trace_id (str): 32 hex characters shared by a span and all of its
+            descendants
+        span_id (str): 16 hex characters identifying the span
+        parent_id (str): the span_id of the parent span, or None
+        start_time (float): seconds since the epoch at which it started
+        end_time (float): seconds since the epoch at which it ended, or
+            None while it is open
+        attributes (dict): str keys to str, int, float or bool values
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_time',
+                 'end_time', 'attributes', '_tracer')
+
+    def __init__(self, tracer, name, trace_id, parent_id=None,
+                 attributes=None):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self.end_time = None
+        self.attributes = attributes if attributes is not None else {}
+
+    def child(self, name, **attributes):
+        """Starts a span within this one."""
+        return Span(self._tracer, name, self.trace_id, self.span_id,
+                    attributes)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        """Ends the span and exports it; later calls do nothing."""
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        self._tracer.export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.end()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'attributes': self.attributes,
+        }
+
+
+class SpanExporter(metaclass=abc.ABCMeta):
+    """Receives the spans of a Tracer as they end."""
+
+    @abc.abstractmethod
+    def export(self, span):
+        """Called with each span once it has ended, on the thread that
+        ended it.
+        """
+
+    def shutdown(self):
+        """Flushes any buffered spans and releases resources."""
+
+
+class Tracer:
+    """Starts the spans of transactions and passes them to an exporter."""
+
+    def __init__(self, exporter):
+        self._exporter = exporter
+
+    def start_span(self, name, **attributes):
+        """Starts a span with no parent, beginning a new trace."""
+        return Span(self, name, os.urandom(16).hex(), attributes=attributes)
+
+    def export(self, span):
+        try:
+            self._exporter.export(span)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Unable to export span %s", span.name)
+
+    def shutdown(self):
+        self._exporter.shutdown()
+
+
+@contextmanager
+def activate(span):
+    """Makes span the current span of the calling thread while the block
+    runs, so that handlers can add child spans with traced().
+    """
+    previous = getattr(_CURRENT, 'span', None)
+    _CURRENT.span = span
+    try:
+        yield span
+    finally:
+        _CURRENT.span = previous
+
+
+@contextmanager
+def traced(name, **attributes):
+    """Times the block as a child of the current span, e.g. for a handler
+    to trace decoding its payload:
+
+        with tracing.traced('decode_payload'):
+            payload = cbor.loads(transaction.payload)
+
+    Does nothing when tracing is disabled, or outside of handler.apply.
+    Async handlers have no current span.
+    """
+    parent = getattr(_CURRENT, 'span', None)
+    if parent is None:
+        yield None
+        return
+    with parent.child(name, **attributes) as child, activate(child):
+        yield child
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends each span to a file as a line of JSON.
+
+    Args:
+        path (str): the file to append to
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+class HttpSpanExporter(SpanExporter):
+    """Posts spans in batches, in the OTLP/HTTP JSON encoding, to a
+    collector such as the OpenTelemetry Collector.
+
+    Spans are buffered and sent from a background thread once batch_size
+    have ended, or every interval seconds. Spans that end while
+    max_queue_size are buffered, and spans that cannot be sent, are
+    dropped, counted by dropped and logged at WARNING.
+
+    Args:
+        url (str): e.g. http://localhost:4318/v1/traces
+        service_name (str): reported as the service.name resource attribute
+        batch_size (int): the most spans sent in one request
+        interval (float): the most seconds a span is buffered
+        timeout (float): the seconds to wait for the collector
+        max_queue_size (int): the most spans buffered
+    """
+
+    def __init__(self, url, service_name='sawtooth-transaction-processor',
+                 batch_size=512, interval=5.0, timeout=10.0,
+                 max_queue_size=2048):
+        self._url = url
+        self._service_name = service_name
+        self._batch_size = batch_size
+        self._interval = interval
+        self._timeout = timeout
+        self._max_queue_size = max_queue_size
+        self._spans = []
+        self._dropped = 0
+        self._overflowed = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name='HttpSpanExporter', daemon=True)
+        self._thread.start()
+
+    @property
+    def dropped(self):
+        """The number of spans dropped, because the buffer was full or
+        they could not be sent.
+        """
+        with self._condition:
+            return self._dropped
+
+    def export(self, span):
+        with self._condition:
+            if len(self._spans) >= self._max_queue_size:
+                self._dropped += 1
+                self._overflowed += 1
+                return
+            self._spans.append(span)
+            if len(self._spans) >= self._batch_size:
+                self._condition.notify()
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopped and \
+                        len(self._spans) < self._batch_size:
+                    self._condition.wait(self._interval)
+                batch = self._spans[:self._batch_size]
+                del self._spans[:self._batch_size]
+                stopped = self._stopped and not self._spans
+                overflowed = self._overflowed
+                self._overflowed = 0
+            if overflowed:
+                LOGGER.warning(
+                    "Dropped %s spans: the buffer was full", overflowed)
+            if batch:
+                self._post(batch)
+            if stopped:
+                return
+
+    def _post(self, spans):
+        # Any failure drops the batch but leaves the thread running, so
+        # that the spans that end later are still sent.
+        # pylint: disable=broad-except
+        try:
+            request = urllib.request.Request(
+                self._url,
+                data=json.dumps(self.encode(spans)).encode(),
+                headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=self._timeout):
+                pass
+        except Exception as err:
+            with self._condition:
+                self._dropped += len(spans)
+            LOGGER.warning("Dropped %s spans: %s", len(spans), err)
+
+    def encode(self, spans):
+        """Returns the OTLP JSON request body for spans."""
+        return {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': _otlp_attributes(
+                        {'service.name': self._service_name}),
+                },
+                'scopeSpans': [{
+                    'scope': {'name': 'sawtooth_sdk'},
+                    'spans': [_otlp_span(span) for span in spans],
+                }],
+            }],
+        }
+
+
+def _otlp_span(span):
+    encoded = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': 1,  # SPAN_KIND_INTERNAL
+        'startTimeUnixNano': str(int(span.start_time * 1e9)),
+        'endTimeUnixNano': str(int(span.end_time * 1e9)),
+        'attributes': _otlp_attributes(span.attributes),
+    }
+    if span.parent_id is not None:
+        encoded['parentSpanId'] = span.parent_id
+    return encoded
+
+
+def _otlp_attributes(attributes):
+    encoded = []
+    for key, value in sorted(attributes.items()):
+        if isinstance(value, bool):
+            typed = {'boolValue': value}
+        elif isinstance(value, int):
+            typed = {'intValue': str(value)}
+        elif isinstance(value, float):
+            typed = {'doubleValue': value}
+        else:
+            typed = {'stringValue': str(value)}
+        encoded.append({'key': key, 'value': typed})
+    return encoded
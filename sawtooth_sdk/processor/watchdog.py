@@ -0,0 +1,173 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+
+_PENDING = 0
+_CANCELLED = 1
+_EXPIRED = 2
+
+
+class Watch:
+    """A transaction watched by a Watchdog, which either finishes, and
+    cancels the watch, or reaches its deadline first.
+
+    Attributes:
+        deadline (float): the time.monotonic() by which the transaction
+            must finish
+    """
+
+    __slots__ = ('deadline', '_on_expired', '_lock', '_state', '_watchdog')
+
+    def __init__(self, deadline, on_expired, watchdog=None):
+        self.deadline = deadline
+        self._on_expired = on_expired
+        self._lock = threading.Lock()
+        self._state = _PENDING
+        self._watchdog = watchdog
+
+    @property
+    def expired(self):
+        """Whether the deadline passed before the watch was cancelled."""
+        return self._state == _EXPIRED
+
+    def cancel(self):
+        """Stops the watch, if it has not expired. May be called more than
+        once.
+
+        Returns:
+            (bool): whether the transaction finished before its deadline,
+                in which case on_expired is never called
+        """
+        with self._lock:
+            if self._state != _PENDING:
+                return self._state == _CANCELLED
+            self._state = _CANCELLED
+            self._on_expired = None
+        if self._watchdog is not None:
+            self._watchdog._cancelled()  # pylint: disable=protected-access
+        return True
+
+    def _expire(self):
+        with self._lock:
+            if self._state != _PENDING:
+                return False
+            self._state = _EXPIRED
+        return True
+
+
+class Watchdog:
+    """Calls the on_expired function of each Watch whose deadline passes
+    before it is cancelled, from a thread of its own, which is started by
+    the first call to watch.
+
+    Cancelled watches are dropped once they reach the front of the heap,
+    or, should they come to outnumber the pending ones, all at once, so
+    that the heap does not grow with the transactions finished within
+    the last deadline.
+    """
+
+    def __init__(self):
+        self._watches = []
+        # The cancelled watches still in the heap, or more, as a watch
+        # may be cancelled after it has been taken off to expire.
+        self._cancelled_count = 0
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, deadline, on_expired):
+        """Watches a transaction.
+
+        Args:
+            deadline (float): the time.monotonic() by which the transaction
+                must finish
+            on_expired (callable): called with the Watch if the
+                transaction does not finish by its deadline
+
+        Returns:
+            (Watch): to be cancelled once the transaction has finished
+        """
+        watch = Watch(deadline, on_expired, self)
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='TransactionWatchdog', daemon=True)
+                self._thread.start()
+            heapq.heappush(
+                self._watches, (deadline, next(self._order), watch))
+            # Only the earliest deadline can shorten the thread's wait.
+            if self._watches[0][2] is watch:
+                self._condition.notify()
+        return watch
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def __len__(self):
+        """The number of watches held, including cancelled ones yet to be
+        dropped.
+        """
+        with self._condition:
+            return len(self._watches)
+
+    def _cancelled(self):
+        with self._condition:
+            self._cancelled_count += 1
+            if self._cancelled_count > len(self._watches) // 2:
+                self._watches = [
+                    entry for entry in self._watches
+                    # pylint: disable=protected-access
+                    if entry[2]._state == _PENDING
+                ]
+                heapq.heapify(self._watches)
+                self._cancelled_count = 0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._watches:
+                        self._condition.wait()
+                        continue
+                    # pylint: disable=protected-access
+                    if self._watches[0][2]._state == _CANCELLED:
+                        heapq.heappop(self._watches)
+                        self._cancelled_count = max(
+                            0, self._cancelled_count - 1)
+                        continue
+                    remaining = self._watches[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopped:
+                    return
+                _, _, watch = heapq.heappop(self._watches)
+            if watch._expire():  # pylint: disable=protected-access
+                try:
+                    # pylint: disable=protected-access
+                    watch._on_expired(watch)
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Error handling an expired transaction")
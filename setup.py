@@ -48,4 +48,8 @@ setup(
         "secp256k1",
         "toml",
         "PyYAML",
-    ])
+    ],
+    extras_require={
+        # For the on-disk store of sawtooth_processor_test.merkle.
+        "lmdb": ["lmdb"],
+    })
@@ -13,14 +13,22 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+import asyncio
+import time
 import unittest
 from unittest.mock import Mock
 
 from collections import OrderedDict
 
+from sawtooth_sdk.processor.context import AsyncContext
 from sawtooth_sdk.processor.context import Context
+from sawtooth_sdk.processor.context import gather
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.exceptions import InternalError
 from sawtooth_sdk.messaging.future import Future
 from sawtooth_sdk.messaging.future import FutureResult
+from sawtooth_sdk.messaging.future import FutureTimeoutError
+from sawtooth_sdk.messaging.metrics import MetricsRegistry
 
 from sawtooth_sdk.protobuf.validator_pb2 import Message
 from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
@@ -80,6 +88,26 @@ class ContextTest(unittest.TestCase):
                 context_id=self.context_id,
                 addresses=self.addresses).SerializeToString())
 
+    def test_request_metrics(self):
+        """Tests that the requests made through a Context are counted, and
+        their latency recorded when a registry is given.
+        """
+        metrics = MetricsRegistry()
+        context = Context(self.mock_stream, self.context_id, metrics=metrics)
+        self.mock_stream.send.return_value = self._make_future(
+            message_type=Message.TP_STATE_GET_RESPONSE,
+            content=TpStateGetResponse(
+                status=TpStateGetResponse.OK,
+                entries=self._make_entries()).SerializeToString())
+
+        context.get_state(self.addresses)
+        context.get_state(self.addresses)
+
+        self.assertEqual(context.request_count, 2)
+        self.assertEqual(
+            metrics.histogram(
+                'tp_context_request_seconds', request='get').count, 2)
+
     def test_state_set(self):
         """Tests that State sets addresses correctly."""
         self.mock_stream.send.return_value = self._make_future(
@@ -144,3 +172,261 @@ class ContextTest(unittest.TestCase):
                     event_type="test",
                     attributes=[Event.Attribute(key="test", value="test")],
                     data=b"test")).SerializeToString())
+
+    def test_async_requests(self):
+        """Tests that the non-blocking variants send every request before
+        any response is waited on, and that gather returns the results in
+        order.
+        """
+        pending = [Future(self.context_id) for _ in range(3)]
+        self.mock_stream.send.side_effect = pending
+
+        futures = [
+            self.context.get_state_async(["a"]),
+            self.context.set_state_async({"b": b"b"}),
+            self.context.add_event_async("test"),
+        ]
+        self.assertEqual(self.mock_stream.send.call_count, 3)
+        self.assertFalse(any(f.done() for f in futures))
+
+        pending[0].set_result(FutureResult(
+            message_type=Message.TP_STATE_GET_RESPONSE,
+            content=TpStateGetResponse(
+                status=TpStateGetResponse.OK,
+                entries=[TpStateEntry(address="a", data=b"a")]
+            ).SerializeToString()))
+        pending[1].set_result(FutureResult(
+            message_type=Message.TP_STATE_SET_RESPONSE,
+            content=TpStateSetResponse(
+                status=TpStateSetResponse.OK,
+                addresses=["b"]).SerializeToString()))
+        pending[2].set_result(FutureResult(
+            message_type=Message.TP_EVENT_ADD_RESPONSE,
+            content=TpEventAddResponse(
+                status=TpEventAddResponse.OK).SerializeToString()))
+
+        entries, addresses, event = gather(futures, timeout=1)
+        self.assertEqual([(e.address, e.data) for e in entries], [("a", b"a")])
+        self.assertEqual(addresses, ["b"])
+        self.assertIsNone(event)
+
+
+class CachedContextTest(unittest.TestCase):
+    def setUp(self):
+        self.context_id = "test"
+        self.mock_stream = Mock()
+
+    def _make_future(self, message_type, content):
+        f = Future(self.context_id)
+        f.set_result(FutureResult(
+            message_type=message_type,
+            content=content))
+        return f
+
+    def _get_response(self, entries):
+        return self._make_future(
+            message_type=Message.TP_STATE_GET_RESPONSE,
+            content=TpStateGetResponse(
+                status=TpStateGetResponse.OK,
+                entries=[
+                    TpStateEntry(address=a, data=d) for a, d in entries
+                ]).SerializeToString())
+
+    def test_repeated_get(self):
+        """Tests that only the addresses not yet read are requested, and
+        that unset addresses are remembered as well.
+        """
+        context = Context(self.mock_stream, self.context_id, cache=True)
+        self.mock_stream.send.side_effect = [
+            self._get_response([("a", b"1"), ("b", b"")]),
+            self._get_response([("c", b"3")]),
+        ]
+
+        first = context.get_state(["a", "b"])
+        second = context.get_state(["a", "b", "c"])
+
+        self.assertEqual([(e.address, e.data) for e in first], [("a", b"1")])
+        self.assertEqual(
+            [(e.address, e.data) for e in second],
+            [("a", b"1"), ("c", b"3")])
+        self.mock_stream.send.assert_called_with(
+            Message.TP_STATE_GET_REQUEST,
+            TpStateGetRequest(
+                context_id=self.context_id,
+                addresses=["c"]).SerializeToString())
+        self.assertEqual(self.mock_stream.send.call_count, 2)
+
+    def test_get_after_set(self):
+        """Tests that reading an address that was set is served from the
+        cache.
+        """
+        context = Context(self.mock_stream, self.context_id, cache=True)
+        self.mock_stream.send.return_value = self._make_future(
+            message_type=Message.TP_STATE_SET_RESPONSE,
+            content=TpStateSetResponse(
+                status=TpStateSetResponse.OK,
+                addresses=["a"]).SerializeToString())
+
+        context.set_state({"a": b"1"})
+        entries = context.get_state(["a"])
+
+        self.assertEqual([(e.address, e.data) for e in entries], [("a", b"1")])
+        self.assertEqual(self.mock_stream.send.call_count, 1)
+
+    def test_write_back(self):
+        """Tests that sets and deletes are held until flush, and that only
+        the last change to each address is sent.
+        """
+        context = Context(self.mock_stream, self.context_id, write_back=True)
+
+        self.assertEqual(context.set_state({"a": b"1", "b": b"2"}), ["a", "b"])
+        self.assertEqual(context.delete_state(["b", "c"]), ["b", "c"])
+        self.assertEqual(context.set_state({"c": b"3"}), ["c"])
+        self.assertEqual(
+            [(e.address, e.data) for e in context.get_state(["a", "b"])],
+            [("a", b"1")])
+        self.mock_stream.send.assert_not_called()
+
+        self.mock_stream.send.side_effect = [
+            self._make_future(
+                message_type=Message.TP_STATE_SET_RESPONSE,
+                content=TpStateSetResponse(
+                    status=TpStateSetResponse.OK,
+                    addresses=["a", "c"]).SerializeToString()),
+            self._make_future(
+                message_type=Message.TP_STATE_DELETE_RESPONSE,
+                content=TpStateDeleteResponse(
+                    status=TpStateDeleteResponse.OK,
+                    addresses=["b"]).SerializeToString()),
+        ]
+        context.flush()
+
+        self.assertEqual(
+            self.mock_stream.send.call_args_list[0][0],
+            (Message.TP_STATE_SET_REQUEST,
+             TpStateSetRequest(
+                 context_id=self.context_id,
+                 entries=[
+                     TpStateEntry(address="a", data=b"1"),
+                     TpStateEntry(address="c", data=b"3"),
+                 ]).SerializeToString()))
+        self.assertEqual(
+            self.mock_stream.send.call_args_list[1][0],
+            (Message.TP_STATE_DELETE_REQUEST,
+             TpStateDeleteRequest(
+                 context_id=self.context_id,
+                 addresses=["b"]).SerializeToString()))
+
+    def test_write_back_unauthorized(self):
+        """Tests that an authorization error surfaces from flush."""
+        context = Context(self.mock_stream, self.context_id, write_back=True)
+        context.set_state({"a": b"1"})
+        self.mock_stream.send.return_value = self._make_future(
+            message_type=Message.TP_STATE_SET_RESPONSE,
+            content=TpStateSetResponse(
+                status=TpStateSetResponse.AUTHORIZATION_ERROR
+            ).SerializeToString())
+
+        with self.assertRaises(AuthorizationException):
+            context.flush()
+
+    def test_prefetch(self):
+        """Tests that prefetched addresses are not requested again, and
+        that an authorization error while prefetching is ignored.
+        """
+        context = Context(self.mock_stream, self.context_id, cache=True)
+        self.mock_stream.send.return_value = \
+            self._get_response([("a", b"1"), ("b", b"")])
+
+        context.prefetch(["a", "b"])
+        entries = context.get_state(["b", "a"])
+
+        self.assertEqual([(e.address, e.data) for e in entries], [("a", b"1")])
+        self.assertEqual(self.mock_stream.send.call_count, 1)
+
+        self.mock_stream.send.return_value = self._make_future(
+            message_type=Message.TP_STATE_GET_RESPONSE,
+            content=TpStateGetResponse(
+                status=TpStateGetResponse.AUTHORIZATION_ERROR
+            ).SerializeToString())
+        context.prefetch(["c"])
+        with self.assertRaises(AuthorizationException):
+            context.get_state(["c"])
+
+    def test_deadline(self):
+        """Tests that requests only wait for the time left before the
+        deadline, and that InternalError is raised once it passes.
+        """
+        context = Context(
+            self.mock_stream, self.context_id,
+            deadline=time.monotonic() + 0.2)
+        self.mock_stream.send.return_value = Future(self.context_id)
+
+        with self.assertRaises(FutureTimeoutError):
+            context.get_state(["a"], timeout=0.01)
+        with self.assertRaises(InternalError):
+            context.get_state(["a"], timeout=10)
+        with self.assertRaises(InternalError):
+            context.set_state_async({"a": b"a"}).result()
+
+
+class AsyncContextTest(unittest.TestCase):
+    def setUp(self):
+        self.context_id = "test"
+        self.mock_stream = Mock()
+        self.context = AsyncContext(self.mock_stream, self.context_id)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_state_get(self):
+        """Tests that an unresolved future is awaited until the stream
+        resolves it.
+        """
+        future = Future(self.context_id)
+        self.mock_stream.send.return_value = future
+
+        def resolve():
+            future.set_result(FutureResult(
+                message_type=Message.TP_STATE_GET_RESPONSE,
+                content=TpStateGetResponse(
+                    status=TpStateGetResponse.OK,
+                    entries=[TpStateEntry(address="a", data=b"a")]
+                ).SerializeToString()))
+
+        self.loop.call_soon(resolve)
+        results = self.loop.run_until_complete(
+            self.context.get_state(["a"]))
+
+        self.assertEqual([(e.address, e.data) for e in results], [("a", b"a")])
+        self.mock_stream.send.assert_called_with(
+            Message.TP_STATE_GET_REQUEST,
+            TpStateGetRequest(
+                context_id=self.context_id,
+                addresses=["a"]).SerializeToString())
+
+    def test_state_set_unauthorized(self):
+        """Tests that an authorization error is raised from the coroutine.
+        """
+        future = Future(self.context_id)
+        future.set_result(FutureResult(
+            message_type=Message.TP_STATE_SET_RESPONSE,
+            content=TpStateSetResponse(
+                status=TpStateSetResponse.AUTHORIZATION_ERROR
+            ).SerializeToString()))
+        self.mock_stream.send.return_value = future
+
+        with self.assertRaises(AuthorizationException):
+            self.loop.run_until_complete(
+                self.context.set_state({"a": b"a"}))
+
+    def test_deadline(self):
+        """Tests that InternalError is raised once the deadline passes."""
+        self.mock_stream.send.return_value = Future(self.context_id)
+        context = AsyncContext(
+            self.mock_stream, self.context_id,
+            deadline=time.monotonic() + 0.05)
+
+        with self.assertRaises(InternalError):
+            self.loop.run_until_complete(context.get_state(["a"]))
@@ -0,0 +1,117 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import sys
+import threading
+import unittest
+
+from sawtooth_sdk.messaging.future import Future
+from sawtooth_sdk.messaging.future import FutureCollection
+from sawtooth_sdk.messaging.future import FutureCollectionKeyError
+from sawtooth_sdk.messaging.future import FutureResult
+from sawtooth_sdk.messaging.future import FutureTimeoutError
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+class TestFuture(unittest.TestCase):
+    def test_result_set_on_another_thread(self):
+        """Tests that every waiter is released once the result is set."""
+        future = Future(b'id')
+        result = FutureResult(message_type=Message.PING_RESPONSE, content=b'')
+        results = []
+
+        waiters = [
+            threading.Thread(target=lambda: results.append(future.result(5)))
+            for _ in range(3)
+        ]
+        for waiter in waiters:
+            waiter.start()
+        future.set_result(result)
+        for waiter in waiters:
+            waiter.join()
+
+        self.assertEqual(results, [result] * 3)
+        self.assertIs(future.result(), result)
+
+    def test_timeout(self):
+        future = Future(b'id', request_type=Message.TP_STATE_GET_REQUEST)
+        with self.assertRaises(FutureTimeoutError):
+            future.result(0.01)
+        self.assertFalse(future.done())
+
+    def test_done_callbacks(self):
+        """Tests that callbacks run once, whether added before or after the
+        result is set.
+        """
+        future = Future(b'id')
+        result = FutureResult(message_type=Message.PING_RESPONSE, content=b'')
+        calls = []
+
+        future.add_done_callback(calls.append)
+        future.set_result(result)
+        future.add_done_callback(calls.append)
+        future.set_result(result)
+
+        self.assertEqual(calls, [result, result])
+
+    def test_concurrent_set_result(self):
+        """Tests that results set on several threads at once release the
+        waiters, and run the callbacks, only once.
+        """
+        result = FutureResult(message_type=Message.PING_RESPONSE, content=b'')
+        errors = []
+        # Switching threads as often as possible makes the setters race.
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+
+        def set_result(future, barrier):
+            barrier.wait()
+            try:
+                future.set_result(result)
+            except RuntimeError as err:
+                errors.append(err)
+
+        for _ in range(200):
+            future = Future(b'id')
+            calls = []
+            future.add_done_callback(calls.append)
+            barrier = threading.Barrier(4)
+            setters = [
+                threading.Thread(target=set_result, args=(future, barrier))
+                for _ in range(4)
+            ]
+            for setter in setters:
+                setter.start()
+            for setter in setters:
+                setter.join()
+            self.assertEqual(calls, [result])
+
+        self.assertEqual(errors, [])
+
+
+class TestFutureCollection(unittest.TestCase):
+    def test_resolve(self):
+        """Tests that resolve sets the result and removes the future."""
+        collection = FutureCollection()
+        future = Future(b'id')
+        result = FutureResult(message_type=Message.PING_RESPONSE, content=b'')
+        collection.put(future)
+
+        self.assertTrue(collection.resolve(b'id', result))
+        self.assertIs(future.result(0), result)
+        self.assertFalse(collection.resolve(b'id', result))
+        with self.assertRaises(FutureCollectionKeyError):
+            collection.get(b'id')
+        self.assertEqual(collection.future_values(), [])
@@ -0,0 +1,144 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import unittest
+
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
+
+from sawtooth_processor_test.bench import make_request
+from sawtooth_processor_test.bench import run_benchmark
+from sawtooth_processor_test.bench import trace_memory
+from sawtooth_processor_test.local_context import LocalContext
+from sawtooth_processor_test.local_context import LocalState
+
+
+ADDRESS = 'abcdef' + '0' * 64
+OTHER_ADDRESS = 'abcdef' + '1' * 64
+FOREIGN_ADDRESS = '123456' + '0' * 64
+
+
+class CountHandler(TransactionHandler):
+    """Increments the byte at the address named by the payload, and
+    rejects it when it would pass 2.
+    """
+
+    # pylint: disable=invalid-overridden-method
+    @property
+    def family_name(self):
+        return 'count'
+
+    @property
+    def family_versions(self):
+        return ['1.0']
+
+    @property
+    def namespaces(self):
+        return ['abcdef']
+
+    def apply(self, transaction, context):
+        address = transaction.payload.decode()
+        entries = context.get_state([address])
+        count = entries[0].data[0] if entries else 0
+        if count == 2:
+            raise InvalidTransaction('count is 2')
+        context.set_state({address: bytes([count + 1])})
+
+
+class TestLocalContext(unittest.TestCase):
+
+    def setUp(self):
+        self.state = LocalState({ADDRESS: b'1'})
+        self.context = LocalContext(self.state, ['abcdef'], [ADDRESS])
+
+    def test_get_state(self):
+        """Tests that state is read from the pending changes, then the
+        state, and that unset and deleted addresses are omitted.
+        """
+        self.assertEqual(
+            self.context.get_state([ADDRESS, OTHER_ADDRESS]),
+            [TpStateEntry(address=ADDRESS, data=b'1')])
+
+        self.context.set_state({ADDRESS: b'2'})
+        self.assertEqual(
+            self.context.get_state([ADDRESS]),
+            [TpStateEntry(address=ADDRESS, data=b'2')])
+        self.assertEqual(self.state.get(ADDRESS), b'1')
+
+        self.assertEqual(self.context.delete_state([ADDRESS]), [ADDRESS])
+        self.assertEqual(self.context.get_state([ADDRESS]), [])
+        self.assertEqual(self.context.delete_state([ADDRESS]), [])
+
+    def test_authorization(self):
+        """Tests that addresses outside of the inputs and outputs are
+        rejected, as the validator rejects them.
+        """
+        with self.assertRaises(AuthorizationException):
+            self.context.get_state([FOREIGN_ADDRESS])
+        with self.assertRaises(AuthorizationException):
+            self.context.set_state({OTHER_ADDRESS: b'1'})
+        with self.assertRaises(AuthorizationException):
+            self.context.delete_state([OTHER_ADDRESS])
+
+        future = self.context.set_state_async({OTHER_ADDRESS: b'1'})
+        self.assertTrue(future.done())
+        with self.assertRaises(AuthorizationException):
+            future.result()
+        self.assertEqual(self.context.changes, {})
+
+    def test_commit(self):
+        """Tests that the changes are applied to the state on commit."""
+        self.context.delete_state([ADDRESS])
+        self.context.add_receipt_data(b'receipt')
+        self.context.add_event('count/deleted', [('key', 'value')], b'data')
+        self.assertEqual(len(self.state), 1)
+
+        self.context.commit()
+        self.assertEqual(len(self.state), 0)
+        self.assertEqual(self.context.receipt_data, [b'receipt'])
+        self.assertEqual(self.context.events[0].event_type, 'count/deleted')
+        self.assertEqual(self.context.events[0].attributes[0].key, 'key')
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_benchmark(self):
+        """Tests that each transaction sees the changes of the valid ones
+        before it.
+        """
+        transactions = [
+            make_request(
+                'count', '1.0', ADDRESS.encode(), [ADDRESS], [ADDRESS],
+                nonce=str(i))
+            for i in range(4)
+        ]
+        state = LocalState()
+        report = run_benchmark(CountHandler(), transactions, state)
+
+        self.assertEqual(len(report.latencies), 4)
+        self.assertEqual(report.statuses, {
+            TpProcessResponse.OK: 2,
+            TpProcessResponse.INVALID_TRANSACTION: 2,
+        })
+        self.assertEqual(state.get(ADDRESS), bytes([2]))
+        self.assertGreater(report.throughput, 0)
+        self.assertLessEqual(report.percentile(50), report.percentile(99))
+        self.assertIn('invalid_transaction: 2', report.format())
+
+        peak, _ = trace_memory(CountHandler(), transactions)
+        self.assertGreater(peak, 0)
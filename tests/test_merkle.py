@@ -0,0 +1,105 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import unittest
+
+from sawtooth_processor_test.local_context import LocalContext
+from sawtooth_processor_test.merkle import EMPTY_ROOT
+from sawtooth_processor_test.merkle import MerkleTree
+from sawtooth_processor_test.merkle import decode_node
+from sawtooth_processor_test.merkle import encode_node
+
+
+FIRST = 'abcdef' + '0' * 64
+SECOND = 'abcdef' + '0' * 63 + '1'
+THIRD = '123456' + 'f' * 64
+
+# The roots computed by the validator's MerkleDatabase.
+VALIDATOR_EMPTY_ROOT = \
+    '708ca7fbb701799bb387f2e50deaca402e8502abe229f705693d2d4f350e1ad6'
+VALIDATOR_ROOT = \
+    '53fd71a1436a4e95c1a50cf6696875b3e652f643810f4f5d1c40e6cb5da60ec1'
+
+
+class TestMerkleTree(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = MerkleTree()
+
+    def test_validator_roots(self):
+        """Tests that the roots are those the validator computes, and that
+        deleting every address returns the tree to the empty root.
+        """
+        self.assertEqual(EMPTY_ROOT, VALIDATOR_EMPTY_ROOT)
+        self.assertEqual(self.tree.root, EMPTY_ROOT)
+
+        root = self.tree.update({FIRST: b'one', SECOND: b'two'})
+        self.assertEqual(self.tree.root, root)
+        self.tree.update({THIRD: b'three'})
+        self.assertEqual(self.tree.root, VALIDATOR_ROOT)
+        self.assertEqual(self.tree.get(SECOND), b'two')
+        self.assertIsNone(self.tree.get('abcdef' + '2' * 64))
+
+        self.tree.update({}, [FIRST, SECOND, THIRD])
+        self.assertEqual(self.tree.root, EMPTY_ROOT)
+
+        with self.assertRaises(KeyError):
+            self.tree.update({}, [FIRST])
+
+    def test_roots(self):
+        """Tests that virtual updates leave the tree unchanged, and that
+        earlier roots remain readable.
+        """
+        first = self.tree.update({FIRST: b'one'})
+        virtual = self.tree.update({FIRST: b'changed'}, virtual=True)
+        self.assertEqual(self.tree.root, first)
+        self.assertEqual(self.tree.get(FIRST), b'one')
+
+        self.tree.update({FIRST: b'changed'})
+        self.assertEqual(self.tree.root, virtual)
+        self.tree.set_root(first)
+        self.assertEqual(self.tree.get(FIRST), b'one')
+
+        with self.assertRaises(KeyError):
+            self.tree.set_root('0' * 64)
+
+    def test_leaves(self):
+        """Tests iterating over the leaves under a prefix."""
+        self.tree.update({FIRST: b'one', SECOND: b'two', THIRD: b'three'})
+        self.assertEqual(
+            list(self.tree),
+            [(THIRD, b'three'), (FIRST, b'one'), (SECOND, b'two')])
+        self.assertEqual(
+            list(self.tree.leaves('abcde')),
+            [(FIRST, b'one'), (SECOND, b'two')])
+        self.assertEqual(list(self.tree.leaves(SECOND)), [(SECOND, b'two')])
+        self.assertEqual(list(self.tree.leaves('ff')), [])
+
+    def test_local_context(self):
+        """Tests that the tree can be the state of a LocalContext."""
+        self.tree.update({FIRST: b'one', SECOND: b'two'})
+        context = LocalContext(self.tree, ['abcdef'], ['abcdef'])
+        context.delete_state([SECOND, 'abcdef' + '2' * 64])
+        context.set_state({FIRST: b'updated'})
+        context.commit()
+
+        self.assertEqual(list(self.tree), [(FIRST, b'updated')])
+
+    def test_encoding(self):
+        """Tests that nodes survive encoding."""
+        node = {'v': b'\x00' * 300, 'c': {'0a': 'f' * 64, '01': 'e' * 64}}
+        self.assertEqual(decode_node(encode_node(node)), node)
+        self.assertEqual(
+            encode_node({'v': None, 'c': {}}).hex(), 'a26163a06176f6')
@@ -0,0 +1,60 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import unittest
+import urllib.request
+
+from sawtooth_sdk.messaging.metrics import MetricsRegistry
+from sawtooth_sdk.messaging.metrics import PrometheusExporter
+from sawtooth_sdk.messaging.metrics import format_prometheus
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter(
+            'tp_transactions_total', family='intkey', status='OK').inc(2)
+        self.registry.gauge('queue_depth').set_function(lambda: 7)
+        histogram = self.registry.histogram('latency', buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+    def test_format_prometheus(self):
+        self.assertEqual(
+            format_prometheus(self.registry).splitlines(),
+            [
+                '# TYPE latency histogram',
+                'latency_bucket{le="0.1"} 1',
+                'latency_bucket{le="1.0"} 2',
+                'latency_bucket{le="+Inf"} 2',
+                'latency_sum 0.55',
+                'latency_count 2',
+                '# TYPE queue_depth gauge',
+                'queue_depth 7',
+                '# TYPE tp_transactions_total counter',
+                'tp_transactions_total{family="intkey",status="OK"} 2',
+            ])
+
+    def test_prometheus_exporter(self):
+        exporter = PrometheusExporter(port=0)
+        exporter.start(self.registry)
+        try:
+            with urllib.request.urlopen(
+                    'http://127.0.0.1:{}/metrics'.format(exporter.port),
+                    timeout=5) as response:
+                body = response.read().decode()
+        finally:
+            exporter.stop()
+        self.assertEqual(body, format_prometheus(self.registry))
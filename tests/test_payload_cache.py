@@ -0,0 +1,75 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import unittest
+
+from sawtooth_sdk.messaging.metrics import MetricsRegistry
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.processor.memo import PayloadCache
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+
+
+class TestPayloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+        self.cache = PayloadCache(max_entries=2, metrics=self.metrics)
+        self.decoded = []
+
+    def decode(self, transaction):
+        self.decoded.append(transaction.signature)
+        if transaction.payload == b'bad':
+            raise InvalidTransaction('Malformed', extended_data=b'bad')
+        return transaction.payload.decode()
+
+    def lookups(self, result):
+        return self.metrics.counter(
+            'tp_payload_cache_lookups_total', result=result).value
+
+    def test_decode(self):
+        """Tests that a payload is decoded once per signature, and that the
+        least recently used payload is evicted.
+        """
+        first = TpProcessRequest(signature='first', payload=b'one')
+        second = TpProcessRequest(signature='second', payload=b'two')
+        third = TpProcessRequest(signature='third', payload=b'three')
+
+        self.assertEqual(self.cache.decode(first, self.decode), 'one')
+        self.assertEqual(self.cache.decode(first, self.decode), 'one')
+        self.cache.decode(second, self.decode)
+        self.cache.decode(first, self.decode)
+        self.cache.decode(third, self.decode)
+        self.cache.decode(second, self.decode)
+
+        self.assertEqual(
+            self.decoded, ['first', 'second', 'third', 'second'])
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.lookups('hit'), 2)
+        self.assertEqual(self.lookups('miss'), 4)
+        self.assertAlmostEqual(self.cache.hit_rate, 1 / 3)
+        self.assertEqual(
+            self.metrics.gauge('tp_payload_cache_entries').value, 2)
+
+    def test_invalid(self):
+        """Tests that an InvalidTransaction is cached and raised again."""
+        bad = TpProcessRequest(signature='bad', payload=b'bad')
+        for _ in range(2):
+            with self.assertRaises(InvalidTransaction) as raised:
+                self.cache.decode(bad, self.decode)
+            self.assertEqual(str(raised.exception), 'Malformed')
+            self.assertEqual(raised.exception.extended_data, b'bad')
+
+        self.assertEqual(self.decoded, ['bad'])
+        self.assertEqual(self.lookups('hit'), 1)
@@ -0,0 +1,666 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import threading
+import random
+import string
+import time
+import unittest
+
+import zmq
+
+from sawtooth_sdk.messaging.metrics import MetricsExporter
+from sawtooth_sdk.processor.core import TransactionProcessor
+from sawtooth_sdk.processor.handler import AsyncTransactionHandler
+from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.processor import core
+from sawtooth_sdk.processor import tracing
+from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterRequest
+from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterResponse
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
+from sawtooth_sdk.protobuf.state_context_pb2 import TpEventAddRequest
+from sawtooth_sdk.protobuf.state_context_pb2 import TpEventAddResponse
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateGetRequest
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateGetResponse
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateSetRequest
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateSetResponse
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+from sawtooth_sdk.protobuf.network_pb2 import PingRequest
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+SOURCE = 'abcdef' + '0' * 64
+DESTINATION = 'abcdef' + '1' * 64
+
+
+class _TestFamily:
+    """The family of the handlers of these tests."""
+
+    @property
+    def family_name(self):
+        return 'test'
+
+    @property
+    def family_versions(self):
+        return ['1.0']
+
+    @property
+    def namespaces(self):
+        return ['abcdef']
+
+
+class FunctionHandler(_TestFamily, TransactionHandler):
+    """Handler whose apply calls apply_function with the transaction and
+    context, and counts its calls.
+    """
+
+    # pylint: disable=invalid-overridden-method
+    def __init__(self, apply_function, deterministic=False):
+        self.apply_function = apply_function
+        self._deterministic = deterministic
+        self.calls = 0
+
+    @property
+    def deterministic(self):
+        return self._deterministic
+
+    def apply(self, transaction, context):
+        self.calls += 1
+        self.apply_function(transaction, context)
+
+
+class AsyncFunctionHandler(_TestFamily, AsyncTransactionHandler):
+    """Async handler whose apply awaits apply_function with the
+    transaction and context.
+    """
+
+    # pylint: disable=invalid-overridden-method
+    def __init__(self, apply_function):
+        self.apply_function = apply_function
+
+    async def apply(self, transaction, context):
+        await self.apply_function(transaction, context)
+
+
+def get_own_address(transaction, context):
+    """Reads a single address from state."""
+    context.get_state(['abcdef' + transaction.signature])
+
+
+async def get_own_address_async(transaction, context):
+    await context.get_state(['abcdef' + transaction.signature])
+
+
+def copy_source(transaction, context):
+    """Copies one address to another, and adds an event."""
+    entries = context.get_state([SOURCE])
+    context.set_state({DESTINATION: entries[0].data})
+    context.add_event('test/copied', [('signature', 'sig')])
+
+
+def fail(transaction, context):
+    """Fails with an error other than those a handler is expected to
+    raise.
+    """
+    raise KeyError(transaction.signature)
+
+
+async def fail_async(transaction, context):
+    raise KeyError(transaction.signature)
+
+
+def wait_at(barrier):
+    """Returns an apply function that only returns once all the parties
+    of the barrier are waiting at it.
+    """
+    return lambda transaction, context: barrier.wait()
+
+
+def stuck_until(released):
+    """Returns an apply function that, for the transaction with signature
+    'stuck', only returns once released is set.
+    """
+    def apply(transaction, context):
+        if transaction.signature == 'stuck':
+            released.wait(5)
+    return apply
+
+
+class TestTransactionProcessor(unittest.TestCase):
+    def setUp(self):
+        self.ctx = zmq.Context.instance()
+        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.RCVTIMEO, 5000)
+        self.socket.bind('tcp://127.0.0.1:*')
+        self.url = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.connection_id = None
+        self.processor = None
+
+    def tearDown(self):
+        # The processor thread is a daemon blocked waiting for the next
+        # request, so it is not joined here.
+        if self.processor is not None:
+            self.processor.stop()
+        self.socket.close(linger=0)
+
+    def start_processor(self, handler, **kwargs):
+        self.processor = TransactionProcessor(self.url, **kwargs)
+        self.processor.add_handler(handler)
+        threading.Thread(target=self.processor.start, daemon=True).start()
+
+    def recv(self):
+        # pylint: disable=unbalanced-tuple-unpacking
+        connection_id, message_bytes = self.socket.recv_multipart(0)
+        self.connection_id = connection_id
+
+        message = Message()
+        message.ParseFromString(message_bytes)
+        return message
+
+    def send(self, message_type, content, correlation_id=None):
+        message = Message(
+            message_type=message_type,
+            correlation_id=correlation_id or generate_correlation_id(),
+            content=content.SerializeToString())
+        self.socket.send_multipart(
+            [self.connection_id, message.SerializeToString()], 0)
+        return message.correlation_id
+
+    def register(self):
+        message = self.recv()
+        self.assertEqual(message.message_type, Message.TP_REGISTER_REQUEST)
+        request = TpRegisterRequest()
+        request.ParseFromString(message.content)
+        self.send(
+            Message.TP_REGISTER_RESPONSE,
+            TpRegisterResponse(status=TpRegisterResponse.OK),
+            correlation_id=message.correlation_id)
+        return request
+
+    def send_process_request(self, signature=None):
+        return self.send(
+            Message.TP_PROCESS_REQUEST,
+            TpProcessRequest(
+                header=TransactionHeader(
+                    family_name='test',
+                    family_version='1.0'),
+                context_id='context',
+                signature=signature or generate_correlation_id()))
+
+    def answer(self, message_type, response):
+        """Receives a request of message_type, answers it, and returns
+        the request's message.
+        """
+        message = self.recv()
+        self.assertEqual(
+            Message.MessageType.Name(message.message_type),
+            Message.MessageType.Name(message_type))
+        self.send(
+            message_type + 1, response,
+            correlation_id=message.correlation_id)
+        return message
+
+    def test_register_without_workers(self):
+        self.start_processor(
+            FunctionHandler(wait_at(threading.Barrier(1, timeout=5))))
+
+        request = self.register()
+
+        self.assertEqual(request.family, 'test')
+        self.assertEqual(request.max_occupancy, 0)
+
+    def test_concurrent_workers(self):
+        """Tests that transactions are applied concurrently up to
+        max_workers, and that each response is correlated with its request.
+        """
+        self.start_processor(
+            FunctionHandler(wait_at(threading.Barrier(3, timeout=5))),
+            max_workers=3)
+
+        request = self.register()
+        self.assertEqual(request.max_occupancy, 3)
+
+        correlation_ids = {self.send_process_request() for _ in range(3)}
+
+        responses = {}
+        for _ in range(3):
+            message = self.recv()
+            self.assertEqual(
+                message.message_type, Message.TP_PROCESS_RESPONSE)
+            response = TpProcessResponse()
+            response.ParseFromString(message.content)
+            responses[message.correlation_id] = response.status
+
+        self.assertEqual(set(responses), correlation_ids)
+        self.assertEqual(
+            set(responses.values()), {TpProcessResponse.OK})
+
+        # the metrics are recorded once the response has been sent
+        transactions = self.processor.metrics.counter(
+            'tp_transactions_total', family='test', version='1.0',
+            status='OK')
+        deadline = time.monotonic() + 5
+        while transactions.value < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(transactions.value, 3)
+        self.assertEqual(
+            self.processor.metrics.histogram(
+                'tp_apply_seconds', family='test', version='1.0').count, 3)
+
+    def test_unhandled_error_in_worker(self):
+        """Tests that a transaction whose handler fails unexpectedly on a
+        worker is answered with INTERNAL_ERROR, and its slot freed.
+        """
+        self.start_processor(FunctionHandler(fail), max_workers=1)
+        self.register()
+
+        for _ in range(2):
+            correlation_id = self.send_process_request()
+            message = self.recv()
+            self.assertEqual(message.correlation_id, correlation_id)
+            response = TpProcessResponse()
+            response.ParseFromString(message.content)
+            self.assertEqual(
+                response.status, TpProcessResponse.INTERNAL_ERROR)
+
+    def test_async_handler(self):
+        """Tests that an async handler keeps several transactions waiting
+        on state at once without a worker pool.
+        """
+        self.start_processor(AsyncFunctionHandler(get_own_address_async))
+        self.register()
+
+        correlation_ids = {self.send_process_request() for _ in range(3)}
+
+        get_requests = [self.recv() for _ in range(3)]
+        for message in get_requests:
+            self.assertEqual(
+                message.message_type, Message.TP_STATE_GET_REQUEST)
+            request = TpStateGetRequest()
+            request.ParseFromString(message.content)
+            self.send(
+                Message.TP_STATE_GET_RESPONSE,
+                TpStateGetResponse(
+                    status=TpStateGetResponse.OK,
+                    entries=[TpStateEntry(address=request.addresses[0])]),
+                correlation_id=message.correlation_id)
+
+        responses = [self.recv() for _ in range(3)]
+        self.assertEqual(
+            {message.correlation_id for message in responses},
+            correlation_ids)
+
+    def test_async_handler_without_state_cache(self):
+        """Tests that starting with an async handler and features it does
+        without, such as the state cache, logs a warning.
+        """
+        self.processor = TransactionProcessor(self.url)
+        self.processor.add_handler(AsyncFunctionHandler(get_own_address_async))
+        self.processor.enable_state_cache(write_back=True)
+        self.processor.enable_memoization()
+        with self.assertLogs(core.LOGGER, 'WARNING') as logs:
+            threading.Thread(
+                target=self.processor.start, daemon=True).start()
+            self.register()
+        self.assertEqual(
+            logs.records[0].getMessage(),
+            'Async handlers are applied without state cache, memoization')
+
+    def test_unhandled_error_in_async_handler(self):
+        """Tests that a transaction whose async handler fails unexpectedly
+        is answered with INTERNAL_ERROR.
+        """
+        self.start_processor(AsyncFunctionHandler(fail_async))
+        self.register()
+
+        correlation_id = self.send_process_request()
+        message = self.recv()
+        self.assertEqual(message.correlation_id, correlation_id)
+        response = TpProcessResponse()
+        response.ParseFromString(message.content)
+        self.assertEqual(response.status, TpProcessResponse.INTERNAL_ERROR)
+
+    def test_zero_copy(self):
+        """Tests that transactions and the responses to their state
+        requests are processed when parsed from ZMQ's frames without
+        copying them.
+        """
+        self.processor = TransactionProcessor(self.url)
+        self.processor.enable_zero_copy()
+        self.processor.add_handler(FunctionHandler(get_own_address))
+        threading.Thread(target=self.processor.start, daemon=True).start()
+        self.register()
+
+        for _ in range(2):
+            process_id = self.send_process_request()
+            self.answer(
+                Message.TP_STATE_GET_REQUEST,
+                TpStateGetResponse(status=TpStateGetResponse.OK))
+            message = self.recv()
+            self.assertEqual(message.correlation_id, process_id)
+            response = TpProcessResponse()
+            response.ParseFromString(message.content)
+            self.assertEqual(response.status, TpProcessResponse.OK)
+
+    def test_ping_while_applying(self):
+        """Tests that a ping is answered while the only thread applying
+        transactions is busy.
+        """
+        barrier = threading.Barrier(2, timeout=5)
+        self.start_processor(FunctionHandler(wait_at(barrier)))
+        self.register()
+
+        process_id = self.send_process_request()
+        ping_id = self.send(Message.PING_REQUEST, PingRequest())
+
+        message = self.recv()
+        self.assertEqual(message.message_type, Message.PING_RESPONSE)
+        self.assertEqual(message.correlation_id, ping_id)
+
+        # let the transaction finish
+        barrier.wait()
+        message = self.recv()
+        self.assertEqual(message.message_type, Message.TP_PROCESS_RESPONSE)
+        self.assertEqual(message.correlation_id, process_id)
+
+    def test_tracing(self):
+        """Tests that a transaction is traced with a span for each state
+        request and for its response.
+        """
+        spans = []
+
+        class ListExporter(tracing.SpanExporter):
+            def export(self, span):
+                spans.append(span)
+
+        self.processor = TransactionProcessor(self.url)
+        self.processor.enable_tracing(ListExporter())
+        self.processor.add_handler(FunctionHandler(get_own_address))
+        threading.Thread(target=self.processor.start, daemon=True).start()
+        self.register()
+
+        process_id = self.send_process_request()
+        message = self.recv()
+        self.assertEqual(message.message_type, Message.TP_STATE_GET_REQUEST)
+        self.send(
+            Message.TP_STATE_GET_RESPONSE,
+            TpStateGetResponse(status=TpStateGetResponse.OK),
+            correlation_id=message.correlation_id)
+        message = self.recv()
+        self.assertEqual(message.correlation_id, process_id)
+
+        deadline = time.monotonic() + 5
+        while len(spans) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(
+            [span.name for span in spans],
+            ['context.get', 'send_back', 'tp_process'])
+        root = spans[-1]
+        self.assertEqual(
+            {span.parent_id for span in spans[:-1]}, {root.span_id})
+        self.assertEqual(root.attributes['status'], 'OK')
+        self.assertEqual(root.attributes['context_id'], 'context')
+
+    def test_memoization(self):
+        """Tests that a transaction sent again is replayed without calling
+        its deterministic handler, unless the state it read has changed.
+        """
+        self.check_memoization(state_cache=False)
+
+    def test_memoization_with_state_cache(self):
+        """Tests that when the state read by a memoized execution has
+        changed, the handler's reads answered from the state cache by the
+        replay's check are memoized with its new execution.
+        """
+        self.check_memoization(state_cache=True)
+
+    def check_memoization(self, state_cache):
+        handler = FunctionHandler(copy_source, deterministic=True)
+        self.processor = TransactionProcessor(self.url)
+        memo = self.processor.enable_memoization()
+        if state_cache:
+            self.processor.enable_state_cache()
+        self.processor.add_handler(handler)
+        threading.Thread(target=self.processor.start, daemon=True).start()
+        self.register()
+
+        def process(source_data, gets=1):
+            process_id = self.send_process_request('sig')
+            for _ in range(gets):
+                self.answer(
+                    Message.TP_STATE_GET_REQUEST,
+                    TpStateGetResponse(
+                        status=TpStateGetResponse.OK,
+                        entries=[
+                            TpStateEntry(address=SOURCE, data=source_data)
+                        ]))
+            message = self.answer(
+                Message.TP_STATE_SET_REQUEST,
+                TpStateSetResponse(
+                    status=TpStateSetResponse.OK, addresses=[DESTINATION]))
+            set_request = TpStateSetRequest()
+            set_request.ParseFromString(message.content)
+            message = self.answer(
+                Message.TP_EVENT_ADD_REQUEST,
+                TpEventAddResponse(status=TpEventAddResponse.OK))
+            event_request = TpEventAddRequest()
+            event_request.ParseFromString(message.content)
+            message = self.recv()
+            self.assertEqual(message.correlation_id, process_id)
+            response = TpProcessResponse()
+            response.ParseFromString(message.content)
+            self.assertEqual(response.status, TpProcessResponse.OK)
+            self.assertEqual(event_request.event.event_type, 'test/copied')
+            return set_request.entries[0].data
+
+        self.assertEqual(process(b'1'), b'1')
+        self.assertEqual(handler.calls, 1)
+        # the replay checks the source, then repeats the set and event
+        self.assertEqual(process(b'1'), b'1')
+        self.assertEqual(handler.calls, 1)
+        # the replay's check fails, so the handler reads the source itself,
+        # from the cache if it is enabled
+        gets = 1 if state_cache else 2
+        self.assertEqual(process(b'2', gets=gets), b'2')
+        self.assertEqual(handler.calls, 2)
+        # the read is memoized with the new execution either way
+        self.assertEqual(process(b'3', gets=gets), b'3')
+        self.assertEqual(handler.calls, 3)
+
+        self.assertAlmostEqual(memo.hit_rate, 1 / 4)
+        for result, count in (('miss', 1), ('hit', 1), ('stale', 2)):
+            self.assertEqual(
+                self.processor.metrics.counter(
+                    'tp_memo_lookups_total', result=result).value,
+                count)
+
+    def test_admission_control(self):
+        """Tests that a request received while max_queued are waiting for
+        the handler is answered with INTERNAL_ERROR, to be retried.
+        """
+        self.start_processor(FunctionHandler(get_own_address))
+        self.processor.enable_admission_control(1)
+        self.register()
+
+        first_id = self.send_process_request()
+        get_request = self.recv()
+        self.assertEqual(
+            get_request.message_type, Message.TP_STATE_GET_REQUEST)
+        second_id = self.send_process_request()
+        third_id = self.send_process_request()
+
+        message = self.recv()
+        self.assertEqual(message.correlation_id, third_id)
+        response = TpProcessResponse()
+        response.ParseFromString(message.content)
+        self.assertEqual(response.status, TpProcessResponse.INTERNAL_ERROR)
+
+        self.send(
+            Message.TP_STATE_GET_RESPONSE,
+            TpStateGetResponse(status=TpStateGetResponse.OK),
+            correlation_id=get_request.correlation_id)
+        self.assertEqual(self.recv().correlation_id, first_id)
+        self.answer(
+            Message.TP_STATE_GET_REQUEST,
+            TpStateGetResponse(status=TpStateGetResponse.OK))
+        self.assertEqual(self.recv().correlation_id, second_id)
+
+    def test_async_admission_control(self):
+        """Tests that a request received while max_queued are being applied
+        by an async handler is answered with INTERNAL_ERROR, to be retried.
+        """
+        self.processor = TransactionProcessor(self.url)
+        self.processor.add_handler(AsyncFunctionHandler(get_own_address_async))
+        self.processor.enable_admission_control(2)
+        threading.Thread(target=self.processor.start, daemon=True).start()
+        self.register()
+
+        applying = [self.send_process_request() for _ in range(2)]
+        get_requests = [self.recv() for _ in range(2)]
+        for request in get_requests:
+            self.assertEqual(
+                request.message_type, Message.TP_STATE_GET_REQUEST)
+        rejected_id = self.send_process_request()
+
+        message = self.recv()
+        self.assertEqual(message.correlation_id, rejected_id)
+        response = TpProcessResponse()
+        response.ParseFromString(message.content)
+        self.assertEqual(response.status, TpProcessResponse.INTERNAL_ERROR)
+        self.assertEqual(
+            self.processor.metrics.counter('tp_async_rejected_total').value,
+            1)
+
+        for request in get_requests:
+            self.send(
+                Message.TP_STATE_GET_RESPONSE,
+                TpStateGetResponse(status=TpStateGetResponse.OK),
+                correlation_id=request.correlation_id)
+        self.assertEqual(
+            sorted(self.recv().correlation_id for _ in range(2)),
+            sorted(applying))
+
+        # once they have been answered, further requests are applied
+        self.send_process_request()
+        self.assertEqual(
+            self.recv().message_type, Message.TP_STATE_GET_REQUEST)
+
+    def test_deadline(self):
+        """Tests that a transaction still being applied at its deadline is
+        answered with INTERNAL_ERROR, and that the worker applying it is
+        replaced, so that the next transaction is processed, until
+        max_stuck_workers are stuck.
+        """
+        released = threading.Event()
+        handler = FunctionHandler(stuck_until(released))
+        self.processor = TransactionProcessor(self.url, max_workers=1)
+        self.processor.enable_deadline(0.2, max_stuck_workers=1)
+        self.processor.add_handler(handler)
+        threading.Thread(target=self.processor.start, daemon=True).start()
+        self.register()
+
+        def answered(correlation_id, status):
+            message = self.recv()
+            self.assertEqual(message.correlation_id, correlation_id)
+            response = TpProcessResponse()
+            response.ParseFromString(message.content)
+            self.assertEqual(response.status, status)
+
+        answered(self.send_process_request('stuck'),
+                 TpProcessResponse.INTERNAL_ERROR)
+        answered(self.send_process_request(), TpProcessResponse.OK)
+
+        # the second stuck worker is not replaced
+        answered(self.send_process_request('stuck'),
+                 TpProcessResponse.INTERNAL_ERROR)
+        process_id = self.send_process_request()
+        self.socket.setsockopt(zmq.RCVTIMEO, 300)
+        with self.assertRaises(zmq.Again):
+            self.recv()
+        stuck = self.processor.metrics.gauge('tp_workers_stuck')
+        self.assertEqual(stuck.value, 2)
+
+        # once they return, the stuck transactions are not answered again
+        released.set()
+        self.socket.setsockopt(zmq.RCVTIMEO, 5000)
+        answered(process_id, TpProcessResponse.OK)
+        self.socket.setsockopt(zmq.RCVTIMEO, 300)
+        with self.assertRaises(zmq.Again):
+            self.recv()
+        self.assertEqual(stuck.value, 0)
+        self.assertEqual(
+            self.processor.metrics.counter(
+                'tp_workers_quarantined_total').value, 2)
+        self.assertLessEqual(
+            sum(thread.name.startswith('TransactionProcessorWorker')
+                for thread in threading.enumerate()), 2)
+
+    def test_async_deadline(self):
+        """Tests that an async handler still applying a transaction at its
+        deadline is cancelled, rather than counted stuck, so that its slot
+        is freed for the next transaction.
+        """
+        self.processor = TransactionProcessor(self.url, max_workers=1)
+        self.processor.enable_deadline(0.2, max_stuck_workers=0)
+        self.processor.add_handler(AsyncFunctionHandler(get_own_address_async))
+        threading.Thread(target=self.processor.start, daemon=True).start()
+        self.register()
+
+        process_id = self.send_process_request()
+        self.assertEqual(
+            self.recv().message_type, Message.TP_STATE_GET_REQUEST)
+        message = self.recv()
+        self.assertEqual(message.correlation_id, process_id)
+        response = TpProcessResponse()
+        response.ParseFromString(message.content)
+        self.assertEqual(response.status, TpProcessResponse.INTERNAL_ERROR)
+
+        self.send_process_request()
+        self.assertEqual(
+            self.recv().message_type, Message.TP_STATE_GET_REQUEST)
+        self.assertEqual(
+            self.processor.metrics.gauge('tp_workers_stuck').value, 0)
+        self.assertEqual(
+            self.processor.metrics.counter(
+                'tp_workers_quarantined_total').value, 0)
+
+    def test_stop_twice(self):
+        """Tests that stopping a processor that has already stopped, as
+        start does when registering fails, does nothing.
+        """
+        stops = []
+
+        class Exporter(MetricsExporter):
+            def start(self, registry):
+                pass
+
+            def stop(self):
+                stops.append(self)
+
+        self.processor = TransactionProcessor(self.url)
+        self.processor.add_metrics_exporter(Exporter())
+        self.processor.stop()
+        self.processor.stop()
+        self.assertEqual(len(stops), 1)
+
+    def test_invalid_max_workers(self):
+        with self.assertRaises(ValueError):
+            TransactionProcessor(self.url, max_workers=0)
+
+
+def generate_correlation_id():
+    return ''.join(random.choice(string.ascii_letters) for _ in range(16))
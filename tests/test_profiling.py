@@ -0,0 +1,79 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import pstats
+import tempfile
+import time
+import unittest
+
+from sawtooth_sdk.processor.profiling import ApplyProfiler
+
+
+def busy(results):
+    # sleeps so that the sampling thread gets to run
+    for _ in range(5):
+        time.sleep(0.005)
+    results.append(None)
+
+
+class TestApplyProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = ApplyProfiler(output_dir=self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sampling(self):
+        """Tests that every Nth call is profiled, and that the results are
+        written as pstats and collapsed stacks.
+        """
+        results = []
+        self.assertEqual(self.profiler.dump(), [])
+
+        self.profiler.set_sampling(2)
+        for _ in range(4):
+            self.profiler.call(busy, results)
+        self.profiler.set_sampling(0)
+        self.profiler.call(busy, results)
+        self.assertEqual(len(results), 5)
+
+        paths = self.profiler.dump()
+        self.assertEqual(
+            [path.rsplit('.', 1)[1] for path in paths],
+            ['pstats', 'collapsed'])
+        # pylint: disable=no-member
+        stats = pstats.Stats(paths[0]).stats
+        # each value starts with the primitive and total number of calls
+        self.assertEqual(
+            [calls for (_, _, name), (_, calls, *_) in stats.items()
+             if name == 'busy'],
+            [2])
+
+        with open(paths[1]) as collapsed:
+            stacks = [line.rsplit(' ', 1) for line in collapsed]
+        self.assertTrue(stacks)
+        for stack, count in stacks:
+            self.assertTrue(stack.startswith('busy ('))
+            self.assertGreater(int(count), 0)
+
+    def test_window(self):
+        results = []
+        self.profiler.start_window(10)
+        self.profiler.call(busy, results)
+        self.profiler.stop()
+        # stopping ends the window and writes the results
+        self.profiler.call(busy, results)
+        self.assertEqual(self.profiler.dump(), [])
@@ -0,0 +1,319 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import threading
+import time
+import unittest
+
+import zmq
+
+from sawtooth_sdk.messaging.exceptions import ValidatorConnectionError
+from sawtooth_sdk.messaging.stream import RECONNECT_EVENT
+from sawtooth_sdk.messaging.stream import Stream
+from sawtooth_sdk.processor.core import TransactionProcessor
+from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
+from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterRequest
+from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterResponse
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+def bind(context, url='tcp://127.0.0.1:*'):
+    """Returns a ROUTER socket bound to url, retrying while the port is
+    still held by a socket being closed.
+    """
+    deadline = time.monotonic() + 5
+    while True:
+        socket = context.socket(zmq.ROUTER)
+        socket.setsockopt(zmq.RCVTIMEO, 5000)
+        try:
+            socket.bind(url)
+            return socket
+        except zmq.ZMQError:
+            socket.close(linger=0)
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+class FlakyValidator:
+    """A ROUTER stand-in for the validator that answers every request
+    with an empty response, and drops every connection when asked to.
+    """
+
+    def __init__(self):
+        self._context = zmq.Context()
+        self._socket = bind(self._context)
+        self.url = self._socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self._drops = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def drop(self):
+        """Closes the validator's socket, dropping the connection, and
+        binds a new one to the same address.
+        """
+        self._drops += 1
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join()
+        self._socket.close(linger=0)
+        self._context.term()
+
+    def _run(self):
+        drops = 0
+        request = Message()
+        while not self._stopped:
+            if drops < self._drops:
+                drops += 1
+                self._socket.close(linger=0)
+                self._socket = bind(self._context, self.url)
+            if not self._socket.poll(10):
+                continue
+            identity, message_bytes = self._socket.recv_multipart()
+            request.ParseFromString(message_bytes)
+            self._socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.PING_RESPONSE,
+                    correlation_id=request.correlation_id
+                ).SerializeToString()])
+
+
+def answer_registration(socket, requests=None,
+                        status=TpRegisterResponse.OK):
+    """Answers a processor's two register requests, once both have
+    arrived, and returns the versions registered and the processor's
+    identity.
+    """
+    if requests is None:
+        requests = [socket.recv_multipart() for _ in range(2)]
+    versions = []
+    identity = None
+    for identity, message_bytes in requests:
+        message = Message()
+        message.ParseFromString(message_bytes)
+        register = TpRegisterRequest()
+        register.ParseFromString(message.content)
+        versions.append(register.version)
+        socket.send_multipart([
+            identity,
+            Message(
+                message_type=Message.TP_REGISTER_RESPONSE,
+                correlation_id=message.correlation_id,
+                content=TpRegisterResponse(
+                    status=status
+                ).SerializeToString()
+            ).SerializeToString()])
+    return sorted(versions), identity
+
+
+def process(socket, identity, correlation_id):
+    """Sends a processor a TP_PROCESS_REQUEST, and returns the correlation
+    id and status of the response.
+    """
+    socket.send_multipart([
+        identity,
+        Message(
+            message_type=Message.TP_PROCESS_REQUEST,
+            correlation_id=correlation_id,
+            content=TpProcessRequest(
+                header=TransactionHeader(
+                    family_name='test',
+                    family_version='1.0'),
+                context_id='context'
+            ).SerializeToString()
+        ).SerializeToString()])
+    _, message_bytes = socket.recv_multipart()
+    message = Message()
+    message.ParseFromString(message_bytes)
+    response = TpProcessResponse()
+    response.ParseFromString(message.content)
+    return message.correlation_id, response.status
+
+
+class TwoVersionHandler(TransactionHandler):
+    # pylint: disable=invalid-overridden-method
+    @property
+    def family_name(self):
+        return 'test'
+
+    @property
+    def family_versions(self):
+        return ['1.0', '2.0']
+
+    @property
+    def namespaces(self):
+        return ['abcdef']
+
+    def apply(self, transaction, context):
+        pass
+
+
+class TestReconnect(unittest.TestCase):
+
+    def test_drops_under_load(self):
+        """Tests that, while requests are being sent, each dropped
+        connection fails the requests outstanding at once, and is
+        reconnected, with receivers told, so that requests succeed again.
+        """
+        validator = FlakyValidator()
+        self.addCleanup(validator.stop)
+        stream = Stream(
+            validator.url, reconnect_interval=0.01,
+            max_reconnect_interval=0.1)
+        self.addCleanup(stream.close)
+        outcomes = {'ok': 0, 'failed': 0, 'timed out': 0}
+        stopped = threading.Event()
+
+        def load():
+            while not stopped.is_set():
+                try:
+                    futures = [
+                        stream.send(Message.PING_REQUEST, b'')
+                        for _ in range(20)
+                    ]
+                except ValidatorConnectionError:
+                    outcomes['failed'] += 1
+                    time.sleep(0.001)
+                    continue
+                for future in futures:
+                    try:
+                        future.result(5).message_type
+                    except ValidatorConnectionError:
+                        outcomes['failed'] += 1
+                    except Exception:  # pylint: disable=broad-except
+                        outcomes['timed out'] += 1
+                    else:
+                        outcomes['ok'] += 1
+
+        thread = threading.Thread(target=load)
+        thread.start()
+        try:
+            for _ in range(3):
+                time.sleep(0.2)
+                validator.drop()
+                self.assertIs(stream.receive().result(5), RECONNECT_EVENT)
+            time.sleep(0.2)
+        finally:
+            stopped.set()
+            thread.join()
+
+        self.assertEqual(outcomes['timed out'], 0)
+        self.assertGreater(outcomes['ok'], 0)
+        self.assertEqual(
+            stream.send(Message.PING_REQUEST, b'').result(5).message_type,
+            Message.PING_RESPONSE)
+        self.assertEqual(
+            stream.metrics.counter('stream_reconnects_total').value, 3)
+        self.assertEqual(
+            stream.metrics.histogram('stream_reconnect_seconds').count, 3)
+
+    def test_reregistration(self):
+        """Tests that a processor registers every family version again,
+        all at once, after the connection drops.
+        """
+        context = zmq.Context()
+        socket = bind(context)
+        url = socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        processor = TransactionProcessor(url)
+        processor.add_handler(TwoVersionHandler())
+        threading.Thread(target=processor.start, daemon=True).start()
+        try:
+            for _ in range(2):
+                # Both requests are sent before either is answered.
+                versions, _ = answer_registration(socket)
+                self.assertEqual(versions, ['1.0', '2.0'])
+
+                socket.close(linger=0)
+                socket = bind(context, url)
+        finally:
+            processor.stop()
+            socket.close(linger=0)
+            context.term()
+
+    def test_failover(self):
+        """Tests that a processor serving two validators registers with
+        each, goes on answering one while the other is down, and registers
+        with the other again once it is back.
+        """
+        context = zmq.Context()
+        sockets = [bind(context), bind(context)]
+        urls = [socket.getsockopt_string(zmq.LAST_ENDPOINT)
+                for socket in sockets]
+        processor = TransactionProcessor(urls)
+        processor.add_handler(TwoVersionHandler())
+        threading.Thread(target=processor.start, daemon=True).start()
+        try:
+            identities = []
+            for socket in sockets:
+                versions, identity = answer_registration(socket)
+                self.assertEqual(versions, ['1.0', '2.0'])
+                identities.append(identity)
+
+            sockets[0].close(linger=0)
+            for i in range(2):
+                self.assertEqual(
+                    process(sockets[1], identities[1], str(i)),
+                    (str(i), TpProcessResponse.OK))
+
+            sockets[0] = bind(context, urls[0])
+            versions, _ = answer_registration(sockets[0])
+            self.assertEqual(versions, ['1.0', '2.0'])
+            self.assertEqual(
+                processor.metrics.counter(
+                    'stream_reconnects_total', validator=urls[0]).value, 1)
+            self.assertEqual(
+                processor.metrics.counter(
+                    'stream_reconnects_total', validator=urls[1]).value, 0)
+        finally:
+            processor.stop()
+            for socket in sockets:
+                socket.close(linger=0)
+            context.term()
+
+    def test_registration_failure(self):
+        """Tests that a processor serving two validators serves one while
+        the other is slow to answer its registration, and goes on serving
+        it once the other refuses the registration.
+        """
+        context = zmq.Context()
+        sockets = [bind(context), bind(context)]
+        urls = [socket.getsockopt_string(zmq.LAST_ENDPOINT)
+                for socket in sockets]
+        processor = TransactionProcessor(urls)
+        processor.add_handler(TwoVersionHandler())
+        threading.Thread(target=processor.start, daemon=True).start()
+        try:
+            requests = [sockets[0].recv_multipart() for _ in range(2)]
+            _, identity = answer_registration(sockets[1])
+            self.assertEqual(
+                process(sockets[1], identity, 'slow'),
+                ('slow', TpProcessResponse.OK))
+
+            answer_registration(
+                sockets[0], requests, status=TpRegisterResponse.ERROR)
+            self.assertEqual(
+                process(sockets[1], identity, 'refused'),
+                ('refused', TpProcessResponse.OK))
+        finally:
+            processor.stop()
+            for socket in sockets:
+                socket.close(linger=0)
+            context.term()
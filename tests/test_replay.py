@@ -0,0 +1,133 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import os
+import tempfile
+import threading
+import unittest
+
+from sawtooth_sdk.messaging.capture import CaptureWriter
+from sawtooth_sdk.messaging.capture import INBOUND
+from sawtooth_sdk.messaging.capture import OUTBOUND
+from sawtooth_sdk.processor.core import TransactionProcessor
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessResponse
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateGetRequest
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateGetResponse
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+from sawtooth_processor_test.replay import Capture
+from sawtooth_processor_test.replay import Replayer
+
+
+class RequireStateHandler(TransactionHandler):
+    """Handler for which a transaction is valid if there is state at the
+    address named by its signature.
+    """
+
+    # pylint: disable=invalid-overridden-method
+    @property
+    def family_name(self):
+        return 'test'
+
+    @property
+    def family_versions(self):
+        return ['1.0']
+
+    @property
+    def namespaces(self):
+        return ['abcdef']
+
+    def apply(self, transaction, context):
+        if not context.get_state(['abcdef' + transaction.signature]):
+            raise InvalidTransaction('no state')
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'capture')
+        self.processor = None
+
+    def tearDown(self):
+        if self.processor is not None:
+            self.processor.stop()
+        self.directory.cleanup()
+
+    def write_capture(self, transactions):
+        """Writes a capture of transactions, a list of (state, status)
+        pairs giving the data at the address each transaction reads, and
+        the status of the response to it.
+        """
+        capture = CaptureWriter(self.path)
+
+        def record(direction, message_type, correlation_id, content):
+            capture.record(direction, message_type, Message(
+                message_type=message_type,
+                correlation_id=correlation_id,
+                content=content.SerializeToString()).SerializeToString())
+
+        for i, (data, status) in enumerate(transactions):
+            context_id = 'context{}'.format(i)
+            signature = 'signature{}'.format(i)
+            record(INBOUND, Message.TP_PROCESS_REQUEST, 'process{}'.format(i),
+                   TpProcessRequest(
+                       header=TransactionHeader(
+                           family_name='test', family_version='1.0'),
+                       context_id=context_id,
+                       signature=signature))
+            address = 'abcdef' + signature
+            record(OUTBOUND, Message.TP_STATE_GET_REQUEST, 'get{}'.format(i),
+                   TpStateGetRequest(
+                       context_id=context_id, addresses=[address]))
+            record(INBOUND, Message.TP_STATE_GET_RESPONSE, 'get{}'.format(i),
+                   TpStateGetResponse(
+                       status=TpStateGetResponse.OK,
+                       entries=[TpStateEntry(address=address, data=data)]))
+            record(OUTBOUND, Message.TP_PROCESS_RESPONSE,
+                   'process{}'.format(i), TpProcessResponse(status=status))
+        capture.close()
+
+    def test_replay(self):
+        """Tests that a processor is given the captured state, and that a
+        change in the outcome of a transaction is reported.
+        """
+        self.write_capture([
+            (b'1', TpProcessResponse.OK),
+            (b'', TpProcessResponse.INVALID_TRANSACTION),
+            # processed differently than when captured
+            (b'', TpProcessResponse.OK),
+        ])
+        replayer = Replayer(Capture(self.path), 'tcp://127.0.0.1:*')
+        try:
+            self.processor = TransactionProcessor(replayer.url)
+            self.processor.add_handler(RequireStateHandler())
+            threading.Thread(
+                target=self.processor.start, daemon=True).start()
+
+            replayer.wait_for_processor(timeout=5, settle=0.1)
+            report = replayer.run(window=2)
+        finally:
+            replayer.close()
+
+        self.assertEqual(len(report.latencies), 3)
+        self.assertEqual(report.mismatched, 1)
+        self.assertEqual(report.unanswered, 0)
+        self.assertGreater(report.throughput, 0)
+        self.assertEqual(report.percentile(100), max(report.latencies))
@@ -0,0 +1,145 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.transaction_pb2 import Transaction
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from sawtooth_processor_test.scheduler import critical_path
+from sawtooth_processor_test.scheduler import read_batch_list
+from sawtooth_processor_test.scheduler import simulate
+from sawtooth_processor_test.scheduler import simulate_pool
+
+
+A = 'abcdef' + 'a' * 64
+B = 'abcdef' + 'b' * 64
+C = 'abcdef' + 'c' * 64
+
+
+class CopyHandler(TransactionHandler):
+    """Copies the data at its first input to its first output, or sets it
+    to the payload when they are the same. An empty payload is invalid.
+    """
+
+    # pylint: disable=invalid-overridden-method
+    @property
+    def family_name(self):
+        return 'copy'
+
+    @property
+    def family_versions(self):
+        return ['1.0']
+
+    @property
+    def namespaces(self):
+        return ['abcdef']
+
+    def apply(self, transaction, context):
+        if not transaction.payload:
+            raise InvalidTransaction('empty payload')
+        header = transaction.header
+        if not header.outputs:
+            return
+        if header.inputs and header.inputs[0] != header.outputs[0]:
+            data = context.get_state([header.inputs[0]])[0].data
+        else:
+            data = transaction.payload
+        context.set_state({header.outputs[0]: data})
+
+
+def make_transaction(name, inputs, outputs, payload=b'x', dependencies=()):
+    header = TransactionHeader(
+        family_name='copy',
+        family_version='1.0',
+        inputs=inputs,
+        outputs=outputs,
+        dependencies=dependencies)
+    return Transaction(
+        header=header.SerializeToString(),
+        header_signature=name,
+        payload=payload)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        batch_list = BatchList(batches=[
+            Batch(transactions=[
+                make_transaction('set-a', [A], [A], b'1'),
+                make_transaction('set-b', [B], [B], b'2'),
+            ]),
+            Batch(transactions=[
+                make_transaction('copy-a', [A], [C]),
+            ]),
+            Batch(transactions=[
+                make_transaction('set-b-again', [B], [B], b'3'),
+                make_transaction('invalid', [], ['abcdef'], b''),
+            ]),
+            Batch(transactions=[
+                make_transaction('after-b', [], [], b'4',
+                                 dependencies=['set-b']),
+            ]),
+        ])
+        handle, self.path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as batch_file:
+            batch_file.write(batch_list.SerializeToString())
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_simulate(self):
+        """Tests that the conflict graph follows the validator's rules, and
+        that the scheduled run leaves the state of the serial one.
+        """
+        transactions = read_batch_list(self.path)
+        report = simulate([CopyHandler()], transactions, workers=[1, 2])
+
+        self.assertEqual(
+            [sorted(transaction.predecessors)
+             for transaction in transactions],
+            # copy-a reads set-a's output, set-b-again writes set-b's,
+            # the prefix write follows the last writer and readers of each
+            # address under it, and after-b depends on set-b.
+            [[], [], [0], [1], [0, 2, 3], [1]])
+        self.assertEqual(report.transactions, 6)
+        self.assertEqual(report.batches, 4)
+        self.assertEqual(report.invalid_batches, 1)
+        self.assertTrue(report.serializable)
+        self.assertEqual(report.critical_length, 3)
+        self.assertEqual(report.hotspots[0], (A, 3))
+        self.assertIn('dependencies', dict(report.hotspots))
+        self.assertLessEqual(report.makespans[2], report.makespans[1])
+        self.assertIn('2 workers', report.format())
+
+    def test_pool(self):
+        """Tests the simulated pool and critical path on known durations.
+        """
+        transactions = read_batch_list(self.path)
+        simulate([CopyHandler()], transactions)
+        durations = [1.0, 2.0, 1.0, 1.0, 1.0, 1.0]
+
+        self.assertEqual(
+            simulate_pool(transactions, durations, 1), sum(durations))
+        # set-a and set-b, then copy-a and after-b while set-b-again waits
+        # for set-b, then the prefix write.
+        self.assertEqual(simulate_pool(transactions, durations, 2), 4.0)
+        self.assertEqual(critical_path(transactions, durations), (4.0, 3))
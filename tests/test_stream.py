@@ -0,0 +1,312 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import concurrent.futures
+import os
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+import zmq
+
+from sawtooth_sdk.messaging.capture import CaptureWriter
+from sawtooth_sdk.messaging.capture import INBOUND
+from sawtooth_sdk.messaging.capture import OUTBOUND
+from sawtooth_sdk.messaging.capture import read_capture
+from sawtooth_sdk.messaging.stream import RECONNECT_EVENT
+from sawtooth_sdk.messaging.stream import Stream
+from sawtooth_sdk.messaging.stream import StreamGroup
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.ctx = zmq.Context.instance()
+        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.RCVTIMEO, 5000)
+        self.socket.bind('tcp://127.0.0.1:*')
+        self.url = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.stream = None
+
+    def tearDown(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.socket.close(linger=0)
+
+    def echo(self, count):
+        """Answers count requests with an empty response."""
+        for _ in range(count):
+            # pylint: disable=unbalanced-tuple-unpacking
+            identity, message_bytes = self.socket.recv_multipart()
+            request = Message()
+            request.ParseFromString(message_bytes)
+            self.socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.PING_RESPONSE,
+                    correlation_id=request.correlation_id
+                ).SerializeToString()])
+
+    def test_batched_send_and_receive(self):
+        """Tests that a burst of messages is delivered in batches no larger
+        than max_batch, and that each response resolves its own future.
+        """
+        self.stream = Stream(self.url, max_batch=4)
+
+        futures = [
+            self.stream.send(Message.PING_REQUEST, str(i).encode())
+            for i in range(20)
+        ]
+        self.echo(20)
+        for future in futures:
+            self.assertEqual(
+                future.result(5).message_type, Message.PING_RESPONSE)
+
+        for name in ('stream_send_batch_size', 'stream_receive_batch_size'):
+            histogram = self.stream.metrics.histogram(name)
+            self.assertEqual(histogram.sum, 20)
+            self.assertEqual(dict(histogram.buckets())[4], histogram.count)
+
+    def test_receive(self):
+        """Tests that requests from the validator are received in order,
+        and that waiting for one times out when none arrives.
+        """
+        self.stream = Stream(self.url)
+        # the first message identifies the stream to the ROUTER socket
+        self.stream.send(Message.PING_REQUEST, b'')
+        # pylint: disable=unbalanced-tuple-unpacking
+        identity, _ = self.socket.recv_multipart()
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.stream.receive().result(0.1)
+
+        for i in range(3):
+            self.socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.TP_PROCESS_REQUEST,
+                    correlation_id=str(i).encode()
+                ).SerializeToString()])
+        received = [self.stream.receive().result(5) for _ in range(3)]
+        self.assertEqual(
+            [message.correlation_id for message in received],
+            ['0', '1', '2'])
+
+    def test_zero_copy(self):
+        """Tests that messages are received intact when parsed from ZMQ's
+        frames without copying them.
+        """
+        self.stream = Stream(self.url)
+        self.stream.set_zero_copy(True)
+        self.stream.send(Message.PING_REQUEST, b'')
+        # pylint: disable=unbalanced-tuple-unpacking
+        identity, _ = self.socket.recv_multipart()
+
+        content = os.urandom(1 << 20)
+        self.socket.send_multipart([
+            identity,
+            Message(
+                message_type=Message.TP_PROCESS_REQUEST,
+                correlation_id='large',
+                content=content
+            ).SerializeToString()])
+        message = self.stream.receive().result(5)
+        self.assertEqual(message.correlation_id, 'large')
+        self.assertEqual(message.content, content)
+
+    def test_zero_copy_content(self):
+        """Tests that, without copying, the content of a message received
+        is a view of ZMQ's memory, so that receiving a large message does
+        not allocate a copy of it.
+        """
+        self.stream = Stream(self.url)
+        self.stream.set_zero_copy(True)
+        ping = self.stream.send(Message.PING_REQUEST, b'')
+        # pylint: disable=unbalanced-tuple-unpacking
+        identity, request_bytes = self.socket.recv_multipart()
+        request = Message()
+        request.ParseFromString(request_bytes)
+        # once answered, the stream has stopped receiving the frame it was
+        # waiting for when zero copy was set
+        self.socket.send_multipart([
+            identity,
+            Message(
+                message_type=Message.PING_RESPONSE,
+                correlation_id=request.correlation_id
+            ).SerializeToString()])
+        ping.result(5)
+        message_bytes = Message(
+            message_type=Message.TP_PROCESS_REQUEST,
+            correlation_id='large',
+            content=os.urandom(4 << 20)
+        ).SerializeToString()
+
+        tracemalloc.start()
+        try:
+            self.socket.send_multipart([identity, message_bytes], copy=False)
+            message = self.stream.receive().result(5)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertIsInstance(message.content, memoryview)
+        self.assertEqual(message.message_type, Message.TP_PROCESS_REQUEST)
+        self.assertEqual(message.correlation_id, 'large')
+        self.assertLess(peak, 1 << 20)
+
+        parsed = Message()
+        parsed.ParseFromString(message_bytes)
+        self.assertEqual(message.content, parsed.content)
+
+    def test_admission_limit(self):
+        """Tests that messages received while max_queued are waiting are
+        passed to reject instead of being queued.
+        """
+        rejected = []
+
+        def reject(message):
+            rejected.append(message.correlation_id)
+            return True
+
+        self.stream = Stream(self.url)
+        self.stream.set_admission_limit(2, reject)
+        self.stream.send(Message.PING_REQUEST, b'')
+        # pylint: disable=unbalanced-tuple-unpacking
+        identity, _ = self.socket.recv_multipart()
+
+        for i in range(5):
+            self.socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.TP_PROCESS_REQUEST,
+                    correlation_id=str(i).encode()
+                ).SerializeToString()])
+        deadline = time.monotonic() + 5
+        while len(rejected) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(rejected, ['2', '3', '4'])
+        received = [self.stream.receive().result(5) for _ in range(2)]
+        self.assertEqual(
+            [message.correlation_id for message in received], ['0', '1'])
+        self.assertEqual(
+            self.stream.metrics.counter(
+                'stream_receive_rejected_total').value, 3)
+        self.assertEqual(
+            self.stream.metrics.histogram(
+                'stream_receive_queue_seconds').count, 2)
+
+    def test_answer_pings(self):
+        """Tests that pings are answered by the stream itself when
+        answer_pings is set, and not returned by receive.
+        """
+        self.stream = Stream(self.url, answer_pings=True)
+        self.stream.send(Message.PING_REQUEST, b'')
+        # pylint: disable=unbalanced-tuple-unpacking
+        identity, _ = self.socket.recv_multipart()
+
+        self.socket.send_multipart([
+            identity,
+            Message(
+                message_type=Message.PING_REQUEST,
+                correlation_id='ping'
+            ).SerializeToString()])
+        _, message_bytes = self.socket.recv_multipart()
+        response = Message()
+        response.ParseFromString(message_bytes)
+        self.assertEqual(response.message_type, Message.PING_RESPONSE)
+        self.assertEqual(response.correlation_id, 'ping')
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.stream.receive().result(0.1)
+        self.assertEqual(
+            self.stream.metrics.histogram(
+                'stream_ping_response_seconds').count, 1)
+
+    def test_capture(self):
+        """Tests that the messages of the captured types are recorded in
+        both directions.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'capture')
+            capture = CaptureWriter(path)
+            self.stream = Stream(self.url)
+            self.stream.set_capture(capture)
+
+            self.stream.send(Message.PING_REQUEST, b'')
+            future = self.stream.send(Message.TP_STATE_GET_REQUEST, b'get')
+            # pylint: disable=unbalanced-tuple-unpacking
+            self.socket.recv_multipart()
+            identity, message_bytes = self.socket.recv_multipart()
+            request = Message()
+            request.ParseFromString(message_bytes)
+            self.socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.TP_STATE_GET_RESPONSE,
+                    correlation_id=request.correlation_id,
+                    content=b'response'
+                ).SerializeToString()])
+            future.result(5)
+            capture.close()
+
+            records = list(read_capture(path))
+
+        self.assertEqual(
+            [(record.direction, record.message.message_type,
+              record.message.content) for record in records],
+            [(OUTBOUND, Message.TP_STATE_GET_REQUEST, b'get'),
+             (INBOUND, Message.TP_STATE_GET_RESPONSE, b'response')])
+
+    def test_stream_group(self):
+        """Tests that a group receives the messages of each of its
+        validators, paired with the stream that received them, and that
+        each stream records its metrics under its validator's address.
+        """
+        other = self.ctx.socket(zmq.ROUTER)
+        other.setsockopt(zmq.RCVTIMEO, 5000)
+        other.bind('tcp://127.0.0.1:*')
+        self.addCleanup(other.close, linger=0)
+        urls = [self.url, other.getsockopt_string(zmq.LAST_ENDPOINT)]
+        group = StreamGroup(urls, connect_events=True)
+        self.addCleanup(group.close)
+
+        connected = [group.receive().result(5) for _ in range(2)]
+        self.assertEqual(
+            {stream.url for stream, _ in connected}, set(urls))
+        self.assertEqual(
+            [message for _, message in connected], [RECONNECT_EVENT] * 2)
+
+        for stream, socket in zip(group.streams, (self.socket, other)):
+            # the first message identifies the stream to the ROUTER socket
+            stream.send(Message.PING_REQUEST, b'')
+            # pylint: disable=unbalanced-tuple-unpacking
+            identity, _ = socket.recv_multipart()
+            socket.send_multipart([
+                identity,
+                Message(
+                    message_type=Message.TP_PROCESS_REQUEST,
+                    correlation_id=stream.url
+                ).SerializeToString()])
+            received, message = group.receive().result(5)
+            self.assertIs(received, stream)
+            self.assertEqual(message.correlation_id, stream.url)
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            group.receive().result(0.1)
+        for url in urls:
+            self.assertEqual(
+                group.metrics.histogram(
+                    'stream_send_batch_size', validator=url).count, 1)
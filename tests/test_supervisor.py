@@ -0,0 +1,206 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+import zmq
+
+from sawtooth_sdk.messaging.metrics import MetricsExporter
+from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.processor.supervisor import TransactionProcessorSupervisor
+from sawtooth_sdk.processor.tracing import JsonLinesSpanExporter
+from sawtooth_sdk.protobuf.processor_pb2 import TpRegisterResponse
+from sawtooth_sdk.protobuf.processor_pb2 import TpUnregisterResponse
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+
+class NoopHandler(TransactionHandler):
+    # pylint: disable=invalid-overridden-method
+    @property
+    def family_name(self):
+        return 'test'
+
+    @property
+    def family_versions(self):
+        return ['1.0']
+
+    @property
+    def namespaces(self):
+        return ['abcdef']
+
+    def apply(self, transaction, context):
+        pass
+
+
+class MarkerExporter(MetricsExporter):
+    """Creates a file once it is started."""
+
+    def __init__(self, path):
+        self._path = path
+
+    def start(self, registry):
+        open(self._path, 'w').close()
+
+    def stop(self):
+        pass
+
+
+class TestTransactionProcessorSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.ctx = zmq.Context.instance()
+        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.RCVTIMEO, 10000)
+        self.socket.bind('tcp://127.0.0.1:*')
+        self.url = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.supervisor = None
+        self.thread = None
+
+    def tearDown(self):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+            self.thread.join(10)
+        self.socket.close(linger=0)
+
+    def start_supervisor(self, processes, configure=None, restart_delay=0,
+                         max_restart_delay=60.0):
+        self.supervisor = TransactionProcessorSupervisor(
+            self.url, processes=processes, restart_delay=restart_delay,
+            drain_timeout=10, max_restart_delay=max_restart_delay)
+        self.supervisor.add_handler(NoopHandler())
+        if configure is not None:
+            configure(self.supervisor)
+        self.thread = threading.Thread(target=self.supervisor.start)
+        self.thread.start()
+
+    def answer(self, expected_type):
+        """Answers the next request, which must be of expected_type, and
+        returns the identity of the connection it came from.
+        """
+        # pylint: disable=unbalanced-tuple-unpacking
+        identity, message_bytes = self.socket.recv_multipart()
+        message = Message()
+        message.ParseFromString(message_bytes)
+        self.assertEqual(message.message_type, expected_type)
+
+        if expected_type == Message.TP_REGISTER_REQUEST:
+            response_type = Message.TP_REGISTER_RESPONSE
+            response = TpRegisterResponse(status=TpRegisterResponse.OK)
+        else:
+            response_type = Message.TP_UNREGISTER_RESPONSE
+            response = TpUnregisterResponse(status=TpUnregisterResponse.OK)
+        self.socket.send_multipart([
+            identity,
+            Message(
+                message_type=response_type,
+                correlation_id=message.correlation_id,
+                content=response.SerializeToString()
+            ).SerializeToString()])
+        return identity
+
+    def test_register_restart_and_drain(self):
+        """Tests that each worker registers with its own connection, that
+        a worker that is killed is started again, and that stopping the
+        supervisor unregisters every worker.
+        """
+        self.start_supervisor(processes=2)
+
+        identities = {
+            self.answer(Message.TP_REGISTER_REQUEST) for _ in range(2)
+        }
+        self.assertEqual(len(identities), 2)
+
+        os.kill(self.supervisor.pids[0], signal.SIGKILL)
+        identities.add(self.answer(Message.TP_REGISTER_REQUEST))
+        self.assertEqual(len(identities), 3)
+
+        self.supervisor.stop()
+        for _ in range(2):
+            self.assertIn(
+                self.answer(Message.TP_UNREGISTER_REQUEST), identities)
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.supervisor = None
+
+    def test_options_reach_each_worker(self):
+        """Tests that the metrics exporters, span exporters and capture
+        files of each worker are created in that worker, under its index.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def configure(supervisor):
+            supervisor.enable_admission_control(10)
+            supervisor.enable_memoization(100)
+            supervisor.add_metrics_exporter(
+                lambda index: MarkerExporter(
+                    os.path.join(directory, 'metrics.{}'.format(index))))
+            supervisor.enable_tracing(
+                lambda index: JsonLinesSpanExporter(
+                    os.path.join(directory, 'spans.{}'.format(index))))
+            supervisor.enable_capture(os.path.join(directory, 'capture'))
+
+        self.start_supervisor(processes=2, configure=configure)
+        for _ in range(2):
+            self.answer(Message.TP_REGISTER_REQUEST)
+
+        self.assertEqual(
+            sorted(os.listdir(directory)),
+            ['capture.0', 'capture.1', 'metrics.0', 'metrics.1',
+             'spans.0', 'spans.1'])
+
+        self.supervisor.stop()
+        for _ in range(2):
+            self.answer(Message.TP_UNREGISTER_REQUEST)
+        self.thread.join(10)
+        self.supervisor = None
+
+    def test_restart_backoff(self):
+        """Tests that a worker that keeps exiting as soon as it is started
+        is started again after a delay that doubles up to the most allowed.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        starts = os.path.join(directory, 'starts')
+
+        def crash(index):
+            # pylint: disable=unused-argument,protected-access
+            with open(starts, 'a') as out:
+                out.write('{}\n'.format(time.monotonic()))
+            os._exit(1)
+
+        self.start_supervisor(
+            processes=1,
+            configure=lambda s: s.add_metrics_exporter(crash),
+            restart_delay=0.2, max_restart_delay=0.4)
+        with self.assertLogs(
+                'sawtooth_sdk.processor.supervisor', 'WARNING'):
+            time.sleep(1.5)
+            self.supervisor.stop()
+            self.thread.join(10)
+        self.supervisor = None
+
+        with open(starts) as source:
+            times = [float(line) for line in source]
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        self.assertTrue(3 <= len(gaps) <= 5, gaps)
+        self.assertGreaterEqual(gaps[0], 0.2)
+        for gap in gaps[1:]:
+            self.assertGreaterEqual(gap, 0.4)
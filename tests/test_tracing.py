@@ -0,0 +1,162 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from sawtooth_sdk.processor import tracing
+
+
+class ListExporter(tracing.SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class TestTracing(unittest.TestCase):
+    def test_traced_children(self):
+        """Tests that traced() nests spans under the active span, and does
+        nothing without one.
+        """
+        exporter = ListExporter()
+        tracer = tracing.Tracer(exporter)
+
+        with tracing.traced('outside') as outside:
+            self.assertIsNone(outside)
+
+        root = tracer.start_span('tp_process', family='intkey')
+        with tracing.activate(root):
+            with tracing.traced('decode'):
+                with tracing.traced('inner', size=3):
+                    pass
+        root.end()
+        root.end()
+
+        self.assertEqual(
+            [span.name for span in exporter.spans],
+            ['inner', 'decode', 'tp_process'])
+        inner = exporter.spans[0]
+        decode = exporter.spans[1]
+        self.assertEqual(inner.parent_id, decode.span_id)
+        self.assertEqual(decode.parent_id, root.span_id)
+        self.assertEqual(
+            {span.trace_id for span in exporter.spans}, {root.trace_id})
+        self.assertEqual(inner.attributes, {'size': 3})
+
+    def test_json_lines_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spans.jsonl')
+            exporter = tracing.JsonLinesSpanExporter(path)
+            tracer = tracing.Tracer(exporter)
+            root = tracer.start_span('tp_process')
+            root.child('context.get').end()
+            root.end()
+            tracer.shutdown()
+
+            with open(path) as spans_file:
+                spans = [json.loads(line) for line in spans_file]
+
+        self.assertEqual(
+            [span['name'] for span in spans], ['context.get', 'tp_process'])
+        self.assertEqual(spans[0]['parent_id'], spans[1]['span_id'])
+
+    def test_http_exporter(self):
+        """Tests that spans are posted to a collector in the OTLP JSON
+        encoding.
+        """
+        bodies = []
+
+        class Collector(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # pylint: disable=invalid-name
+                length = int(self.headers['Content-Length'])
+                bodies.append(json.loads(self.rfile.read(length).decode()))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # pylint: disable=redefined-builtin
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Collector)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            exporter = tracing.HttpSpanExporter(
+                'http://127.0.0.1:{}/v1/traces'.format(
+                    server.server_address[1]))
+            tracer = tracing.Tracer(exporter)
+            root = tracer.start_span('tp_process', signature='abc')
+            root.child('send_back').end()
+            root.end()
+            tracer.shutdown()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        spans = [
+            span
+            for body in bodies
+            for resource in body['resourceSpans']
+            for scope in resource['scopeSpans']
+            for span in scope['spans']
+        ]
+        self.assertEqual(
+            [span['name'] for span in spans], ['send_back', 'tp_process'])
+        self.assertEqual(spans[0]['parentSpanId'], spans[1]['spanId'])
+        self.assertNotIn('parentSpanId', spans[1])
+        self.assertEqual(
+            spans[1]['attributes'],
+            [{'key': 'signature', 'value': {'stringValue': 'abc'}}])
+
+    def test_http_exporter_bounds_buffer(self):
+        """Tests that spans ending while the buffer is full are dropped and
+        counted, as are spans that cannot be sent.
+        """
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        exporter = tracing.HttpSpanExporter(
+            'http://127.0.0.1:{}/v1/traces'.format(port),
+            batch_size=10, interval=60.0, timeout=1.0, max_queue_size=3)
+        tracer = tracing.Tracer(exporter)
+        with self.assertLogs(tracing.LOGGER, 'WARNING'):
+            for _ in range(5):
+                tracer.start_span('tp_process').end()
+            self.assertEqual(exporter.dropped, 2)
+
+            tracer.shutdown()
+        self.assertEqual(exporter.dropped, 5)
+
+    def test_http_exporter_survives_errors(self):
+        """Tests that a batch that fails other than with an OSError is
+        dropped without stopping the spans that end later from being
+        handled.
+        """
+        exporter = tracing.HttpSpanExporter('not a url', batch_size=1)
+        tracer = tracing.Tracer(exporter)
+        with self.assertLogs(tracing.LOGGER, 'WARNING'):
+            tracer.start_span('first').end()
+            tracer.start_span('second').end()
+            tracer.shutdown()
+        self.assertEqual(exporter.dropped, 2)
@@ -0,0 +1,61 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import threading
+import time
+import unittest
+
+from sawtooth_sdk.processor.watchdog import Watchdog
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self):
+        self.watchdog = Watchdog()
+
+    def tearDown(self):
+        self.watchdog.stop()
+
+    def test_expired(self):
+        """Tests that only the watches not cancelled by their deadline
+        expire.
+        """
+        expired = []
+        done = threading.Event()
+
+        def on_expired(watch):
+            expired.append(watch)
+            done.set()
+
+        start = time.monotonic()
+        cancelled = self.watchdog.watch(start + 0.05, on_expired)
+        watch = self.watchdog.watch(start + 0.1, on_expired)
+        self.assertTrue(cancelled.cancel())
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(expired, [watch])
+        self.assertTrue(watch.expired)
+        self.assertFalse(watch.cancel())
+        self.assertFalse(cancelled.expired)
+
+    def test_cancelled_watches_dropped(self):
+        """Tests that cancelled watches do not accumulate until their
+        deadline.
+        """
+        deadline = time.monotonic() + 60
+        pending = self.watchdog.watch(deadline, lambda watch: None)
+        for _ in range(1000):
+            self.watchdog.watch(deadline, lambda watch: None).cancel()
+        self.assertLessEqual(len(self.watchdog), 3)
+        self.assertFalse(pending.expired)